@@ -0,0 +1,144 @@
+"""
+Measurement of the benchmarks (time and memory), and storage and comparison of their results.
+
+Each benchmark is run several times and the median time is kept (it is less sensitive to noise than the mean). The
+memory is measured in an extra run with tracemalloc (which slows down the code, so that run is not timed): the peak of
+the memory allocated while the benchmark runs, in MB.
+
+The results are stored as JSON, so a run can be saved as a baseline, and later runs compared against it.
+"""
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Dict, List
+
+
+@dataclass
+class BenchmarkResult:
+    """ A helper data class to hold the measurements of a benchmark """
+    name: str
+    seconds: float
+    min_seconds: float
+    repeats: int
+    peak_memory_mb: float
+    items: int
+    items_per_second: float
+
+
+def measure(name, function, items, repeats=3, setup=None):
+    """
+    Run a benchmark several times and measure it
+    :param name: the name of the benchmark
+    :param function: the code to measure (a function without parameters, or with the value returned by setup)
+    :param items: the number of items processed by each run (sentences, lines, steps...) to compute the throughput
+    :param repeats: the number of timed runs
+    :param setup: an optional function that is called (not timed) before each run, its result is passed to function
+    :return: a BenchmarkResult
+    """
+    def run():
+        if setup is None:
+            function()
+        else:
+            function(setup())
+
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start_time)
+
+    # (if the caller is already tracing the memory, e.g. to profile it, the tracing is not stopped)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    start_memory, _ = tracemalloc.get_traced_memory()
+    if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+ (before, the peak of the whole run is measured)
+        tracemalloc.reset_peak()
+    try:
+        run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        peak_memory -= start_memory
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+
+    seconds = statistics.median(times)
+    return BenchmarkResult(name=name, seconds=seconds, min_seconds=min(times), repeats=repeats,
+                           peak_memory_mb=peak_memory / 2 ** 20, items=items,
+                           items_per_second=items / seconds if seconds > 0 else 0.0)
+
+
+def save_results(results: List[BenchmarkResult], output_path, metadata=None):
+    """ Save the results of the benchmarks to a JSON file (with some information about the environment) """
+    data = {
+        'metadata': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            **(metadata or {}),
+        },
+        'results': {result.name: asdict(result) for result in results},
+    }
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+
+
+def load_results(results_path) -> Dict[str, BenchmarkResult]:
+    """ Load the results of the benchmarks saved with save_results, by benchmark name """
+    with open(results_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {name: BenchmarkResult(**result) for name, result in data['results'].items()}
+
+
+def print_results(results: List[BenchmarkResult]):
+    """ Print the results of the benchmarks as a table """
+    print(f'{"benchmark":<22} {"seconds":>9} {"min":>9} {"items/s":>12} {"peak MB":>9}')
+    for result in results:
+        print(f'{result.name:<22} {result.seconds:>9.3f} {result.min_seconds:>9.3f} '
+              f'{result.items_per_second:>12.1f} {result.peak_memory_mb:>9.1f}')
+
+
+def compare_results(baseline: Dict[str, BenchmarkResult], current: Dict[str, BenchmarkResult], time_tolerance=0.1,
+                    memory_tolerance=0.1):
+    """
+    Compare the results of a run against a baseline, and print the differences
+    A benchmark is a regression when its time (or its peak memory) grows more than the tolerance (e.g. 0.1 is 10%)
+    :param baseline: the results of the baseline (see load_results)
+    :param current: the results to compare
+    :param time_tolerance: the relative increase of time that is accepted
+    :param memory_tolerance: the relative increase of peak memory that is accepted
+    :return: the list of names of the benchmarks with regressions
+    """
+    regressions = []
+    print(f'{"benchmark":<22} {"base s":>9} {"now s":>9} {"time":>8} {"base MB":>9} {"now MB":>9} {"memory":>8}')
+    for name in sorted(set(baseline) | set(current)):
+        if name not in baseline or name not in current:
+            print(f'{name:<22} (only in the {"current results" if name in current else "baseline"})')
+            continue
+        base, now = baseline[name], current[name]
+        if base.items != now.items:
+            print(f'{name:<22} WARNING: different workload ({base.items} vs {now.items} items), '
+                  f'the throughput is compared instead of the time')
+            time_change = base.items_per_second / now.items_per_second - 1 if now.items_per_second > 0 else 0.0
+        else:
+            time_change = now.seconds / base.seconds - 1 if base.seconds > 0 else 0.0
+        memory_change = now.peak_memory_mb / base.peak_memory_mb - 1 if base.peak_memory_mb > 0 else 0.0
+        flags = []
+        if time_change > time_tolerance:
+            flags.append('SLOWER')
+        if memory_change > memory_tolerance:
+            flags.append('MORE MEMORY')
+        print(f'{name:<22} {base.seconds:>9.3f} {now.seconds:>9.3f} {time_change:>+8.1%} '
+              f'{base.peak_memory_mb:>9.1f} {now.peak_memory_mb:>9.1f} {memory_change:>+8.1%} '
+              f'{" ".join(flags)}'.rstrip())
+        if flags:
+            regressions.append(name)
+    if regressions:
+        print(f'REGRESSIONS: {regressions}')
+    else:
+        print('No regressions found')
+    return regressions
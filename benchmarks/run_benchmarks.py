@@ -0,0 +1,199 @@
+"""
+The benchmark suite of the project: the data conversion, the training steps, the analysis (with and without the
+rendering of the HTML pages) and the evaluation are measured on a synthetic corpus (see synthetic_corpus), and the
+results are saved as JSON baselines.
+
+Usage:
+    # run the benchmarks and save the results (e.g. as the baseline, before a change)
+    python -m benchmarks.run_benchmarks run --output baseline.json
+    # run them again after the change, and compare both results
+    python -m benchmarks.run_benchmarks run --output current.json
+    python -m benchmarks.run_benchmarks compare --baseline baseline.json --current current.json
+
+Always compare results obtained in the same machine, with the same corpus size and parameters.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+
+import spacy
+
+from benchmarks.measurement import measure, save_results, load_results, print_results, compare_results
+from benchmarks.synthetic_corpus import generate_synthetic_bio_corpus
+from part1_use_a_nerc.html_output import HTML_OFF, HTML_PAGED
+from part1_use_a_nerc.run_nerc import analyze
+from part1_use_a_nerc.streaming import CHUNK_BY_LINE
+from part2_train_custom_nerc.data_conversion import load_spacy_train_data_from_bio_dataset, \
+    transform_conll_format_to_plain_text
+from part2_train_custom_nerc.evaluation import evaluate
+from part2_train_custom_nerc.pretokenized import make_gold_docs, pretokenize_instances
+from part2_train_custom_nerc.spacy_nerc_training import _instantiate_model_for_training
+
+BENCHMARKS = ['conversion', 'plain_text', 'training_steps', 'analyze', 'render', 'evaluate']
+
+DEFAULT_SOURCE_CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'train.txt')
+
+
+def run_benchmarks(source_corpus=DEFAULT_SOURCE_CORPUS, num_sentences=20000, lang='en', custom_model=None,
+                   update_steps=50, batch_size=32, eval_size=2000, repeats=3, benchmarks=None, seed=0):
+    """
+    Run the benchmarks on a synthetic corpus
+    :param source_corpus: the BIO corpus used to generate the synthetic corpus
+    :param num_sentences: the number of sentences of the synthetic corpus
+    :param lang: the language of the blank model trained in the training steps benchmark, and of the default spaCy
+                 model used to analyze the text (if no custom model is given)
+    :param custom_model: the path of a custom model to use in the analyze benchmark (optional)
+    :param update_steps: the number of training steps (nlp.update calls) of the training steps benchmark
+    :param batch_size: the number of sentences of each training step
+    :param eval_size: the number of sentences used in the evaluation benchmark
+    :param repeats: the number of timed runs of each benchmark
+    :param benchmarks: the names of the benchmarks to run (all of them by default)
+    :param seed: the seed used to generate the corpus and the training batches
+    :return: the list of BenchmarkResults
+    """
+    benchmarks = benchmarks or BENCHMARKS
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_path = os.path.join(tmp_dir, 'synthetic_train.txt')
+        plain_text_path = os.path.join(tmp_dir, 'synthetic_PLAIN.txt')
+        print(f'Generating a synthetic corpus of {num_sentences} sentences from {source_corpus}')
+        num_lines = generate_synthetic_bio_corpus(source_corpus, corpus_path, num_sentences, seed=seed)
+        with open(corpus_path, 'r', encoding='utf-8') as f:
+            corpus_lines = f.readlines()
+        instances = load_spacy_train_data_from_bio_dataset(corpus_lines)
+        # the plain text is needed by the analyze benchmark, even if the plain text benchmark is not run
+        transform_conll_format_to_plain_text(corpus_path, plain_text_path)
+
+        if 'conversion' in benchmarks:
+            results.append(_run('conversion', lambda: load_spacy_train_data_from_bio_dataset(corpus_lines),
+                                items=num_lines, repeats=repeats))
+
+        if 'plain_text' in benchmarks:
+            results.append(_run('plain_text', lambda: transform_conll_format_to_plain_text(corpus_path,
+                                                                                           plain_text_path),
+                                items=num_lines, repeats=repeats))
+
+        # the same fixed batches are used in all the runs, and each run starts from a fresh model
+        rng = random.Random(seed)
+        batches = [rng.sample(instances, min(batch_size, len(instances))) for _ in range(update_steps)]
+        trained_nlp = None
+        if 'training_steps' in benchmarks or 'evaluate' in benchmarks:
+            trained_nlp, optimizer = _new_model_for_training(lang, instances)
+            _training_steps((trained_nlp, optimizer), batches)
+        if 'training_steps' in benchmarks:
+            results.append(_run('training_steps', lambda model: _training_steps(model, batches), items=update_steps,
+                                repeats=repeats, setup=lambda: _new_model_for_training(lang, instances)))
+
+        # the synthetic corpus is usually longer than the spaCy max_length (1,000,000 characters), so it is
+        # analyzed in streaming mode, a chunk per line (a sentence), that works with any corpus size
+        def analyze_corpus(html_mode):
+            return analyze(plain_text_path, lang, custom_model=custom_model, streaming=True, chunk_by=CHUNK_BY_LINE,
+                           html_mode=html_mode)
+
+        if 'analyze' in benchmarks or 'render' in benchmarks:
+            # the model is loaded once before measuring (loaded models are cached), so only the analysis is measured
+            _quiet(lambda: analyze_corpus(HTML_OFF))
+        if 'analyze' in benchmarks:
+            # only the NERC (and the report), without the HTML pages
+            results.append(_run('analyze', lambda: analyze_corpus(HTML_OFF), items=num_sentences, repeats=repeats))
+        if 'render' in benchmarks:
+            # the same analysis, also rendering and writing the HTML pages (the difference with analyze is the cost
+            # of the rendering)
+            results.append(_run('render', lambda: analyze_corpus(HTML_PAGED), items=num_sentences, repeats=repeats))
+
+        if 'evaluate' in benchmarks:
+            eval_instances = instances[:eval_size]
+            results.append(_run('evaluate', lambda: evaluate(eval_instances, trained_nlp), items=len(eval_instances),
+                                repeats=repeats))
+    return results
+
+
+def _run(name, function, items, repeats, setup=None):
+    """ Measure a benchmark (without the console output of the measured code) """
+    print(f'Running benchmark: {name}')
+    return measure(name, lambda *args: _quiet(lambda: function(*args)), items=items, repeats=repeats, setup=setup)
+
+
+def _quiet(function):
+    """ Call a function discarding what it prints to the console """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function()
+
+
+def _new_model_for_training(lang, instances):
+    """ A fresh blank model with a NER component, and its optimizer, ready to be trained """
+    nlp = _instantiate_model_for_training(lang, instances)
+    optimizer = nlp.begin_training()
+    return nlp, optimizer
+
+
+def _training_steps(model, batches):
+    """ Perform a training step (nlp.update) with each batch, the model is a tuple (nlp, optimizer) """
+    nlp, optimizer = model
+    for batch in batches:
+        # (with pre-tokenized Docs, split into words batch by batch as in the training)
+        docs, golds = make_gold_docs(nlp.vocab, pretokenize_instances(batch))
+        nlp.update(docs, golds, drop=0.5, losses={}, sgd=optimizer)
+
+
+def configure_argument_parser():
+    """ Console arguments parser configuration """
+    parser = argparse.ArgumentParser(description='Run the benchmarks of the project, or compare their results.',
+                                     add_help=True)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks and save the results')
+    run_parser.add_argument('--output', type=str, required=True, help='Path of the JSON file to save the results')
+    run_parser.add_argument('--source_corpus', type=str, default=DEFAULT_SOURCE_CORPUS,
+                            help='BIO corpus used to generate the synthetic corpus')
+    run_parser.add_argument('--num_sentences', type=int, default=20000,
+                            help='Number of sentences of the synthetic corpus')
+    run_parser.add_argument('--lang', type=str, choices=['en', 'fr', 'es'], default='en',
+                            help='Language of the models used in the benchmarks')
+    run_parser.add_argument('--custom_model', type=str, required=False,
+                            help='Path to a custom model to use in the analyze benchmark')
+    run_parser.add_argument('--update_steps', type=int, default=50,
+                            help='Number of training steps of the training steps benchmark')
+    run_parser.add_argument('--batch_size', type=int, default=32, help='Number of sentences of each training step')
+    run_parser.add_argument('--eval_size', type=int, default=2000,
+                            help='Number of sentences used in the evaluation benchmark')
+    run_parser.add_argument('--repeats', type=int, default=3, help='Number of timed runs of each benchmark')
+    run_parser.add_argument('--benchmarks', type=str, nargs='+', choices=BENCHMARKS, default=BENCHMARKS,
+                            help='The benchmarks to run (all of them by default)')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare the results of a run against a baseline')
+    compare_parser.add_argument('--baseline', type=str, required=True, help='Path of the baseline results')
+    compare_parser.add_argument('--current', type=str, required=True, help='Path of the results to compare')
+    compare_parser.add_argument('--time_tolerance', type=float, default=0.1,
+                                help='Accepted relative increase of the time (e.g. 0.1 for 10%%)')
+    compare_parser.add_argument('--memory_tolerance', type=float, default=0.1,
+                                help='Accepted relative increase of the peak memory (e.g. 0.1 for 10%%)')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = configure_argument_parser()
+    params = parser.parse_args()
+
+    if params.command == 'run':
+        benchmark_results = run_benchmarks(source_corpus=params.source_corpus, num_sentences=params.num_sentences,
+                                           lang=params.lang, custom_model=params.custom_model,
+                                           update_steps=params.update_steps, batch_size=params.batch_size,
+                                           eval_size=params.eval_size, repeats=params.repeats,
+                                           benchmarks=params.benchmarks)
+        print_results(benchmark_results)
+        save_results(benchmark_results, params.output, metadata={
+            'spacy': spacy.__version__, 'num_sentences': params.num_sentences, 'lang': params.lang,
+            'custom_model': params.custom_model, 'update_steps': params.update_steps,
+            'batch_size': params.batch_size, 'eval_size': params.eval_size})
+        print(f'Results saved to {os.path.abspath(params.output)}')
+    else:
+        found_regressions = compare_results(load_results(params.baseline), load_results(params.current),
+                                            time_tolerance=params.time_tolerance,
+                                            memory_tolerance=params.memory_tolerance)
+        # a non-zero exit code, so the comparison can be used in scripts
+        sys.exit(1 if found_regressions else 0)
@@ -0,0 +1,110 @@
+"""
+A benchmark of the startup time of the command line tools: each command is run several times in a new Python
+process (like a short-lived cron job would), measuring its wall time and its maximum resident memory (RSS).
+
+The commands measured are the --help of the scripts, a BIO to plain text conversion and, if they are given, the
+loading of a custom model from its zip and from its snapshot (see part1_use_a_nerc.model_snapshot).
+
+Usage:
+    python -m benchmarks.startup_benchmark --output startup.json --custom_model models/nerc_model.zip \
+        --snapshot models/nerc_model.snapshot
+
+The results are saved in the same JSON format as the rest of the benchmarks, so they can be compared with:
+    python -m benchmarks.run_benchmarks compare --baseline startup_baseline.json --current startup.json
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.measurement import BenchmarkResult, save_results, print_results
+
+_REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_LOAD_MODEL_CODE = 'import sys; from part1_use_a_nerc.run_nerc import load_custom_model; load_custom_model(sys.argv[1])'
+
+
+def measure_command(name, command, repeats=5):
+    """
+    Run a command several times, each time in a new process, and measure it
+    :param name: the name of the benchmark
+    :param command: the command, as a list of arguments
+    :param repeats: the number of runs
+    :return: a BenchmarkResult (the peak memory is the maximum RSS of the processes, when it can be measured)
+    """
+    times = []
+    max_rss_mb = 0.0
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        process = subprocess.Popen(command, cwd=_REPOSITORY_DIR, stdout=subprocess.DEVNULL)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            failed = status != 0
+            # ru_maxrss is in kilobytes in Linux (and in bytes in macOS)
+            max_rss_mb = max(max_rss_mb, usage.ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10))
+        else:
+            failed = process.wait() != 0
+        times.append(time.perf_counter() - start_time)
+        if failed:
+            raise Exception(f'The command of the benchmark {name} failed: {" ".join(command)}')
+
+    seconds = statistics.median(times)
+    return BenchmarkResult(name=name, seconds=seconds, min_seconds=min(times), repeats=repeats,
+                           peak_memory_mb=max_rss_mb, items=1, items_per_second=1 / seconds if seconds > 0 else 0.0)
+
+
+def run_startup_benchmarks(bio_file, custom_model=None, snapshot=None, repeats=5):
+    """
+    Measure the startup time of the command line tools
+    :param bio_file: a file in BIO format, for the conversion to plain text
+    :param custom_model: the path of a custom model (zip), to measure its loading time (optional)
+    :param snapshot: the path of a model snapshot, to measure its loading time (optional)
+    :param repeats: the number of runs of each command
+    :return: the list of BenchmarkResults
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        commands = [
+            ('run_nerc_help', [sys.executable, '-m', 'part1_use_a_nerc.run_nerc', '--help']),
+            ('run_nerc_train_help', [sys.executable, '-m', 'part2_train_custom_nerc.run_nerc_train', '--help']),
+            ('bio_to_plain_text', [sys.executable, '-m', 'part2_train_custom_nerc.data_conversion',
+                                   '--input', os.path.abspath(bio_file),
+                                   '--output', os.path.join(tmp_dir, 'plain.txt')]),
+        ]
+        if custom_model:
+            commands.append(('load_custom_model_zip',
+                             [sys.executable, '-c', _LOAD_MODEL_CODE, os.path.abspath(custom_model)]))
+        if snapshot:
+            commands.append(('load_custom_model_snapshot',
+                             [sys.executable, '-c', _LOAD_MODEL_CODE, os.path.abspath(snapshot)]))
+        for name, command in commands:
+            print(f'Running benchmark: {name}')
+            results.append(measure_command(name, command, repeats=repeats))
+    return results
+
+
+def configure_argument_parser():
+    """ Console arguments parser configuration """
+    parser = argparse.ArgumentParser(description='Measure the startup time of the command line tools.', add_help=True)
+    parser.add_argument('--output', type=str, required=True, help='Path of the JSON file to save the results')
+    parser.add_argument('--bio_file', type=str, default=os.path.join(_REPOSITORY_DIR, 'data', 'test.txt'),
+                        help='File in BIO format used in the conversion to plain text')
+    parser.add_argument('--custom_model', type=str, required=False,
+                        help='Path to a custom model (zip) to measure its loading time')
+    parser.add_argument('--snapshot', type=str, required=False,
+                        help='Path to a model snapshot to measure its loading time')
+    parser.add_argument('--repeats', type=int, default=5, help='Number of runs of each command')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = configure_argument_parser()
+    params = parser.parse_args()
+
+    startup_results = run_startup_benchmarks(bio_file=params.bio_file, custom_model=params.custom_model,
+                                             snapshot=params.snapshot, repeats=params.repeats)
+    print_results(startup_results)
+    save_results(startup_results, params.output)
+    print(f'Results saved to {os.path.abspath(params.output)}')
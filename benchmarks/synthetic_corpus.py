@@ -0,0 +1,49 @@
+"""
+Generation of synthetic corpora of any size, in the same BIO format as data/train.txt (one token and its tag per line,
+empty lines as sentence boundaries).
+
+The sentences of a source corpus are sampled randomly (with replacement) until the requested size is reached, so the
+synthetic corpus keeps the vocabulary, the tags and the distribution of sentence lengths of the real data. The same
+seed always generates the same corpus, so the benchmarks can be repeated on exactly the same data.
+"""
+import random
+
+
+def read_bio_sentences(source_path):
+    """ Read the sentences of a BIO file, as lists of lines (the 'token tag' lines, without the line breaks) """
+    sentences = []
+    sentence = []
+    with open(source_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.strip():
+                sentence.append(line)
+            elif len(sentence) > 0:
+                sentences.append(sentence)
+                sentence = []
+    if len(sentence) > 0:
+        sentences.append(sentence)
+    return sentences
+
+
+def generate_synthetic_bio_corpus(source_path, output_path, num_sentences, seed=0):
+    """
+    Write a synthetic BIO corpus with the given number of sentences, sampled from a source corpus
+    :param source_path: the BIO file to take the sentences from (e.g. data/train.txt)
+    :param output_path: the path of the synthetic corpus
+    :param num_sentences: the number of sentences of the synthetic corpus (it can be bigger than the source)
+    :param seed: the seed of the random generator
+    :return: the number of lines (tokens) written
+    """
+    sentences = read_bio_sentences(source_path)
+    if len(sentences) == 0:
+        raise Exception(f'No sentences found in the source corpus: {source_path}')
+    rng = random.Random(seed)
+    num_tokens = 0
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for _ in range(num_sentences):
+            sentence = sentences[rng.randrange(len(sentences))]
+            # the sentences are separated by two empty lines, like in the original data files
+            f.write('\n'.join(sentence) + '\n\n\n')
+            num_tokens += len(sentence)
+    return num_tokens
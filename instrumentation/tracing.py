@@ -0,0 +1,195 @@
+"""
+Opt-in per-stage profiling of the analysis and training pipelines.
+
+The code marks its stages (loading a model, the inference, a training step, an evaluation...) with:
+
+    with stage('nlp.update', category='train', step=steps):
+        ...
+
+When the tracing is disabled (the default), stage() returns a shared no-op context manager, so the cost is a single
+function call. When it is enabled (see tracing_session), each stage records its wall time, its CPU time (of the thread
+that runs it) and, optionally, the peak of memory it allocated (with tracemalloc, which slows down the code, so it is
+a separate option) and the maximum resident memory (RSS) of the process when it finished. The tracemalloc peak is
+global to the process, so the memory is only measured in the stages of the thread that enabled the tracing (the
+stages of other threads, e.g. the background checkpoint writer, only record their times and RSS).
+
+The records can be exported as a Chrome trace JSON file (it can be opened in chrome://tracing or
+https://ui.perfetto.dev), and summarized in a table with the totals per stage.
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import nullcontext, contextmanager
+
+try:
+    import resource
+except ImportError:  # not available in Windows
+    resource = None
+
+# The tracer that records the stages, None when the tracing is disabled
+_active_tracer = None
+_NO_STAGE = nullcontext()
+
+
+class StageTracer:
+    """ Collects the records of the stages """
+
+    def __init__(self, trace_memory=False):
+        """
+        :param trace_memory: if True, the peak of memory allocated by each stage is measured with tracemalloc
+        """
+        self.trace_memory = trace_memory
+        # the thread whose stages measure the memory (the one that enabled the tracing)
+        self.memory_thread = threading.get_ident()
+        # whether enable_tracing started tracemalloc (so disable_tracing has to stop it)
+        self.started_tracemalloc = False
+        self.records = []
+        self.start_time = time.perf_counter()
+        self._local = threading.local()
+
+    def _stack(self):
+        """ The stages that are open in the current thread (each thread has its own nesting of stages) """
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def export_chrome_trace(self, trace_path):
+        """ Write the records in the Chrome trace event format (complete events, times in microseconds) """
+        pid = os.getpid()
+        events = [{'name': record['name'], 'cat': record['category'], 'ph': 'X', 'pid': pid, 'tid': record['tid'],
+                   'ts': record['start'] * 1e6, 'dur': record['wall'] * 1e6,
+                   'args': {key: value for key, value in record.items()
+                            if key not in ('name', 'category', 'tid', 'start', 'wall')}}
+                  for record in self.records]
+        with open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self):
+        """ The totals of each stage (by name, in order of appearance): count, wall time, CPU time, peak memory """
+        totals = OrderedDict()
+        for record in sorted(self.records, key=lambda r: r['start']):
+            total = totals.setdefault(record['name'], {'category': record['category'], 'count': 0, 'wall': 0.0,
+                                                       'cpu': 0.0, 'peak_mb': None, 'max_rss_mb': None})
+            total['count'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+            for key in ('peak_mb', 'max_rss_mb'):
+                if record.get(key) is not None:
+                    total[key] = max(total[key] or 0.0, record[key])
+        return totals
+
+    def print_summary(self):
+        """ Print the summary as a table """
+        total_time = time.perf_counter() - self.start_time
+        print('==========\nProfile by stage:')
+        print(f'{"stage":<28} {"count":>7} {"wall(s)":>9} {"mean(ms)":>9} {"cpu(s)":>9} {"% run":>6} '
+              f'{"peak MB":>8} {"RSS MB":>8}')
+        for name, total in self.summary().items():
+            peak = f'{total["peak_mb"]:>8.1f}' if total['peak_mb'] is not None else f'{"-":>8}'
+            rss = f'{total["max_rss_mb"]:>8.1f}' if total['max_rss_mb'] is not None else f'{"-":>8}'
+            print(f'{name:<28} {total["count"]:>7} {total["wall"]:>9.3f} {1000 * total["wall"] / total["count"]:>9.2f} '
+                  f'{total["cpu"]:>9.3f} {100 * total["wall"] / total_time:>6.1f} {peak} {rss}')
+        print(f'Total time: {total_time:1.3f}s (nested stages are also included in the time of their parents)')
+
+
+class _Stage:
+    """ The context manager that measures a stage, when the tracing is enabled """
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        # the peak of memory of the nested stages (tracemalloc only keeps a single peak, it is reset by each stage)
+        self.children_peak = 0
+        self.trace_memory = tracer.trace_memory and threading.get_ident() == tracer.memory_thread
+
+    def __enter__(self):
+        self.tracer._stack().append(self)
+        if self.trace_memory:
+            self.start_memory, self.outer_peak = tracemalloc.get_traced_memory()
+            if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+ (before, the peak of the whole run is measured)
+                tracemalloc.reset_peak()
+        self.start_cpu = time.thread_time()
+        self.start_wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.thread_time() - self.start_cpu
+        stack = self.tracer._stack()
+        stack.pop()
+        record = {'name': self.name, 'category': self.category, 'tid': threading.get_ident(),
+                  'start': self.start_wall - self.tracer.start_time, 'wall': wall, 'cpu': cpu, **self.args}
+        if self.trace_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], self.children_peak)
+            record['peak_mb'] = (peak - self.start_memory) / 2 ** 20
+            if len(stack) > 0:
+                stack[-1].children_peak = max(stack[-1].children_peak, self.outer_peak, peak)
+        if resource is not None:
+            # ru_maxrss is in kilobytes in Linux (and in bytes in macOS)
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            record['max_rss_mb'] = max_rss / (2 ** 20 if os.uname().sysname == 'Darwin' else 2 ** 10)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        self.tracer.records.append(record)
+        return False
+
+
+def stage(name, category='stage', **args):
+    """
+    Measure a stage of the code (use it in a with statement), it does nothing when the tracing is disabled
+    :param name: the name of the stage (the records with the same name are added up in the summary)
+    :param category: the category of the stage (e.g. 'analyze', 'train')
+    :param args: any other information to store with the record (e.g. the epoch number)
+    """
+    tracer = _active_tracer
+    if tracer is None:
+        return _NO_STAGE
+    return _Stage(tracer, name, category, args)
+
+
+def enable_tracing(trace_memory=False):
+    """ Start recording the stages, returns the StageTracer """
+    global _active_tracer
+    tracer = StageTracer(trace_memory=trace_memory)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        tracer.started_tracemalloc = True
+    _active_tracer = tracer
+    return tracer
+
+
+def disable_tracing():
+    """ Stop recording the stages, returns the StageTracer with the records """
+    global _active_tracer
+    tracer, _active_tracer = _active_tracer, None
+    if tracer is not None and tracer.started_tracemalloc:
+        tracemalloc.stop()
+    return tracer
+
+
+@contextmanager
+def tracing_session(trace_path=None, trace_memory=False, enabled=True):
+    """
+    Record the stages of the code run inside the with statement, and then print the summary and export the trace
+    :param trace_path: if given, the path of the Chrome trace JSON file to write
+    :param trace_memory: if True, also measure the peak of memory of each stage (slower)
+    :param enabled: if False, nothing is recorded (so it can be used unconditionally)
+    """
+    if not enabled:
+        yield None
+        return
+    tracer = enable_tracing(trace_memory=trace_memory)
+    try:
+        yield tracer
+    finally:
+        disable_tracing()
+        tracer.print_summary()
+        if trace_path:
+            tracer.export_chrome_trace(trace_path)
+            print(f'>>> NOTE: The profiling trace has been written to {os.path.abspath(trace_path)} '
+                  f'(open it with chrome://tracing or https://ui.perfetto.dev)')
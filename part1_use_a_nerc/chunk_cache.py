@@ -0,0 +1,190 @@
+"""
+A persistent cache of the entities detected in each chunk of text, to re-analyze files that barely change.
+
+Files that grow (e.g. logs) or that get small edits are mostly made of the same chunks (paragraphs or lines) every
+time they are analyzed. The entities of each chunk are stored in a SQLite database, keyed by the hash of the content
+of the chunk and the identity of the model, so a later analysis only needs to run the model over the chunks that are
+new or have changed. The entities of the rest of the chunks (their offsets, relative to the chunk, and their labels)
+are read from the cache.
+
+The identity of a model changes whenever the model changes (its name and version for the default spaCy models, the
+hash of the zip or the snapshot for the custom models), so the results of different models are never mixed.
+"""
+import hashlib
+import json
+import sqlite3
+from collections import deque
+
+from part1_use_a_nerc.model_cache import archive_digest
+
+# The maximum number of parameters of a SQLite query (the limit of old SQLite versions is 999)
+_MAX_QUERY_PARAMS = 900
+
+
+class ChunkResultCache:
+    """ The entities of the chunks analyzed by a model, stored in a SQLite database """
+
+    def __init__(self, db_path, model_id):
+        """
+        :param db_path: the path of the SQLite database (it is created if it does not exist)
+        :param model_id: the identity of the model (see model_identity)
+        """
+        self.db_path = db_path
+        self.model_id = model_id
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(db_path, timeout=60)
+        # several processes can use the same database (e.g. the workers of the corpus mode)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS chunk_entities ('
+                                 'model_id TEXT NOT NULL, chunk_hash TEXT NOT NULL, entities TEXT NOT NULL, '
+                                 'PRIMARY KEY (model_id, chunk_hash)) WITHOUT ROWID')
+        self._connection.commit()
+
+    def get_many(self, chunk_hashes):
+        """
+        Get the cached entities of several chunks
+        :param chunk_hashes: the hashes of the chunks (see chunk_hash)
+        :return: a dictionary from the hashes that are in the cache to their entities, lists of (start, end, label)
+        """
+        cached = {}
+        unique_hashes = list(set(chunk_hashes))
+        for i in range(0, len(unique_hashes), _MAX_QUERY_PARAMS):
+            hashes = unique_hashes[i:i + _MAX_QUERY_PARAMS]
+            rows = self._connection.execute(
+                f'SELECT chunk_hash, entities FROM chunk_entities WHERE model_id = ? '
+                f'AND chunk_hash IN ({",".join("?" * len(hashes))})', [self.model_id, *hashes])
+            for hash_value, entities in rows:
+                cached[hash_value] = [tuple(entity) for entity in json.loads(entities)]
+        return cached
+
+    def put_many(self, entities_by_hash):
+        """ Store the entities (lists of (start, end, label)) of several chunks, given a dictionary by hash """
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO chunk_entities (model_id, chunk_hash, entities) VALUES (?, ?, ?)',
+                [(self.model_id, hash_value, json.dumps(entities))
+                 for hash_value, entities in entities_by_hash.items()])
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def chunk_hash(text):
+    """ The hash of the content of a chunk """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def model_identity(nlp, custom_model_file_path=None):
+    """
+    An identifier that changes whenever the model changes
+    :param nlp: the spaCy model
+    :param custom_model_file_path: for custom models, the path of their zip or snapshot (the hash of its content is
+                                   used)
+    :return: a string
+    """
+    if custom_model_file_path:
+        return f'custom:{archive_digest(custom_model_file_path)}'
+    import spacy
+    return f'spacy-{spacy.__version__}:{nlp.meta.get("lang")}_{nlp.meta.get("name")}-{nlp.meta.get("version")}'
+
+
+def iter_cached_chunk_entities(nlp, chunks, cache, batch_size=1000, n_process=1):
+    """
+    Get the entities of the chunks, from the cache when possible, running the model only over the rest of them
+    All the chunks missing from the cache go through a single nlp.pipe (so with several processes, a single pool of
+    processes is started for the whole stream), while the chunks found in the cache are yielded without waiting
+    :param nlp: the spaCy model
+    :param chunks: an iterable of tuples (offset, text), like the ones generated by streaming.read_text_chunks
+    :param cache: the ChunkResultCache
+    :param batch_size: the number of chunks looked up in the cache (and sent to spaCy) together
+    :param n_process: the number of processes used by spaCy (-1 to use all the cores)
+    :return: a generator of tuples (offset, text, entities), with the entities as (start, end, label) in the chunk
+    """
+    batches = _iter_looked_up_batches(chunks, cache, batch_size)
+    # the batches looked up in the cache that have not been yielded yet, in order
+    looked_up = deque()
+    # the missing chunks (batch, hash, text) not sent to spaCy yet, and those (batch, hash) waiting for their Docs
+    to_analyze = deque()
+    analyzing = deque()
+
+    def look_up_next_batch():
+        batch = next(batches, None)
+        if batch is None:
+            return False
+        looked_up.append(batch)
+        to_analyze.extend((batch, hash_value, text) for hash_value, text in batch.missing.items())
+        return True
+
+    def texts_to_analyze():
+        while len(to_analyze) > 0 or look_up_next_batch():
+            if len(to_analyze) > 0:
+                batch, hash_value, text = to_analyze.popleft()
+                analyzing.append((batch, hash_value))
+                yield text
+
+    docs = nlp.pipe(texts_to_analyze(), batch_size=batch_size, n_process=n_process)
+    pipe_started = False
+    while True:
+        while len(looked_up) > 0 and looked_up[0].is_complete():
+            batch = looked_up.popleft()
+            cache.put_many(batch.new_entities)
+            yield from batch.results()
+        if len(to_analyze) > 0 or len(analyzing) > 0:
+            pipe_started = True
+            doc = next(docs)
+            batch, hash_value = analyzing.popleft()
+            batch.add_entities(hash_value, [(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents])
+        elif not look_up_next_batch():
+            break
+    if pipe_started:
+        # let spaCy see the end of the texts, so that it finishes its processes
+        for _ in docs:
+            raise Exception('spaCy returned more Docs than the texts sent to it')
+
+
+class _LookedUpBatch:
+    """ A batch of chunks looked up in the cache, with the entities of the missing ones as they are analyzed """
+
+    def __init__(self, chunks, entities_by_hash):
+        self.chunks = chunks
+        self.entities_by_hash = entities_by_hash
+        self.missing = {hash_value: text for _, text, hash_value in chunks if hash_value not in entities_by_hash}
+        self.new_entities = {}
+
+    def add_entities(self, hash_value, entities):
+        self.new_entities[hash_value] = entities
+        self.entities_by_hash[hash_value] = entities
+
+    def is_complete(self):
+        return len(self.new_entities) == len(self.missing)
+
+    def results(self):
+        for offset, text, hash_value in self.chunks:
+            yield offset, text, self.entities_by_hash[hash_value]
+
+
+def _iter_looked_up_batches(chunks, cache, batch_size):
+    """ Look up the chunks in the cache, in batches of _LookedUpBatch """
+    batch = []
+    for offset, text in chunks:
+        batch.append((offset, text, chunk_hash(text)))
+        if len(batch) >= batch_size:
+            yield _look_up_batch(batch, cache)
+            batch = []
+    if len(batch) > 0:
+        yield _look_up_batch(batch, cache)
+
+
+def _look_up_batch(chunks, cache):
+    batch = _LookedUpBatch(chunks, cache.get_many([hash_value for _, _, hash_value in chunks]))
+    cache.misses += len(batch.missing)
+    cache.hits += len(chunks) - len(batch.missing)
+    return batch
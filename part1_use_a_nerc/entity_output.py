@@ -0,0 +1,216 @@
+"""
+Structured output of the detected entities: one record per entity (document id, start, end, label, text), written
+incrementally while the documents are analyzed, so other programs can use the entities without running the NERC again.
+
+Two formats are available:
+ - jsonl: a JSON object per line, e.g. {"doc": "file.txt", "start": 10, "end": 15, "label": "ORG", "text": "Apple"}
+ - columnar: a directory with a binary file per column, that can be loaded without parsing (memory-mapped), e.g. with
+   numpy.fromfile(path, dtype) or with load_entity_columns
+
+The layout of the columnar directory (all the integers are little-endian):
+
+    doc.i32          the index of the document of each entity (in docs.json)
+    start.i64        the character offset where each entity starts in its document
+    end.i64          the character offset where each entity ends in its document
+    label.i32        the index of the label of each entity (in labels.json)
+    text_offset.i64  num_entities + 1 byte offsets of the text of each entity in texts.bin
+    texts.bin        the UTF-8 texts of all the entities, one after the other
+    docs.json        the list of document ids
+    labels.json      the list of labels
+    meta.json        the format version and the number of entities (it is written last, when the output is complete)
+"""
+import json
+import mmap
+import os
+import sys
+from array import array
+
+ENTITIES_JSONL = 'jsonl'
+ENTITIES_COLUMNAR = 'columnar'
+ENTITIES_FORMATS = [ENTITIES_JSONL, ENTITIES_COLUMNAR]
+
+# The suffixes of the entities output generated next to an analyzed file, by format
+ENTITIES_OUTPUT_SUFFIXES = {ENTITIES_JSONL: '._ENTITIES.jsonl', ENTITIES_COLUMNAR: '._ENTITIES.columns'}
+
+_COLUMNAR_FORMAT_VERSION = 1
+# The columns of the columnar format: file name and array typecode
+_COLUMNS = {'doc': ('doc.i32', 'i'), 'start': ('start.i64', 'q'), 'end': ('end.i64', 'q'), 'label': ('label.i32', 'i'),
+            'text_offset': ('text_offset.i64', 'q')}
+
+
+class JsonlEntityWriter:
+    """ Writes the entities as JSON lines, through a big write buffer """
+
+    def __init__(self, output_path, buffer_size=1024 * 1024):
+        """
+        :param output_path: the path of the JSONL file
+        :param buffer_size: the size (in bytes) of the write buffer
+        """
+        self.output_path = output_path
+        self.num_entities = 0
+        self._file = open(output_path, 'w', encoding='utf-8', buffering=buffer_size)
+
+    def write(self, doc_id, start, end, label, text):
+        """ Write the record of an entity """
+        self._file.write(json.dumps({'doc': doc_id, 'start': start, 'end': end, 'label': label, 'text': text},
+                                    ensure_ascii=False) + '\n')
+        self.num_entities += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ColumnarEntityWriter:
+    """ Writes the entities in the columnar binary format, appending the buffered columns to their files """
+
+    def __init__(self, output_dir, buffer_entities=100000):
+        """
+        :param output_dir: the directory of the columnar output (it is created if it does not exist)
+        :param buffer_entities: the number of entities kept in memory before they are appended to the files
+        """
+        if sys.byteorder != 'little' or array('i').itemsize != 4 or array('q').itemsize != 8:
+            raise Exception('The columnar entities output can only be written in little-endian platforms')
+        self.output_dir = output_dir
+        self.buffer_entities = buffer_entities
+        self.num_entities = 0
+        self._doc_indices = {}
+        self._label_indices = {}
+        self._text_bytes = 0
+        os.makedirs(output_dir, exist_ok=True)
+        # a previous output in the same directory is replaced (its meta.json is removed first, so it is not used)
+        if os.path.exists(os.path.join(output_dir, 'meta.json')):
+            os.remove(os.path.join(output_dir, 'meta.json'))
+        self._files = {name: open(os.path.join(output_dir, file_name), 'wb')
+                       for name, (file_name, _) in _COLUMNS.items()}
+        self._texts_file = open(os.path.join(output_dir, 'texts.bin'), 'wb')
+        self._columns = {name: array(typecode) for name, (_, typecode) in _COLUMNS.items()}
+        self._texts = []
+        self._columns['text_offset'].append(0)
+
+    def write(self, doc_id, start, end, label, text):
+        """ Write the record of an entity """
+        encoded_text = text.encode('utf-8')
+        self._text_bytes += len(encoded_text)
+        self._texts.append(encoded_text)
+        self._columns['doc'].append(self._doc_indices.setdefault(doc_id, len(self._doc_indices)))
+        self._columns['start'].append(start)
+        self._columns['end'].append(end)
+        self._columns['label'].append(self._label_indices.setdefault(label, len(self._label_indices)))
+        self._columns['text_offset'].append(self._text_bytes)
+        self.num_entities += 1
+        if len(self._texts) >= self.buffer_entities:
+            self._flush()
+
+    def close(self):
+        """ Write the pending entities and the tables, the output is complete after this """
+        self._flush()
+        for column_file in self._files.values():
+            column_file.close()
+        self._texts_file.close()
+        for table_name, indices in (('docs.json', self._doc_indices), ('labels.json', self._label_indices)):
+            with open(os.path.join(self.output_dir, table_name), 'w', encoding='utf-8') as f:
+                json.dump(sorted(indices, key=indices.get), f, ensure_ascii=False)
+        with open(os.path.join(self.output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': _COLUMNAR_FORMAT_VERSION, 'num_entities': self.num_entities,
+                       'columns': {name: file_name for name, (file_name, _) in _COLUMNS.items()}}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _flush(self):
+        for name, column in self._columns.items():
+            column.tofile(self._files[name])
+            del column[:]
+        self._texts_file.write(b''.join(self._texts))
+        self._texts = []
+
+
+class EntityColumns:
+    """ The entities of a columnar output, memory-mapped (nothing is parsed or copied when it is loaded) """
+
+    def __init__(self, output_dir):
+        """
+        :param output_dir: the directory of a columnar output written by ColumnarEntityWriter
+        """
+        meta_path = os.path.join(output_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            raise Exception(f'The directory does not contain a complete columnar entities output: {output_dir}')
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['version'] != _COLUMNAR_FORMAT_VERSION:
+            raise Exception(f'The columnar entities output has an unsupported version: {output_dir}')
+        with open(os.path.join(output_dir, 'docs.json'), 'r', encoding='utf-8') as f:
+            self.docs = json.load(f)
+        with open(os.path.join(output_dir, 'labels.json'), 'r', encoding='utf-8') as f:
+            self.labels = json.load(f)
+        self.num_entities = meta['num_entities']
+        self._mmaps = []
+        self.columns = {name: self._map(os.path.join(output_dir, file_name), typecode)
+                        for name, (file_name, typecode) in _COLUMNS.items()}
+        self._texts = self._map(os.path.join(output_dir, 'texts.bin'), None)
+
+    def _map(self, path, typecode):
+        """ Memory-map a file, as a view of the given type (or of bytes) """
+        if os.path.getsize(path) == 0:
+            return memoryview(b'').cast(typecode) if typecode else memoryview(b'')
+        with open(path, 'rb') as f:
+            file_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mmaps.append(file_mmap)
+        return memoryview(file_mmap).cast(typecode) if typecode else memoryview(file_mmap)
+
+    def text(self, i):
+        """ The text of the i-th entity """
+        text_offsets = self.columns['text_offset']
+        return bytes(self._texts[text_offsets[i]:text_offsets[i + 1]]).decode('utf-8')
+
+    def as_numpy(self):
+        """ The columns as numpy arrays (they share the memory-mapped buffers, nothing is copied) """
+        import numpy
+        return {name: numpy.frombuffer(column, dtype=numpy.int32 if column.format == 'i' else numpy.int64)
+                for name, column in self.columns.items()}
+
+    def close(self):
+        for column in self.columns.values():
+            column.release()
+        self._texts.release()
+        for file_mmap in self._mmaps:
+            file_mmap.close()
+
+    def __len__(self):
+        return self.num_entities
+
+    def __getitem__(self, i):
+        """ The record of the i-th entity: (doc_id, start, end, label, text) """
+        if i < 0 or i >= self.num_entities:
+            raise IndexError(i)
+        return (self.docs[self.columns['doc'][i]], self.columns['start'][i], self.columns['end'][i],
+                self.labels[self.columns['label'][i]], self.text(i))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_entity_writer(output_path, output_format=ENTITIES_JSONL):
+    """ Open a writer of entities in the given format ('jsonl' or 'columnar') """
+    if output_format == ENTITIES_JSONL:
+        return JsonlEntityWriter(output_path)
+    if output_format == ENTITIES_COLUMNAR:
+        return ColumnarEntityWriter(output_path)
+    raise Exception(f'The entities output format {output_format} is not valid. Use one of: {ENTITIES_FORMATS}')
+
+
+def load_entity_columns(output_dir):
+    """ Load (memory-map) a columnar entities output """
+    return EntityColumns(output_dir)
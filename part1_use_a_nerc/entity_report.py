@@ -0,0 +1,64 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Union
+
+from part1_use_a_nerc.heavy_hitters import SpaceSaving
+
+
+@dataclass
+class EntityReport:
+    """
+    A helper data class to accumulate the entity counts that are printed in the analysis report
+    If sketch_capacity is given, the specific entities are counted approximately, in bounded memory (see heavy_hitters)
+    """
+    entity_type_counter: Counter = field(default_factory=Counter)
+    specific_entities_count_by_type: Dict[str, Union[Counter, SpaceSaving]] = field(default_factory=dict)
+    sketch_capacity: Optional[int] = None
+
+    def add_entity(self, label, text):
+        """ Count one detected entity (its type and its specific text) """
+        self.entity_type_counter.update([label])
+        if label not in self.specific_entities_count_by_type:
+            self.specific_entities_count_by_type[label] = self._new_counter()
+        self.specific_entities_count_by_type[label].update([text])
+
+    def add_doc(self, doc):
+        """ Count all the entities detected in a spaCy Doc (or any object with ents) """
+        for ent in doc.ents:
+            self.add_entity(ent.label_, ent.text)
+
+    def merge(self, other):
+        """ Add the counts of another report (e.g. the partial report of a single file) to this one """
+        self.entity_type_counter.update(other.entity_type_counter)
+        for label, counter in other.specific_entities_count_by_type.items():
+            if label not in self.specific_entities_count_by_type:
+                self.specific_entities_count_by_type[label] = self._new_counter()
+            own_counter = self.specific_entities_count_by_type[label]
+            if isinstance(own_counter, SpaceSaving) and isinstance(counter, SpaceSaving):
+                own_counter.merge(counter)
+            elif isinstance(own_counter, SpaceSaving):
+                for text, count in counter.items():
+                    own_counter.add(text, count)
+            elif isinstance(counter, SpaceSaving):
+                raise Exception('An approximate report cannot be merged into an exact one')
+            else:
+                own_counter.update(counter)
+        return self
+
+    def messages(self, top_n=None):
+        """
+        Prepare some messages with the counts to be printed in the console (or file)
+        :param top_n: the top number of named entities to list for each entity type
+        :return: a tuple with the entity types message and the entities by type message
+        """
+        entities_count_msg = f'==========\nEntity types:\t{self.entity_type_counter.most_common()}'
+        entities_by_type_msg = '==========\nEntities found by type:\n'
+        for entity_type, counter in self.specific_entities_count_by_type.items():
+            entities_by_type_msg += f'{entity_type.ljust(10)} =>\t{counter.most_common(top_n)}\n'
+            if isinstance(counter, SpaceSaving) and counter.error_bound() > 0:
+                entities_by_type_msg += f'{"".ljust(10)}\t(approximate counts, each one overestimated by at most ' \
+                                        f'{counter.error_bound()})\n'
+        return entities_count_msg, entities_by_type_msg
+
+    def _new_counter(self):
+        return SpaceSaving(self.sketch_capacity) if self.sketch_capacity else Counter()
@@ -0,0 +1,289 @@
+"""
+A gazetteer: a list of known entities (surface forms and their labels) that are found in a text by exact matching.
+
+In a specialized domain (like the materials science data of this practice) many of the entities are the same known
+strings again and again. A gazetteer compiled from the annotated training data finds them very fast, without running
+the neural model. The known entities are stored in a trie of tokens, and the text is scanned once, taking the longest
+known entity that starts at each token (leftmost-longest matching).
+
+The gazetteer can be used in three modes:
+ - only: the entities are found with the gazetteer alone (the model is not used at all, the fastest mode)
+ - merge: the model is run over all the texts, and the entities of the gazetteer are added to its entities (the model
+   takes precedence when both overlap)
+ - triage: the model is only run over the texts where the gazetteer finds some entity (the rest are assumed to have no
+   entities), and both results are merged
+
+The gazetteer of a custom model is stored next to it, in a JSON file (see gazetteer_path_for_model).
+"""
+import json
+import re
+from collections import Counter, deque
+from typing import Dict
+
+GAZETTEER_ONLY = 'only'
+GAZETTEER_MERGE = 'merge'
+GAZETTEER_TRIAGE = 'triage'
+GAZETTEER_MODES = [GAZETTEER_ONLY, GAZETTEER_MERGE, GAZETTEER_TRIAGE]
+
+GAZETTEER_FORMAT_VERSION = 1
+
+# Words, or single punctuation symbols (the same tokenization is used for the known entities and for the texts)
+_TOKEN_REGEX = re.compile(r'\w+|[^\w\s]')
+# The key of the trie nodes where a known entity ends (the tokens are never empty, so it cannot clash with them)
+_END = ''
+
+
+class Gazetteer:
+    """ A collection of known entities, stored in a trie of tokens to find them in the texts """
+
+    def __init__(self):
+        # the known entities, by their tokens: (text, label, count, precision)
+        self.entries = {}
+        self._trie = {}
+
+    def add(self, text, label, count=1, precision=1.0):
+        """ Add a known entity (its surface form and its label) """
+        tokens = tuple(tokenize(text))
+        if len(tokens) == 0:
+            return
+        self.entries[tokens] = (text, label, count, precision)
+        node = self._trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node[_END] = label
+
+    def find_entities(self, text):
+        """
+        Find the known entities in a text (the longest one, when several of them start at the same token)
+        :param text: the text
+        :return: a list of tuples (start, end, label), with the character offsets of the entities in the text
+        """
+        tokens = [(match.start(), match.end(), match.group()) for match in _TOKEN_REGEX.finditer(text)]
+        entities = []
+        i = 0
+        while i < len(tokens):
+            node = self._trie
+            longest_end, longest_label = None, None
+            j = i
+            while j < len(tokens) and tokens[j][2] in node:
+                node = node[tokens[j][2]]
+                j += 1
+                if _END in node:
+                    longest_end, longest_label = j, node[_END]
+            if longest_end is not None:
+                entities.append((tokens[i][0], tokens[longest_end - 1][1], longest_label))
+                i = longest_end
+            else:
+                i += 1
+        return entities
+
+    def save(self, path):
+        """ Write the gazetteer to a JSON file """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'version': GAZETTEER_FORMAT_VERSION,
+                       'entries': [{'text': text, 'label': label, 'count': count, 'precision': precision}
+                                   for text, label, count, precision in self.entries.values()]},
+                      f, ensure_ascii=False, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        """ Read a gazetteer from a JSON file written with save """
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != GAZETTEER_FORMAT_VERSION:
+            raise Exception(f'The gazetteer {path} has an unsupported format version: {data.get("version")}')
+        gazetteer = cls()
+        for entry in data['entries']:
+            gazetteer.add(entry['text'], entry['label'], entry['count'], entry['precision'])
+        return gazetteer
+
+    @classmethod
+    def compile(cls, instances, min_count=1, min_precision=0.5):
+        """
+        Compile a gazetteer from the entities annotated in some instances (e.g. the training data)
+        A surface form is only kept if it is annotated often enough, and if it is an entity (with the same label) in
+        most of the places where the gazetteer finds it, so ambiguous words (e.g. 'temperature', that is only
+        sometimes annotated) do not produce lots of false positives
+        :param instances: the instances in spaCy format, tuples (text, {'entities': [(start, end, label), ...]})
+        :param min_count: the minimum number of times that a surface form must be annotated with its label
+        :param min_precision: the minimum ratio of the matches of a surface form that are annotated with its label
+        :return: a Gazetteer
+        """
+        label_counts: Dict[tuple, Counter] = {}
+        texts_by_tokens = {}
+        for text, annotations in instances:
+            for start, end, label in annotations['entities']:
+                tokens = tuple(tokenize(text[start:end]))
+                label_counts.setdefault(tokens, Counter())[label] += 1
+                texts_by_tokens.setdefault(tokens, text[start:end])
+
+        # all the candidates (with their most frequent label), to count how many times each one is matched
+        candidates = cls()
+        for tokens, counter in label_counts.items():
+            label, count = counter.most_common(1)[0]
+            if count >= min_count:
+                candidates.add(texts_by_tokens[tokens], label, count)
+        matches = Counter()
+        for text, _ in instances:
+            for start, end, _ in candidates.find_entities(text):
+                matches[tuple(tokenize(text[start:end]))] += 1
+
+        gazetteer = cls()
+        for tokens, (text, label, count, _) in candidates.entries.items():
+            precision = min(1.0, count / matches[tokens]) if matches[tokens] > 0 else 0.0
+            if precision >= min_precision:
+                gazetteer.add(text, label, count, round(precision, 4))
+        return gazetteer
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class GazetteerAnnotator:
+    """ Finds the entities of many texts combining a gazetteer and a spaCy model, in one of the gazetteer modes """
+
+    def __init__(self, gazetteer, nlp=None, mode=GAZETTEER_MERGE, disable=(), model_entities_function=None):
+        """
+        :param gazetteer: the Gazetteer
+        :param nlp: the spaCy model (not needed in the 'only' mode)
+        :param mode: 'only', 'merge' or 'triage'
+        :param disable: the spaCy pipes to disable when running the model
+        :param model_entities_function: how the model is run (by default, with nlp.pipe), a function that gets an
+                                        iterable of texts, the batch size and the number of processes, and returns an
+                                        iterable with the entities of each text, as lists of (start, end, label) (e.g.
+                                        to build the Docs of already tokenized texts, see pretokenized)
+        """
+        if mode not in GAZETTEER_MODES:
+            raise Exception(f'The gazetteer mode {mode} is not valid. Use one of: {GAZETTEER_MODES}')
+        if nlp is None and mode != GAZETTEER_ONLY:
+            raise Exception(f'A spaCy model is needed in the gazetteer mode {mode}')
+        self.gazetteer = gazetteer
+        self.nlp = nlp
+        self.mode = mode
+        self.disable = disable
+        self.model_entities_function = model_entities_function
+        # how many texts have been annotated, and how many of them have been sent to the model
+        self.texts = 0
+        self.model_texts = 0
+
+    def iter_entities(self, texts_with_context, batch_size=1000, n_process=1):
+        """
+        Find the entities of the texts
+        All the texts that the model has to analyze go through a single nlp.pipe (so with several processes, a single
+        pool of processes is started for the whole stream), while the texts that only need the gazetteer are yielded
+        without waiting
+        :param texts_with_context: an iterable of tuples (text, context), the context is returned with the results
+        :param batch_size: the number of texts processed (and sent to spaCy) together
+        :param n_process: the number of processes used by spaCy (-1 to use all the cores)
+        :return: a generator of tuples (entities, context), with the entities as a list of (start, end, label)
+        """
+        batches = self._iter_gazetteer_batches(texts_with_context, batch_size)
+        # the batches that have not been yielded yet, in order
+        annotated = deque()
+        # the texts (batch, index, text) not sent to the model yet, and those (batch, index) waiting for its results
+        to_analyze = deque()
+        analyzing = deque()
+
+        def annotate_next_batch():
+            batch = next(batches, None)
+            if batch is None:
+                return False
+            annotated.append(batch)
+            to_analyze.extend((batch, i, batch.texts[i]) for i in batch.model_indices)
+            return True
+
+        def texts_to_analyze():
+            while len(to_analyze) > 0 or annotate_next_batch():
+                if len(to_analyze) > 0:
+                    batch, i, text = to_analyze.popleft()
+                    analyzing.append((batch, i))
+                    yield text
+
+        model_entities = None
+        while True:
+            while len(annotated) > 0 and annotated[0].is_complete():
+                yield from annotated.popleft().results()
+            if len(to_analyze) > 0 or len(analyzing) > 0:
+                if model_entities is None:
+                    model_entities = self._iter_model_entities(texts_to_analyze(), batch_size, n_process)
+                entities = next(model_entities)
+                batch, i = analyzing.popleft()
+                batch.model_entities[i] = entities
+            elif not annotate_next_batch():
+                break
+        if model_entities is not None:
+            # let spaCy see the end of the texts, so that it finishes its processes
+            for _ in model_entities:
+                raise Exception('The model returned more results than the texts sent to it')
+
+    def _iter_model_entities(self, texts, batch_size, n_process):
+        if self.model_entities_function is not None:
+            return iter(self.model_entities_function(texts, batch_size, n_process))
+        docs = self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process, disable=self.disable)
+        return ([(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents] for doc in docs)
+
+    def _iter_gazetteer_batches(self, texts_with_context, batch_size):
+        """ Find the entities of the gazetteer, and choose the texts for the model, in batches of _AnnotatedBatch """
+        batch = []
+        for text, context in texts_with_context:
+            batch.append((text, context))
+            if len(batch) >= batch_size:
+                yield self._annotate_batch(batch)
+                batch = []
+        if len(batch) > 0:
+            yield self._annotate_batch(batch)
+
+    def _annotate_batch(self, batch):
+        gazetteer_entities = [self.gazetteer.find_entities(text) for text, _ in batch]
+        if self.mode == GAZETTEER_ONLY:
+            model_indices = []
+        elif self.mode == GAZETTEER_TRIAGE:
+            model_indices = [i for i, entities in enumerate(gazetteer_entities) if len(entities) > 0]
+        else:
+            model_indices = list(range(len(batch)))
+        self.texts += len(batch)
+        self.model_texts += len(model_indices)
+        return _AnnotatedBatch(batch, gazetteer_entities, model_indices)
+
+
+class _AnnotatedBatch:
+    """ A batch of texts with the entities of the gazetteer, and those of the model as they are found """
+
+    def __init__(self, texts_with_context, gazetteer_entities, model_indices):
+        self.texts = [text for text, _ in texts_with_context]
+        self.contexts = [context for _, context in texts_with_context]
+        self.gazetteer_entities = gazetteer_entities
+        self.model_indices = model_indices
+        self.model_entities = {}
+
+    def is_complete(self):
+        return len(self.model_entities) == len(self.model_indices)
+
+    def results(self):
+        for i, context in enumerate(self.contexts):
+            if i in self.model_entities:
+                yield merge_entities(self.model_entities[i], self.gazetteer_entities[i]), context
+            else:
+                yield self.gazetteer_entities[i], context
+
+
+def merge_entities(primary_entities, secondary_entities):
+    """ Add the secondary entities that do not overlap any of the primary ones, all of them as (start, end, label) """
+    merged = list(primary_entities)
+    for start, end, label in secondary_entities:
+        if all(end <= other_start or start >= other_end for other_start, other_end, _ in primary_entities):
+            merged.append((start, end, label))
+    return sorted(merged)
+
+
+def tokenize(text):
+    """ The tokens used to match the known entities """
+    return _TOKEN_REGEX.findall(text)
+
+
+def gazetteer_path_for_model(model_path):
+    """ The path of the gazetteer stored next to a custom model (a zip, with or without extension, or a snapshot) """
+    for model_suffix in ('.zip', '.snapshot'):
+        if model_path.endswith(model_suffix):
+            model_path = model_path[:-len(model_suffix)]
+    return model_path + '.gazetteer.json'
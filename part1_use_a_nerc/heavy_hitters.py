@@ -0,0 +1,98 @@
+"""
+Approximate counting of the most frequent items (heavy hitters) in bounded memory.
+
+Keeping an exact Counter with every distinct entity ever seen does not scale to huge corpora, although only the top N
+entities are printed in the report. The Space-Saving algorithm (Metwally et al., 2005) keeps only a fixed number of
+counters: when a new item arrives and all the counters are in use, the item with the smallest count is replaced, and
+the new item inherits its count (as a possible overestimation, its error).
+
+Guarantees, with k counters and a total count of N:
+ - every item with a true count greater than N/k is in the sketch
+ - the count of an item is never underestimated, and it is overestimated by at most its error (which is <= N/k)
+
+The sketches can be merged (e.g. the partial results of several chunks or worker processes), following the merge of
+Agarwal et al. (2012), keeping the same guarantees for the combined stream.
+"""
+import heapq
+
+
+class SpaceSaving:
+    """ A Space-Saving sketch, it can be used like a Counter to count items and get the most common ones """
+
+    def __init__(self, capacity=1000):
+        """
+        :param capacity: the number of counters (the memory used is proportional to it)
+        """
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        # a min-heap of (count, item) to find the item with the smallest count, it may contain outdated entries
+        self._heap = []
+
+    def update(self, items):
+        """ Count each one of the given items once (like Counter.update) """
+        for item in items:
+            self.add(item)
+
+    def add(self, item, count=1):
+        """ Count an item the given number of times """
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            # replace the item with the smallest count, the new item inherits its count as error
+            min_count, min_item = self._pop_min()
+            del self.counts[min_item]
+            del self.errors[min_item]
+            self.counts[item] = min_count + count
+            self.errors[item] = min_count
+        heapq.heappush(self._heap, (self.counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def most_common(self, n=None):
+        """ The n items with the highest (estimated) counts, as a list of (item, count) like Counter.most_common """
+        return sorted(self.counts.items(), key=lambda item_count: item_count[1], reverse=True)[:n]
+
+    def error_bound(self):
+        """ The maximum overestimation of any count in the sketch """
+        return max(self.errors.values(), default=0)
+
+    def merge(self, other):
+        """ Add the counts of another sketch to this one (the result keeps the capacity of this sketch) """
+        self_min = self._min_count() if len(self.counts) >= self.capacity else 0
+        other_min = other._min_count() if len(other.counts) >= other.capacity else 0
+        merged_counts = {}
+        merged_errors = {}
+        # an item missing in a full sketch may have been counted up to the minimum count of that sketch
+        for item in set(self.counts) | set(other.counts):
+            merged_counts[item] = self.counts.get(item, self_min) + other.counts.get(item, other_min)
+            merged_errors[item] = self.errors.get(item, self_min) + other.errors.get(item, other_min)
+
+        kept_items = heapq.nlargest(self.capacity, merged_counts, key=merged_counts.get)
+        self.counts = {item: merged_counts[item] for item in kept_items}
+        self.errors = {item: merged_errors[item] for item in kept_items}
+        self.total += other.total
+        self._rebuild_heap()
+        return self
+
+    def _min_count(self):
+        return min(self.counts.values(), default=0)
+
+    def _pop_min(self):
+        """ Remove the entry of the item with the smallest count from the heap, skipping outdated entries """
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == count:
+                return count, item
+
+    def _rebuild_heap(self):
+        self._heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self.counts)
@@ -0,0 +1,156 @@
+"""
+Writing of the HTML files with the highlighted entities.
+
+Rendering a whole big document into a single HTML string takes a lot of memory, and the resulting page is too big for
+a web browser. Instead, the rendered pieces are written to disk as soon as they are ready, split into pages of a
+bounded size, with an index page that links all of them. Small documents still produce a single page.
+
+The rendering can also be limited to the first N pages (a sample), or turned off completely.
+"""
+import html
+import os
+
+HTML_PAGED = 'paged'
+HTML_OFF = 'off'
+HTML_MODES = [HTML_PAGED, HTML_OFF]
+
+DEFAULT_MAX_PAGE_CHARS = 500000
+
+_PAGE_HEADER = '<!DOCTYPE html>\n<html lang="{lang}">\n<head>\n<meta charset="utf-8">\n<title>{title}</title>\n' \
+               '</head>\n<body style="font-size: 16px; font-family: sans-serif; padding: 4rem 2rem;">\n'
+_PAGE_FOOTER = '</body>\n</html>\n'
+
+
+class PaginatedHtmlWriter:
+    """ Writes rendered entities to HTML pages of a bounded size, as they are rendered """
+
+    def __init__(self, html_file_path, lang='en', max_page_chars=DEFAULT_MAX_PAGE_CHARS, max_pages=None):
+        """
+        :param html_file_path: the path of the main HTML file (the index page, or the only page if there is just one)
+        :param lang: the language of the content of the pages
+        :param max_page_chars: the size of the pages, a page is closed once its content exceeds it
+        :param max_pages: if given, only this number of pages are rendered (the rest of the content is skipped)
+        """
+        if max_pages is not None and max_pages < 1:
+            raise Exception(f'The maximum number of HTML pages must be at least 1 (or None), not {max_pages}')
+        self.html_file_path = html_file_path
+        self.lang = lang
+        self.max_page_chars = max_page_chars
+        self.max_pages = max_pages
+        self.page_paths = []
+        self.truncated = False
+        self._page_file = None
+        self._page_chars = 0
+
+    @property
+    def accepting(self):
+        """ False when the maximum number of pages has been reached (so there is no need to render anything else) """
+        if self._page_file is not None and self._page_chars < self.max_page_chars:
+            return True
+        return self._can_open_page()
+
+    def write_doc(self, doc):
+        """ Render the entities of a spaCy Doc (or Span) and write them """
+        if self.accepting:
+            from spacy import displacy  # imported on first use, it is slow to import
+            self.write(displacy.render(doc, style='ent', page=False))
+        else:
+            self.truncated = True
+
+    def write_entities(self, text, entities):
+        """ Render the entities of a text given as (start, end, label) (e.g. read from a cache) and write them """
+        if self.accepting:
+            from spacy import displacy
+            ents = [{'start': start, 'end': end, 'label': label} for start, end, label in entities]
+            self.write(displacy.render({'text': text, 'ents': ents, 'title': None}, style='ent', manual=True,
+                                       page=False))
+        else:
+            self.truncated = True
+
+    def write(self, rendered_html):
+        """ Write a piece of rendered HTML, in the current page or in a new one """
+        if self._page_file is not None and self._page_chars >= self.max_page_chars:
+            if not self._can_open_page():
+                # the last page allowed is full, the rest of the content is skipped
+                self.truncated = True
+            self._close_page(has_next_page=self._can_open_page())
+        if self._page_file is None:
+            if not self.accepting:
+                self.truncated = True
+                return
+            self._open_page()
+        self._page_file.write(rendered_html)
+        self._page_chars += len(rendered_html)
+
+    def close(self):
+        """ Close the last page, and write the index page (unless there is a single page, or nothing to write) """
+        if self._page_file is not None:
+            self._close_page(has_next_page=False)
+        if len(self.page_paths) == 0:
+            # nothing has been written (empty input), there is no page to link
+            return
+        if len(self.page_paths) == 1 and not self.truncated:
+            # a single page does not need an index
+            os.replace(self.page_paths[0], self.html_file_path)
+            self.page_paths = [self.html_file_path]
+            return
+        with open(self.html_file_path, 'w', encoding='utf-8') as f:
+            f.write(_PAGE_HEADER.format(lang=self.lang, title='displaCy (index)'))
+            f.write(f'<h2>{len(self.page_paths)} pages</h2>\n<ul>\n')
+            for page_number, page_path in enumerate(self.page_paths, start=1):
+                f.write(f'<li><a href="{html.escape(os.path.basename(page_path))}">Page {page_number}</a></li>\n')
+            f.write('</ul>\n')
+            if self.truncated:
+                f.write(f'<p>Only the first {len(self.page_paths)} pages have been rendered.</p>\n')
+            f.write(_PAGE_FOOTER)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _can_open_page(self):
+        return self.max_pages is None or len(self.page_paths) < self.max_pages
+
+    def _page_path(self, page_number):
+        return f'{self.html_file_path[:-len(".html")]}.page{page_number:04d}.html'
+
+    def _open_page(self):
+        page_path = self._page_path(len(self.page_paths) + 1)
+        self.page_paths.append(page_path)
+        self._page_file = open(page_path, 'w', encoding='utf-8')
+        self._page_file.write(_PAGE_HEADER.format(lang=self.lang, title=f'displaCy (page {len(self.page_paths)})'))
+        self._page_chars = 0
+
+    def _close_page(self, has_next_page):
+        """ Close the current page, with navigation links (unless it turns out to be the only page) """
+        page_number = len(self.page_paths)
+        if page_number > 1 or has_next_page or self.truncated:
+            links = [f'<a href="{html.escape(os.path.basename(self.html_file_path))}">Index</a>']
+            if page_number > 1:
+                links.insert(0, f'<a href="{html.escape(os.path.basename(self._page_path(page_number - 1)))}">'
+                                f'Previous</a>')
+            if has_next_page:
+                links.append(f'<a href="{html.escape(os.path.basename(self._page_path(page_number + 1)))}">Next</a>')
+            self._page_file.write(f'<p>{" | ".join(links)}</p>\n')
+        self._page_file.write(_PAGE_FOOTER)
+        self._page_file.close()
+        self._page_file = None
+
+
+def iter_page_spans(doc, max_chars=DEFAULT_MAX_PAGE_CHARS):
+    """
+    Split a big Doc into spans of whole sentences (of roughly max_chars characters), so they can be rendered separately
+    If the Doc has no sentence boundaries, the whole Doc is returned
+    """
+    if not doc.is_sentenced:
+        yield doc
+        return
+    span_start = 0
+    for sentence in doc.sents:
+        if sentence.end_char - doc[span_start].idx >= max_chars:
+            yield doc[span_start:sentence.end]
+            span_start = sentence.end
+    if span_start < len(doc):
+        yield doc[span_start:len(doc)]
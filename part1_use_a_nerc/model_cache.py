@@ -0,0 +1,154 @@
+"""
+Caches to avoid paying the cost of loading a model again and again.
+
+There are two levels of cache:
+ - An on-disk cache of extracted custom models. The zip files are extracted to a directory named after the hash of
+   their content, so a zip that has already been extracted (and verified) is never extracted again.
+ - An in-process LRU cache of loaded spaCy models (Language objects), so loading the same model again in a long-lived
+   process is almost free. The least recently used models are evicted when there are too many, or when they use too
+   much memory (estimated with the size of the model on disk).
+
+The cache directory and the limits of the LRU cache can be configured with these environment variables:
+NERC_MODEL_CACHE_DIR, NERC_MAX_CACHED_MODELS and NERC_MAX_CACHED_MODELS_MB
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+DEFAULT_CACHE_DIR = os.environ.get('NERC_MODEL_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'nerc_practice', 'models'))
+
+# A file written inside each extracted model, once the extraction has been completed
+_EXTRACTION_MARKER = '.nerc_extracted'
+
+# Hashes already calculated in this process, by (path, size, modification time), to avoid reading the zip again
+_archive_digests = {}
+
+
+def archive_digest(zip_path):
+    """ Calculate the SHA-256 hash of the content of a file (remembering it while the file does not change) """
+    stat = os.stat(zip_path)
+    digest_key = (os.path.abspath(zip_path), stat.st_size, stat.st_mtime_ns)
+    if digest_key not in _archive_digests:
+        sha256 = hashlib.sha256()
+        with open(zip_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(block)
+        _archive_digests[digest_key] = sha256.hexdigest()
+    return _archive_digests[digest_key]
+
+
+def extract_model_archive(zip_path, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Extract a zipped model to the cache directory, unless the same content has already been extracted there
+    :param zip_path: the path of the zip file that contains the model
+    :param cache_dir: the directory where the models are extracted (each one in a directory named after its hash)
+    :return: the path of the directory that contains the extracted model
+    """
+    digest = archive_digest(zip_path)
+    model_dir = os.path.join(cache_dir, digest)
+    if _is_extracted(model_dir, digest):
+        return model_dir
+
+    print(f'Extracting model {zip_path} to {model_dir}')
+    os.makedirs(cache_dir, exist_ok=True)
+    # extract to a temporary directory first, so a half-extracted model is never used
+    tmp_dir = tempfile.mkdtemp(prefix=f'.{digest}.', dir=cache_dir)
+    try:
+        shutil.unpack_archive(zip_path, extract_dir=tmp_dir)
+        with open(os.path.join(tmp_dir, _EXTRACTION_MARKER), 'w', encoding='utf-8') as f:
+            f.write(digest)
+        if os.path.exists(model_dir):
+            # an incomplete extraction from a previous (interrupted) run
+            shutil.rmtree(model_dir, ignore_errors=True)
+        os.rename(tmp_dir, model_dir)
+    except OSError:
+        # another process may have extracted the same model at the same time, that is fine if it is complete
+        if not _is_extracted(model_dir, digest):
+            raise
+    finally:
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return model_dir
+
+
+def _is_extracted(model_dir, digest):
+    """ Returns true if the model directory contains a completed extraction of the zip with the given hash """
+    marker_path = os.path.join(model_dir, _EXTRACTION_MARKER)
+    if not os.path.exists(marker_path):
+        return False
+    with open(marker_path, 'r', encoding='utf-8') as f:
+        return f.read().strip() == digest
+
+
+def directory_size(path):
+    """ The total size (in bytes) of the files inside a directory """
+    total_size = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            total_size += os.path.getsize(os.path.join(dir_path, file_name))
+    return total_size
+
+
+class LanguageLRUCache:
+    """ An LRU cache of loaded spaCy models, limited by the number of models and by their (estimated) memory """
+
+    def __init__(self, max_models=4, max_bytes=None):
+        """
+        :param max_models: the maximum number of models kept in memory
+        :param max_bytes: the maximum memory used by the models (estimated with their size on disk), None for no limit
+        """
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._models = OrderedDict()
+
+    def get_or_load(self, key, loader):
+        """
+        Get a model from the cache, or load it (and keep it in the cache) if it is not there
+        :param key: the identity of the model (e.g. the name of a spaCy model or the path of an extracted model)
+        :param loader: a function without parameters that loads the model
+        :return: the loaded model
+        """
+        if key in self._models:
+            self._models.move_to_end(key)
+            return self._models[key][0]
+
+        nlp = loader()
+        model_path = getattr(nlp, 'path', None)
+        model_size = directory_size(str(model_path)) if model_path else 0
+        self._models[key] = (nlp, model_size)
+        self._evict()
+        return nlp
+
+    def total_bytes(self):
+        """ The estimated memory used by the models in the cache """
+        return sum(model_size for _, model_size in self._models.values())
+
+    def clear(self):
+        """ Remove all the models from the cache """
+        self._models.clear()
+
+    def _evict(self):
+        """ Remove the least recently used models until the limits are respected (the last one is always kept) """
+        while len(self._models) > 1 and (len(self._models) > self.max_models or
+                                         (self.max_bytes is not None and self.total_bytes() > self.max_bytes)):
+            self._models.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def __len__(self):
+        return len(self._models)
+
+
+def _max_bytes_from_env():
+    """ The memory limit of the LRU cache, in megabytes, read from the environment (if set) """
+    max_megabytes = os.environ.get('NERC_MAX_CACHED_MODELS_MB')
+    return int(max_megabytes) * 1024 * 1024 if max_megabytes else None
+
+
+# The LRU cache shared by all the model loading functions of this process
+loaded_models = LanguageLRUCache(max_models=int(os.environ.get('NERC_MAX_CACHED_MODELS', 4)),
+                                 max_bytes=_max_bytes_from_env())
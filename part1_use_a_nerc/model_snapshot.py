@@ -0,0 +1,100 @@
+"""
+Model snapshots: a whole spaCy model serialized (with nlp.to_bytes) into a single file.
+
+Loading a model with spacy.load parses a directory with many files (and the custom models are zip files that must be
+extracted first). A snapshot is a single file with a small header, the meta information of the model (needed to
+rebuild its pipeline) and the bytes of the model, so it is loaded with a single read and an nlp.from_bytes call.
+
+Any model can be converted to a snapshot:
+    python -m part1_use_a_nerc.model_snapshot --custom_model models/nerc_model.zip --output models/nerc_model.snapshot
+    python -m part1_use_a_nerc.model_snapshot --lang en --output en_core_web_sm.snapshot
+
+The snapshots can be used as custom models anywhere (--custom_model models/nerc_model.snapshot).
+"""
+import argparse
+import json
+import os
+import struct
+
+SNAPSHOT_SUFFIX = '.snapshot'
+# the name of the snapshot inside a zipped model (see part2_train_custom_nerc.checkpointing)
+ZIPPED_SNAPSHOT_NAME = 'model' + SNAPSHOT_SUFFIX
+
+_MAGIC = b'NERCSNAP'
+_FORMAT_VERSION = 1
+# magic, format version, length of the meta JSON
+_HEADER = struct.Struct('<8sIQ')
+
+
+def is_model_snapshot(model_path):
+    """ True if the path is a model snapshot (by its extension) """
+    return model_path.endswith(SNAPSHOT_SUFFIX)
+
+
+def save_model_snapshot(nlp, snapshot_path):
+    """ Write a spaCy model to a snapshot file """
+    write_model_snapshot(dict(nlp.meta), nlp.to_bytes(), snapshot_path)
+
+
+def write_model_snapshot(meta, model_bytes, snapshot_path):
+    """ Write an already serialized model (its meta and its nlp.to_bytes) to a snapshot file """
+    # written to a temporary file first, so a snapshot file is never incomplete
+    tmp_path = snapshot_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write_model_snapshot_content(meta, model_bytes, f)
+    os.replace(tmp_path, snapshot_path)
+
+
+def write_model_snapshot_content(meta, model_bytes, f):
+    """ Write an already serialized model to a file object open for writing in binary mode (e.g. a zip entry) """
+    meta_bytes = json.dumps(meta).encode('utf-8')
+    f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, len(meta_bytes)))
+    f.write(meta_bytes)
+    f.write(model_bytes)
+
+
+def load_model_snapshot(snapshot_path):
+    """ Load a spaCy model from a snapshot file """
+    with open(snapshot_path, 'rb') as f:
+        content = f.read()
+    magic, version, meta_length = _HEADER.unpack_from(content)
+    if magic != _MAGIC or version != _FORMAT_VERSION:
+        raise Exception(f'The file is not a valid model snapshot (or it has an unsupported version): {snapshot_path}')
+    meta_end = _HEADER.size + meta_length
+    meta = json.loads(content[_HEADER.size:meta_end].decode('utf-8'))
+    return model_from_bytes(meta, content[meta_end:])
+
+
+def model_from_bytes(meta, model_bytes):
+    """ Rebuild a spaCy model from the bytes and the meta information of a serialized model """
+    import spacy
+    nlp = spacy.blank(meta['lang'])
+    for pipe_name in meta['pipeline']:
+        nlp.add_pipe(nlp.create_pipe(pipe_name))
+    nlp.from_bytes(model_bytes)
+    return nlp
+
+
+def configure_argument_parser():
+    """ Console arguments parser configuration """
+    parser = argparse.ArgumentParser(description='Convert a spaCy model to a snapshot (a single file, fast to load).',
+                                     add_help=True)
+    model_group = parser.add_mutually_exclusive_group(required=True)
+    model_group.add_argument('--custom_model', type=str, help='Path to a custom model (zip)')
+    model_group.add_argument('--lang', type=str, choices=['en', 'fr', 'es'],
+                             help='Language of the default spaCy model to convert')
+    parser.add_argument('--output', type=str, required=True, help=f'Path of the snapshot (ending in {SNAPSHOT_SUFFIX})')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = configure_argument_parser()
+    params = parser.parse_args()
+
+    from part1_use_a_nerc.run_nerc import instantiate_default_model, load_custom_model
+
+    if not is_model_snapshot(params.output):
+        raise Exception(f'The path of the snapshot must end in {SNAPSHOT_SUFFIX}: {params.output}')
+    model = load_custom_model(params.custom_model) if params.custom_model else instantiate_default_model(params.lang)
+    save_model_snapshot(model, params.output)
+    print(f'Model snapshot saved to {os.path.abspath(params.output)}')
@@ -0,0 +1,345 @@
+"""
+A resident NERC service that keeps the models loaded in memory.
+
+Running the run_nerc.py script for each request means paying for the Python start, the spaCy import and the model
+load every time. This service loads the models once and serves the entity extraction through a small HTTP API,
+listening on a local TCP port or on a Unix socket.
+
+Concurrent requests for the same model are grouped in micro-batches that are analyzed together with nlp.pipe. A batch
+is processed as soon as it is full (max batch size) or when its first request has waited long enough (max wait).
+
+The API (all the responses are JSON):
+ - POST /entities   with a JSON body like {"text": "...", "model": "en"} or {"texts": ["...", "..."], "model": "en"}
+ - GET  /models     the names of the loaded models
+ - GET  /stats      latency and throughput counters of each model
+ - GET  /health
+
+Example of usage:
+python -m part1_use_a_nerc.nerc_server --port 8080 --custom_model materials=/path/to/model.zip
+curl -X POST localhost:8080/entities -d '{"text": "Some text to analyze", "model": "en"}'
+"""
+import argparse
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from part1_use_a_nerc.run_nerc import LANG_MODELS, instantiate_default_model, load_custom_model
+
+
+class ServiceStats:
+    """ Thread-safe latency and throughput counters of a model served by the service """
+
+    def __init__(self, latency_window=1000):
+        """
+        :param latency_window: the number of recent requests used to calculate the latency percentiles
+        """
+        self._lock = threading.Lock()
+        self._start_time = time.time()
+        self._recent_latencies = deque(maxlen=latency_window)
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record_batch(self, num_texts):
+        """ Count a batch of texts analyzed together """
+        with self._lock:
+            self.batches += 1
+            self.texts += num_texts
+
+    def record_request(self, latency, failed=False):
+        """ Count a request (a single text), and the time it took since it was submitted """
+        with self._lock:
+            self.requests += 1
+            self.errors += 1 if failed else 0
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self._recent_latencies.append(latency)
+
+    def as_dict(self):
+        """ The current value of the counters (latencies in milliseconds) """
+        with self._lock:
+            uptime = time.time() - self._start_time
+            recent_latencies = sorted(self._recent_latencies)
+            return {
+                'requests': self.requests,
+                'texts': self.texts,
+                'batches': self.batches,
+                'errors': self.errors,
+                'mean_batch_size': self.texts / self.batches if self.batches > 0 else 0,
+                'requests_per_second': self.requests / uptime if uptime > 0 else 0,
+                'texts_per_second': self.texts / uptime if uptime > 0 else 0,
+                'mean_latency_ms': 1000 * self.total_latency / self.requests if self.requests > 0 else 0,
+                'p50_latency_ms': 1000 * _percentile(recent_latencies, 0.50),
+                'p95_latency_ms': 1000 * _percentile(recent_latencies, 0.95),
+                'max_latency_ms': 1000 * self.max_latency,
+                'uptime_seconds': uptime,
+            }
+
+
+def _percentile(sorted_values, fraction):
+    """ A simple percentile (nearest rank) of an already sorted list """
+    if len(sorted_values) == 0:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class MicroBatcher:
+    """ Groups the texts submitted concurrently for a model, and analyzes them together with nlp.pipe """
+
+    def __init__(self, nlp, max_batch_size=64, max_wait_ms=5):
+        """
+        :param nlp: the spaCy model
+        :param max_batch_size: the maximum number of texts analyzed together
+        :param max_wait_ms: the maximum time (in milliseconds) that a text waits for other texts to fill its batch
+        """
+        self.nlp = nlp
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = ServiceStats()
+        self._pending = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, text):
+        """ Submit a text to be analyzed, the result will be the list of its entities (as dictionaries) """
+        future = Future()
+        self._pending.put((text, future, time.perf_counter()))
+        return future
+
+    def _run(self):
+        """ The loop of the batching thread """
+        while True:
+            # wait (without limit) for the first text of the batch, then fill it until it is full or it is too late
+            batch = [self._pending.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process_batch(batch)
+
+    def _process_batch(self, batch):
+        """ Analyze a batch of texts and deliver the results """
+        texts = [text for text, _, _ in batch]
+        try:
+            docs = list(self.nlp.pipe(texts, batch_size=len(texts)))
+        except Exception:
+            # a single bad text (e.g. longer than max_length) must not fail the texts of other requests of the batch,
+            # so the texts are analyzed again one by one, and only the failing ones get the error
+            for item in batch:
+                self._process_single_text(*item)
+            return
+        self.stats.record_batch(len(texts))
+        for doc, (_, future, submit_time) in zip(docs, batch):
+            future.set_result(_entities_as_dicts(doc))
+            self.stats.record_request(time.perf_counter() - submit_time)
+
+    def _process_single_text(self, text, future, submit_time):
+        """ Analyze a single text (of a batch that failed) and deliver its result, or its error """
+        try:
+            doc = self.nlp(text)
+        except Exception as e:
+            future.set_exception(e)
+            self.stats.record_request(time.perf_counter() - submit_time, failed=True)
+            return
+        self.stats.record_batch(1)
+        future.set_result(_entities_as_dicts(doc))
+        self.stats.record_request(time.perf_counter() - submit_time)
+
+
+def _entities_as_dicts(doc):
+    """ The entities of a Doc, as the dictionaries returned by the API """
+    return [{'start': ent.start_char, 'end': ent.end_char, 'label': ent.label_, 'text': ent.text} for ent in doc.ents]
+
+
+class NercRequestHandler(BaseHTTPRequestHandler):
+    """ Handles the requests of the HTTP API, the batchers of the models are found in the server object """
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif self.path == '/models':
+            self._send_json(200, {'models': sorted(self.server.batchers.keys())})
+        elif self.path == '/stats':
+            self._send_json(200, {name: batcher.stats.as_dict() for name, batcher in self.server.batchers.items()})
+        else:
+            self._send_json(404, {'error': f'Unknown path: {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/entities':
+            self._send_json(404, {'error': f'Unknown path: {self.path}'})
+            return
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(content_length).decode('utf-8'))
+        except ValueError as e:
+            self._send_json(400, {'error': f'Invalid JSON request: {e}'})
+            return
+        validation_error = _validate_entities_request(request)
+        if validation_error is not None:
+            self._send_json(400, {'error': validation_error})
+            return
+
+        model_name = request.get('model', self.server.default_model)
+        if model_name not in self.server.batchers:
+            self._send_json(400, {'error': f'Unknown model: {model_name}. Use one of: {sorted(self.server.batchers)}'})
+            return
+        batcher = self.server.batchers[model_name]
+
+        # all the texts are submitted before waiting, so they can end up in the same batch
+        single_text = 'text' in request
+        texts = [request['text']] if single_text else request.get('texts', [])
+        futures = [batcher.submit(text) for text in texts]
+        try:
+            results = [future.result() for future in futures]
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'entities': results[0]} if single_text else {'entities': results})
+
+    def _send_json(self, status, content):
+        body = json.dumps(content, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # the clients connected through a Unix socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix-socket'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def _validate_entities_request(request):
+    """ Check the content of a request to /entities, the error message if it is not valid (None if it is valid) """
+    if not isinstance(request, dict):
+        return 'The request must be a JSON object, like {"text": "...", "model": "en"}'
+    if 'text' in request and not isinstance(request['text'], str):
+        return 'The "text" of the request must be a string'
+    if 'text' not in request:
+        texts = request.get('texts', [])
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return 'The "texts" of the request must be a list of strings'
+    if not isinstance(request.get('model', ''), str):
+        return 'The "model" of the request must be a string'
+    return None
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ The same as ThreadingHTTPServer, but listening on a Unix socket """
+    daemon_threads = True
+
+
+def create_server(batchers, default_model, host='127.0.0.1', port=8080, unix_socket=None, verbose=False):
+    """
+    Create the HTTP server of the service (it still needs to be started with serve_forever)
+    :param batchers: a dictionary with the MicroBatcher of each model, by name
+    :param default_model: the name of the model used when the requests do not specify one
+    :param host: the host to listen to (ignored if a Unix socket is used)
+    :param port: the port to listen to (ignored if a Unix socket is used)
+    :param unix_socket: the path of a Unix socket to listen to, instead of a TCP port
+    :param verbose: whether to log every request to the console
+    :return: the server
+    """
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, NercRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), NercRequestHandler)
+    server.batchers = batchers
+    server.default_model = default_model
+    server.verbose = verbose
+    return server
+
+
+def load_batchers(languages, custom_models, max_batch_size, max_wait_ms):
+    """
+    Load the models that will be kept warm in memory, and create a MicroBatcher for each of them
+    :param languages: the languages of the default spaCy models to load (a default model that fails is skipped)
+    :param custom_models: a dictionary with the paths of the custom models to load, by name
+    :param max_batch_size: the maximum number of texts analyzed together
+    :param max_wait_ms: the maximum time (in milliseconds) that a text waits for other texts to fill its batch
+    :return: a dictionary with the MicroBatcher of each model, by name
+    """
+    batchers = {}
+    for language in languages:
+        try:
+            nlp = instantiate_default_model(language)
+        except OSError as e:
+            print(f'Skipping the default spaCy model for {language} (is it downloaded?): {e}')
+            continue
+        batchers[language] = MicroBatcher(nlp, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    for name, model_path in custom_models.items():
+        batchers[name] = MicroBatcher(load_custom_model(model_path), max_batch_size=max_batch_size,
+                                      max_wait_ms=max_wait_ms)
+    if len(batchers) == 0:
+        raise Exception('No models could be loaded')
+    return batchers
+
+
+def _parse_custom_models(custom_model_args):
+    """ Parse the custom models given in the console as name=path """
+    custom_models = {}
+    for custom_model_arg in custom_model_args or []:
+        if '=' not in custom_model_arg:
+            raise Exception(f'Custom models must be given as name=path, not: {custom_model_arg}')
+        name, model_path = custom_model_arg.split('=', 1)
+        custom_models[name] = model_path
+    return custom_models
+
+
+def configure_argument_parser():
+    """ Console arguments parser configuration """
+    parser = argparse.ArgumentParser(description='Serve NERC over a local HTTP API, with the models kept in memory.',
+                                     add_help=True)
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Host to listen to')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen to')
+    parser.add_argument('--unix_socket', type=str, required=False,
+                        help='Path of a Unix socket to listen to (instead of host and port)')
+    parser.add_argument('--langs', type=str, nargs='*', choices=list(LANG_MODELS.keys()),
+                        default=list(LANG_MODELS.keys()), help='Languages of the default spaCy models to serve')
+    parser.add_argument('--custom_model', type=str, action='append',
+                        help='A custom model to serve, as name=path (can be repeated)')
+    parser.add_argument('--default_model', type=str, required=False,
+                        help='Model used when the requests do not specify one (by default, the first loaded one)')
+    parser.add_argument('--max_batch_size', type=int, default=64, help='Maximum number of texts analyzed together')
+    parser.add_argument('--max_wait_ms', type=float, default=5,
+                        help='Maximum time (milliseconds) that a text waits for other texts to fill its batch')
+    parser.add_argument('--verbose', action='store_true', help='Log every request to the console')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = configure_argument_parser()
+    params = parser.parse_args()
+
+    batchers = load_batchers(languages=params.langs, custom_models=_parse_custom_models(params.custom_model),
+                             max_batch_size=params.max_batch_size, max_wait_ms=params.max_wait_ms)
+    server = create_server(batchers, default_model=params.default_model or next(iter(batchers)),
+                           host=params.host, port=params.port, unix_socket=params.unix_socket,
+                           verbose=params.verbose)
+    print(f'Serving models {sorted(batchers.keys())} on {params.unix_socket or f"{params.host}:{params.port}"}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Stopping the service...')
+    finally:
+        server.server_close()
@@ -13,22 +13,38 @@ Default spaCy NERC models contain these entity types:
 https://spacy.io/api/annotation#named-entities
 """
 import argparse
+import glob
 import os
+from multiprocessing import Pool
 
-import shutil
-from collections import Counter
-from typing import Dict
-
-import spacy
-from spacy import displacy
-from spacy.tokens.doc import Doc
+from instrumentation.tracing import stage, tracing_session
+from part1_use_a_nerc.chunk_cache import ChunkResultCache, iter_cached_chunk_entities, model_identity
+from part1_use_a_nerc.entity_output import open_entity_writer, ENTITIES_FORMATS, ENTITIES_OUTPUT_SUFFIXES
+from part1_use_a_nerc.entity_report import EntityReport
+from part1_use_a_nerc.gazetteer import Gazetteer, GazetteerAnnotator, gazetteer_path_for_model, GAZETTEER_MODES, \
+    GAZETTEER_ONLY
+from part1_use_a_nerc.html_output import PaginatedHtmlWriter, iter_page_spans, DEFAULT_MAX_PAGE_CHARS, HTML_MODES, \
+    HTML_OFF, HTML_PAGED
+from part1_use_a_nerc.model_cache import extract_model_archive, loaded_models
+from part1_use_a_nerc.model_snapshot import is_model_snapshot, load_model_snapshot, ZIPPED_SNAPSHOT_NAME
+from part1_use_a_nerc.streaming import read_text_chunks, stream_docs, iter_entities, CHUNK_BY_PARAGRAPH, CHUNK_MODES
 
 # These are the spaCy model for different languages
 # spaCy has pre-trained models for more languages, but this is assuming that we have downloaded only: 'en','es','fr'
 LANG_MODELS = {'en': 'en_core_web_sm', 'fr': 'fr_core_news_sm', 'es': 'es_core_news_sm'}
 
+# The files generated by the analysis itself are never analyzed in corpus mode
+_GENERATED_FILE_SUFFIXES = ('._HIGHLIGHTED.html', '._REPORT.txt', *ENTITIES_OUTPUT_SUFFIXES.values())
+
+# In corpus mode, each worker process loads the model only once and keeps it here (and opens the result cache, if any)
+_worker_nlp = None
+_worker_result_cache = None
 
-def analyze(file_path, language, output_path=None, custom_model=None, top_n=None):
+
+def analyze(file_path, language, output_path=None, custom_model=None, top_n=None, streaming=False,
+            chunk_by=CHUNK_BY_PARAGRAPH, batch_size=1000, n_process=1, html_mode=HTML_PAGED, html_max_pages=None,
+            html_page_chars=DEFAULT_MAX_PAGE_CHARS, sketch_capacity=None, result_cache=None, gazetteer_mode=None,
+            gazetteer=None, entities_format=None, entities_output=None):
     """
     Analyze an input file in the given language to find out Named Entities
     :param file_path: the file to analyze
@@ -36,46 +52,123 @@ def analyze(file_path, language, output_path=None, custom_model=None, top_n=None
     :param output_path: the path to write the results to a file (they will be shown in console too)
     :param custom_model: the path to a custom model of your own (if used, the language parameter is ignored)
     :param top_n: the top number of named entities to list in the report that is printed at the end
+    :param streaming: if True, the file is read and analyzed in chunks (bounded memory, suitable for big files)
+    :param chunk_by: in streaming mode, whether to split the file by 'line' or by 'paragraph'
+    :param batch_size: in streaming mode, the number of chunks sent together to spaCy
+    :param n_process: in streaming mode, the number of processes used by spaCy (-1 to use all the cores)
+    :param html_mode: 'paged' to write the HTML with the highlighted entities (split in pages), 'off' to skip it
+    :param html_max_pages: if given, only the first N pages of HTML are written (a sample)
+    :param html_page_chars: the approximate size (in characters) of each HTML page
+    :param sketch_capacity: if given, the top entities are counted approximately with this number of counters per
+    entity type (bounded memory, for huge inputs)
+    :param result_cache: if given, the path of a database where the entities of each chunk are cached, so only the
+    new or changed chunks are analyzed when the file is analyzed again (the file is always read in chunks then)
+    :param gazetteer_mode: if given, a gazetteer of known entities is used: 'only' (without the model), 'merge' (with
+    the model) or 'triage' (the model only analyzes the chunks with known entities), the file is read in chunks then
+    :param gazetteer: the path of the gazetteer (by default, the one stored next to the custom model)
+    :param entities_format: if given, a record of each entity is written as it is found, in this format: 'jsonl' or
+    'columnar' (a directory with a binary file per column)
+    :param entities_output: the path of the entities output (by default, next to the input file)
     :return:
     """
     # Check that the input file exists
     if not os.path.exists(file_path):
         raise Exception(f'Input file does not exist: {file_path}')
 
-    # Load the model (custom or default)
-    if custom_model:
-        print(f'Loading custom model from {custom_model}')
-        nlp = load_custom_model(custom_model)
-    else:
-        print(f'Loading default spaCy model for {language}')
-        nlp = instantiate_default_model(language)
-
-    # Read the input file to analyze it
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    # Analyze the file
-    # It seems pretty simple because spaCy does all the work for us
-    # we just need to get the results and do something with them
-    # doc is a spaCy Doc object, filled with all the information after the analysis
-    # More info about it at the spaCy website: https://spacy.io/api/doc
-    doc: Doc = nlp(content)
-
-    # Now we are going to read the detected entities from the doc object, and count them
-    entity_type_counter = Counter()
-    specific_entities_count_by_type: Dict[str, Counter] = {}
-    for ent in doc.ents:
-        entity_type_counter.update([ent.label_])
-        if ent.label_ in specific_entities_count_by_type:
-            specific_entities_count_by_type[ent.label_].update([ent.text])
+    if gazetteer_mode:
+        gazetteer = gazetteer or (gazetteer_path_for_model(custom_model) if custom_model else None)
+        if not gazetteer or not os.path.exists(gazetteer):
+            raise Exception(f'The gazetteer file does not exist: {gazetteer}')
+        if result_cache:
+            raise Exception('The gazetteer modes cannot be combined with the result cache')
+
+    # Load the model (custom or default), it is not needed if only the gazetteer is used
+    with stage('load_model', 'analyze'):
+        if gazetteer_mode == GAZETTEER_ONLY:
+            nlp = None
+        elif custom_model:
+            print(f'Loading custom model from {custom_model}')
+            nlp = load_custom_model(custom_model)
         else:
-            specific_entities_count_by_type[ent.label_] = Counter([ent.text])
+            print(f'Loading default spaCy model for {language}')
+            nlp = instantiate_default_model(language)
+
+    # The report accumulates the counts of the detected entities
+    report = EntityReport(sketch_capacity=sketch_capacity)
+    html_file_path = file_path + '._HIGHLIGHTED.html'
+
+    # Also, using some of the spaCy utility functions, the detected entities are written to HTML pages
+    # (the pages are written as the content is analyzed, each one of a bounded size, with an index page)
+    html_writer = PaginatedHtmlWriter(html_file_path, lang=nlp.lang if nlp else language,
+                                      max_page_chars=html_page_chars,
+                                      max_pages=html_max_pages) if html_mode != HTML_OFF else None
+
+    # The entities can also be written (as they are found) in a structured format, to be used by other programs
+    if entities_format:
+        entities_output = entities_output or file_path + ENTITIES_OUTPUT_SUFFIXES[entities_format]
+    entity_writer = open_entity_writer(entities_output, entities_format) if entities_format else None
+
+    if gazetteer_mode:
+        # Read the file in chunks, and find the known entities (combined with the model, depending on the mode)
+        print(f'Loading gazetteer from {gazetteer}')
+        annotator = GazetteerAnnotator(Gazetteer.load(gazetteer), nlp, mode=gazetteer_mode)
+        chunks = read_text_chunks(file_path, chunk_by=chunk_by)
+        with stage('gazetteer_analysis', 'analyze'):
+            texts_with_context = ((text, (offset, text)) for offset, text in chunks)
+            for entities, (offset, text) in annotator.iter_entities(texts_with_context, batch_size=batch_size,
+                                                                    n_process=n_process):
+                _add_chunk_entities(report, html_writer, entity_writer, file_path, offset, text, entities)
+        print(f'Gazetteer ({gazetteer_mode}): {annotator.model_texts} of {annotator.texts} chunks analyzed by the '
+              f'model')
+    elif result_cache:
+        # Read the file in chunks, and only analyze the ones that are not in the cache yet (for this model)
+        chunks = read_text_chunks(file_path, chunk_by=chunk_by)
+        cache_model_id = model_identity(nlp, _custom_model_file_path(custom_model) if custom_model else None)
+        with ChunkResultCache(result_cache, cache_model_id) as cache, stage('cached_analysis', 'analyze'):
+            for offset, text, entities in iter_cached_chunk_entities(nlp, chunks, cache, batch_size=batch_size,
+                                                                     n_process=n_process):
+                _add_chunk_entities(report, html_writer, entity_writer, file_path, offset, text, entities)
+        print(f'Result cache: {cache.hits} chunks reused, {cache.misses} chunks analyzed')
+    elif streaming:
+        # Read the file in chunks and analyze them in batches, folding the entity counts into the report as we go
+        # (the inference is the time of the 'streaming' stage that is not spent in counting and rendering)
+        chunks = read_text_chunks(file_path, chunk_by=chunk_by)
+        with stage('streaming', 'analyze'):
+            for offset, doc in stream_docs(nlp, chunks, batch_size=batch_size, n_process=n_process):
+                with stage('count', 'analyze'):
+                    report.add_doc(doc)
+                if entity_writer:
+                    _write_doc_entities(entity_writer, file_path, offset, doc)
+                if html_writer:
+                    with stage('render', 'analyze'):
+                        html_writer.write_doc(doc)
+    else:
+        # Read the input file to analyze it
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+        # Analyze the file
+        # It seems pretty simple because spaCy does all the work for us
+        # we just need to get the results and do something with them
+        # doc is a spaCy Doc object, filled with all the information after the analysis
+        # More info about it at the spaCy website: https://spacy.io/api/doc
+        with stage('inference', 'analyze', chars=len(content)):
+            doc = nlp(content)
+
+        # Now we are going to read the detected entities from the doc object, and count them
+        with stage('count', 'analyze'):
+            report.add_doc(doc)
+
+        if entity_writer:
+            _write_doc_entities(entity_writer, file_path, 0, doc)
+
+        if html_writer:
+            with stage('render', 'analyze'):
+                for span in iter_page_spans(doc, max_chars=html_page_chars):
+                    html_writer.write_doc(span)
 
     # Prepare some messages with the counts to be printed in the console (or file)
-    entities_count_msg = f'==========\nEntity types:\t{entity_type_counter.most_common()}'
-    entities_by_type_msg = '==========\nEntities found by type:\n'
-    for entity_type, counter in specific_entities_count_by_type.items():
-        entities_by_type_msg += f'{entity_type.ljust(10)} =>\t{counter.most_common(top_n)}\n'
+    entities_count_msg, entities_by_type_msg = report.messages(top_n)
 
     # Print the messages (with our little reports) to console
     print(entities_count_msg)
@@ -83,18 +176,142 @@ def analyze(file_path, language, output_path=None, custom_model=None, top_n=None
 
     # if an output_path has been passed as a parameter, write the reports to the path
     if output_path:
+        _write_report(report, output_path, top_n)
+
+    if html_writer:
+        with stage('render', 'analyze'):
+            html_writer.close()
+        if len(html_writer.page_paths) == 0:
+            print('>>> NOTE: No HTML file has been written (the input is empty)')
+        else:
+            print('>>> NOTE: An HTML file with highlighted entities has been written to: ', html_file_path)
+        if len(html_writer.page_paths) > 1:
+            print(f'>>> (it is an index of {len(html_writer.page_paths)} pages, written next to it)')
+        print('>>> The HTML file can be opened with a Web browser (e.g. Firefox, Chrome...)')
+
+    if entity_writer:
+        with stage('write_entities', 'analyze'):
+            entity_writer.close()
+        print(f'>>> NOTE: {entity_writer.num_entities} entities have been written ({entities_format}) to: '
+              f'{entities_output}')
+
+
+def _add_chunk_entities(report, html_writer, entity_writer, doc_id, offset, text, entities):
+    """ Count the entities of a chunk given as (start, end, label), render them to HTML and write their records """
+    with stage('count', 'analyze'):
+        for start, end, label in entities:
+            report.add_entity(label, text[start:end])
+    if entity_writer:
+        with stage('write_entities', 'analyze'):
+            for start, end, label in entities:
+                entity_writer.write(doc_id, offset + start, offset + end, label, text[start:end])
+    if html_writer:
+        with stage('render', 'analyze'):
+            html_writer.write_entities(text, entities)
+
+
+def _write_doc_entities(entity_writer, doc_id, offset, doc):
+    """ Write the records of the entities of a spaCy Doc (of a chunk starting at offset) """
+    with stage('write_entities', 'analyze'):
+        for start, end, label, text in iter_entities(offset, doc):
+            entity_writer.write(doc_id, start, end, label, text)
+
+
+def analyze_corpus(files_glob, language, output_path=None, custom_model=None, top_n=None,
+                   chunk_by=CHUNK_BY_PARAGRAPH, batch_size=1000, num_workers=None, sketch_capacity=None,
+                   result_cache=None, entities_format=None):
+    """
+    Analyze many files using a pool of worker processes, and merge the results into a single corpus report
+    Each worker loads the model only once, and analyzes many files with it. A report is also written for each file,
+    next to it, with the suffix '._REPORT.txt' (no HTML files are generated in this mode)
+    :param files_glob: a glob pattern to select the files to analyze (e.g. 'my_corpus/**/*.txt')
+    :param language: the language to choose the correct spaCy default model (ignored if custom model is provided)
+    :param output_path: the path to write the corpus results to a file (they will be shown in console too)
+    :param custom_model: the path to a custom model of your own (if used, the language parameter is ignored)
+    :param top_n: the top number of named entities to list in the reports
+    :param chunk_by: whether to split each file by 'line' or by 'paragraph' to analyze it
+    :param batch_size: the number of chunks sent together to spaCy
+    :param num_workers: the number of worker processes (by default, the number of cores)
+    :param sketch_capacity: if given, the top entities are counted approximately with this number of counters per
+    entity type (bounded memory, the partial reports of the workers are merged as sketches too)
+    :param result_cache: if given, the path of a database where the entities of each chunk are cached, so only the
+    new or changed chunks are analyzed when the files are analyzed again
+    :param entities_format: if given, a record of each entity is written next to each file, in this format: 'jsonl'
+    or 'columnar'
+    :return: the EntityReport with the merged counts of the whole corpus
+    """
+    file_paths = sorted(path for path in glob.glob(files_glob, recursive=True)
+                        if os.path.isfile(path) and not path.endswith(_GENERATED_FILE_SUFFIXES)
+                        and not _is_inside_generated_dir(path))
+    if len(file_paths) == 0:
+        raise Exception(f'No input files found for: {files_glob}')
+    print(f'Analyzing {len(file_paths)} files...')
+
+    corpus_report = EntityReport(sketch_capacity=sketch_capacity)
+    worker_args = [(file_path, chunk_by, batch_size, sketch_capacity, entities_format) for file_path in file_paths]
+    with Pool(processes=num_workers, initializer=_init_corpus_worker,
+              initargs=(language, custom_model, result_cache)) as pool:
+        # the partial reports arrive as soon as each file is done (in any order), and are merged right away
+        for file_path, file_report in pool.imap_unordered(_analyze_corpus_file, worker_args):
+            with stage('merge_report', 'analyze'):
+                corpus_report.merge(file_report)
+            _write_report(file_report, file_path + '._REPORT.txt', top_n)
+
+    entities_count_msg, entities_by_type_msg = corpus_report.messages(top_n)
+    print(entities_count_msg)
+    print(entities_by_type_msg)
+    if output_path:
+        _write_report(corpus_report, output_path, top_n)
+    print(f'>>> NOTE: A report for each of the {len(file_paths)} files has been written next to it (._REPORT.txt)')
+    return corpus_report
+
+
+def _init_corpus_worker(language, custom_model, result_cache):
+    """ Initialization of each worker process of the corpus mode: load the model once (and open the result cache) """
+    global _worker_nlp, _worker_result_cache
+    if custom_model:
+        _worker_nlp = load_custom_model(custom_model)
+    else:
+        _worker_nlp = instantiate_default_model(language)
+    if result_cache:
+        cache_model_id = model_identity(_worker_nlp, _custom_model_file_path(custom_model) if custom_model else None)
+        _worker_result_cache = ChunkResultCache(result_cache, cache_model_id)
+
+
+def _analyze_corpus_file(args):
+    """ The work done by the corpus mode workers: analyze a file and return its partial report """
+    file_path, chunk_by, batch_size, sketch_capacity, entities_format = args
+    report = EntityReport(sketch_capacity=sketch_capacity)
+    chunks = read_text_chunks(file_path, chunk_by=chunk_by)
+    entity_writer = open_entity_writer(file_path + ENTITIES_OUTPUT_SUFFIXES[entities_format],
+                                       entities_format) if entities_format else None
+    if _worker_result_cache is not None:
+        for offset, text, entities in iter_cached_chunk_entities(_worker_nlp, chunks, _worker_result_cache,
+                                                                 batch_size=batch_size):
+            _add_chunk_entities(report, None, entity_writer, file_path, offset, text, entities)
+    else:
+        for offset, doc in stream_docs(_worker_nlp, chunks, batch_size=batch_size):
+            report.add_doc(doc)
+            if entity_writer:
+                _write_doc_entities(entity_writer, file_path, offset, doc)
+    if entity_writer:
+        entity_writer.close()
+    return file_path, report
+
+
+def _is_inside_generated_dir(path):
+    """ True if the path is inside a directory generated by the analysis (e.g. a columnar entities output) """
+    return any(part.endswith(_GENERATED_FILE_SUFFIXES) for part in os.path.normpath(path).split(os.sep)[:-1])
+
+
+def _write_report(report, output_path, top_n):
+    """ Write the messages of a report to a file """
+    with stage('write_report', 'analyze'):
+        entities_count_msg, entities_by_type_msg = report.messages(top_n)
         with open(output_path, 'w', encoding='utf-8') as f:
             f.write(entities_count_msg + '\n')
             f.write(entities_by_type_msg + '\n')
 
-    # Also, using some of the spaCy utility functions, print the detected entities to an HTML page
-    html = displacy.render(doc, style="ent", page=True)
-    html_file_path = file_path + '._HIGHLIGHTED.html'
-    with open(html_file_path, 'w', encoding='utf-8') as f:
-        print('>>> NOTE: Writing an HTML file with highlighted entities to: ', html_file_path)
-        f.write(html)
-        print('>>> The HTML file can be opened with a Web browser (e.g. Firefox, Chrome...)')
-
 
 def instantiate_default_model(language):
     """ Load an spaCy default model for the given language """
@@ -102,29 +319,103 @@ def instantiate_default_model(language):
         raise Exception(f'The language {language} is not valid. Use one of: {LANG_MODELS.keys()}')
 
     model_name = LANG_MODELS[language]
-    nlp = spacy.load(model_name)
+    # spaCy is only imported when a model is loaded (importing it is slow, and many commands do not need it)
+    import spacy
+    # the loaded models are kept in an LRU cache, so loading the same model again in this process is almost free
+    nlp = loaded_models.get_or_load(model_name, lambda: spacy.load(model_name))
     return nlp
 
 
 def load_custom_model(model_path):
     """ Load a custom model from the given path """
     print('Loading custom model: {}'.format(model_path))
-    model_zip_path = model_path if model_path.endswith('.zip') else model_path + '.zip'
-    shutil.unpack_archive(model_zip_path, extract_dir=model_zip_path[:-4])
-    nlp = spacy.load(model_zip_path[:-4])  # remove the.zip extension, and there you should have your path
-    nlp.add_pipe(nlp.create_pipe('sentencizer'))
+    if is_model_snapshot(model_path):
+        # a snapshot is loaded directly from its single file (no extraction, no directory to parse), and it is cached
+        # while the file does not change
+        stat = os.stat(model_path)
+        snapshot_key = f'snapshot:{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}'
+        return loaded_models.get_or_load(snapshot_key, lambda: _add_sentencizer(load_model_snapshot(model_path)))
+    model_zip_path = _custom_model_file_path(model_path)
+    # the zip is only extracted the first time, to a cache directory named after the hash of its content
+    extracted_model_path = extract_model_archive(model_zip_path)
+    nlp = loaded_models.get_or_load(extracted_model_path, lambda: _load_extracted_custom_model(extracted_model_path))
+    return nlp
+
+
+def _custom_model_file_path(model_path):
+    """ The path of the file of a custom model, a snapshot or a zip (the .zip extension can be omitted) """
+    if is_model_snapshot(model_path) or model_path.endswith('.zip'):
+        return model_path
+    return model_path + '.zip'
+
+
+def _load_extracted_custom_model(extracted_model_path):
+    """ Load a custom model that has already been extracted (a zipped snapshot or a spaCy model directory) """
+    zipped_snapshot_path = os.path.join(extracted_model_path, ZIPPED_SNAPSHOT_NAME)
+    if os.path.exists(zipped_snapshot_path):
+        return _add_sentencizer(load_model_snapshot(zipped_snapshot_path))
+    import spacy
+    return _add_sentencizer(spacy.load(extracted_model_path))
+
+
+def _add_sentencizer(nlp):
+    """ Add a sentencizer to a custom model, if it does not have one yet (a snapshot may already contain it) """
+    if 'sentencizer' not in nlp.pipe_names:
+        nlp.add_pipe(nlp.create_pipe('sentencizer'))
     return nlp
 
 
 def configure_argument_parser():
     """ Console arguments parser configuration """
     parser = argparse.ArgumentParser(description='Perform NERC over a file content.', add_help=True)
-    parser.add_argument('--file', type=str, required=True, help='Path to the file to be processed')
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument('--file', type=str, help='Path to the file to be processed')
+    input_group.add_argument('--files_glob', type=str,
+                             help='Glob pattern of many files to be processed in corpus mode (e.g. "corpus/**/*.txt")')
     parser.add_argument('--lang', type=str, choices=['en', 'fr', 'es'], default='fr', help='Language of the input')
     parser.add_argument('--output', type=str, required=False, help='Optional path to file to write the results')
     parser.add_argument('--custom_model', type=str, required=False,
                         help='Path to a custom model you have trained or downloaded from elsewhere')
     parser.add_argument('--top_n', type=int, default=10, help='Top N entities to print in the output report')
+    parser.add_argument('--sketch_capacity', type=int, required=False,
+                        help='Count the top entities approximately, with this number of counters per entity type '
+                             '(bounded memory, for huge inputs)')
+    parser.add_argument('--result_cache', type=str, required=False,
+                        help='Path to a database to cache the entities of each chunk, so re-analyzing a file only '
+                             'analyzes the new or changed chunks')
+    parser.add_argument('--gazetteer_mode', type=str, choices=GAZETTEER_MODES, required=False,
+                        help='Use a gazetteer of known entities: alone (only), with the model (merge), or to choose '
+                             'which chunks the model analyzes (triage)')
+    parser.add_argument('--gazetteer', type=str, required=False,
+                        help='Path to the gazetteer (by default, the one stored next to the custom model)')
+    parser.add_argument('--entities_format', type=str, choices=ENTITIES_FORMATS, required=False,
+                        help='Write a record of each entity (doc, start, end, label, text) in this format, next to '
+                             'the input file (JSON lines, or a columnar binary directory)')
+    parser.add_argument('--entities_output', type=str, required=False,
+                        help='Path of the entities output of a single file (by default, next to the input file)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Read and analyze the file in chunks (bounded memory, suitable for big files)')
+    parser.add_argument('--chunk_by', type=str, choices=CHUNK_MODES, default=CHUNK_BY_PARAGRAPH,
+                        help='In streaming mode, how to split the input file in chunks')
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help='In streaming mode, number of chunks sent together to spaCy')
+    parser.add_argument('--n_process', type=int, default=1,
+                        help='In streaming mode, number of processes used by spaCy (-1 to use all the cores)')
+    parser.add_argument('--num_workers', type=int, default=None,
+                        help='In corpus mode, number of worker processes (by default, the number of cores)')
+    parser.add_argument('--html', type=str, choices=HTML_MODES, required=False,
+                        help='Write the HTML with the highlighted entities (split in pages, the default), or turn it '
+                             'off')
+    parser.add_argument('--html_max_pages', type=int, required=False,
+                        help='Only write the first N pages of HTML (a sample of the content)')
+    parser.add_argument('--html_page_chars', type=int, default=DEFAULT_MAX_PAGE_CHARS,
+                        help='Approximate size (in characters) of each HTML page')
+    parser.add_argument('--profile', action='store_true',
+                        help='Measure the time of each stage of the analysis, and print a summary at the end')
+    parser.add_argument('--profile_trace', type=str, required=False,
+                        help='Path to write the profile as a Chrome trace JSON file (implies --profile)')
+    parser.add_argument('--profile_memory', action='store_true',
+                        help='Also measure the peak of memory of each stage, slower (implies --profile)')
     return parser
 
 
@@ -132,5 +423,32 @@ if __name__ == '__main__':
     parser = configure_argument_parser()
     params = parser.parse_args()
 
-    analyze(file_path=params.file, language=params.lang, output_path=params.output, custom_model=params.custom_model,
-            top_n=params.top_n)
+    # (in corpus mode, only the stages of the main process are profiled)
+    with tracing_session(trace_path=params.profile_trace, trace_memory=params.profile_memory,
+                         enabled=params.profile or params.profile_trace or params.profile_memory):
+        if params.files_glob:
+            # the corpus mode writes no HTML and does not use gazetteers, so those options are not accepted
+            single_file_options = [option for option, value in [('--gazetteer_mode', params.gazetteer_mode),
+                                                                ('--gazetteer', params.gazetteer),
+                                                                ('--html', params.html not in (None, HTML_OFF)),
+                                                                ('--html_max_pages', params.html_max_pages is not None),
+                                                                ('--entities_output', params.entities_output)]
+                                   if value]
+            if len(single_file_options) > 0:
+                parser.error(f'{", ".join(single_file_options)} cannot be used in corpus mode (--files_glob)')
+            analyze_corpus(files_glob=params.files_glob, language=params.lang, output_path=params.output,
+                           custom_model=params.custom_model, top_n=params.top_n, chunk_by=params.chunk_by,
+                           batch_size=params.batch_size, num_workers=params.num_workers,
+                           sketch_capacity=params.sketch_capacity, result_cache=params.result_cache,
+                           entities_format=params.entities_format)
+        else:
+            if params.html_max_pages is not None and params.html_max_pages < 1:
+                parser.error('--html_max_pages must be at least 1')
+            analyze(file_path=params.file, language=params.lang, output_path=params.output,
+                    custom_model=params.custom_model, top_n=params.top_n, streaming=params.streaming,
+                    chunk_by=params.chunk_by, batch_size=params.batch_size, n_process=params.n_process,
+                    html_mode=params.html or HTML_PAGED, html_max_pages=params.html_max_pages,
+                    html_page_chars=params.html_page_chars, sketch_capacity=params.sketch_capacity,
+                    result_cache=params.result_cache, gazetteer_mode=params.gazetteer_mode,
+                    gazetteer=params.gazetteer, entities_format=params.entities_format,
+                    entities_output=params.entities_output)
@@ -0,0 +1,95 @@
+"""
+Helpers to analyze big input files in a streaming fashion.
+
+Instead of reading the whole file and analyzing it with a single nlp(content) call, the file is read in small chunks
+(lines or paragraphs) that are sent to spaCy with nlp.pipe. This way the memory usage does not grow with the size of
+the file, the spaCy max_length limit is not hit, and several processes can be used to analyze the chunks.
+
+Each chunk keeps the character offset where it starts in the file, so the offsets of the detected entities can be
+translated back to global offsets (the same ones you would get analyzing the whole content at once).
+"""
+
+CHUNK_BY_LINE = 'line'
+CHUNK_BY_PARAGRAPH = 'paragraph'
+CHUNK_MODES = [CHUNK_BY_LINE, CHUNK_BY_PARAGRAPH]
+
+# A limit to the size of a single chunk, well below the default spaCy max_length (1,000,000 characters)
+DEFAULT_MAX_CHUNK_CHARS = 100000
+
+
+def read_text_chunks(file_path, chunk_by=CHUNK_BY_PARAGRAPH, max_chunk_chars=DEFAULT_MAX_CHUNK_CHARS):
+    """
+    Read a text file lazily, chunk by chunk
+    :param file_path: the file to read
+    :param chunk_by: 'line' to get one chunk per line, 'paragraph' to get one chunk per block of non-empty lines
+    :param max_chunk_chars: chunks longer than this are split (at a whitespace if possible)
+    :return: a generator of tuples (offset, text), where offset is the character offset of the chunk in the file
+    """
+    if chunk_by not in CHUNK_MODES:
+        raise Exception(f'The chunk mode {chunk_by} is not valid. Use one of: {CHUNK_MODES}')
+
+    offset = 0
+    pending_lines = []
+    pending_offset = 0
+    pending_length = 0
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if chunk_by == CHUNK_BY_LINE:
+                yield from _split_long_chunk(offset, line, max_chunk_chars)
+                offset += len(line)
+                continue
+
+            if len(pending_lines) == 0:
+                pending_offset = offset
+            pending_lines.append(line)
+            pending_length += len(line)
+            offset += len(line)
+            # an empty line is a paragraph boundary (also flush if the paragraph is getting too long)
+            if len(line.strip()) == 0 or pending_length >= max_chunk_chars:
+                yield from _split_long_chunk(pending_offset, ''.join(pending_lines), max_chunk_chars)
+                pending_lines = []
+                pending_length = 0
+
+    # pick the last one
+    if len(pending_lines) > 0:
+        yield from _split_long_chunk(pending_offset, ''.join(pending_lines), max_chunk_chars)
+
+
+def _split_long_chunk(offset, text, max_chunk_chars):
+    """ Split a chunk that is too long into smaller pieces, skipping the ones that only contain whitespace """
+    while len(text) > max_chunk_chars:
+        # try to cut at the last whitespace, so no word is split in two
+        cut = max(text.rfind(' ', 0, max_chunk_chars), text.rfind('\n', 0, max_chunk_chars)) + 1
+        if cut <= 0:
+            cut = max_chunk_chars
+        if len(text[:cut].strip()) > 0:
+            yield offset, text[:cut]
+        offset += cut
+        text = text[cut:]
+    if len(text.strip()) > 0:
+        yield offset, text
+
+
+def stream_docs(nlp, chunks, batch_size=1000, n_process=1):
+    """
+    Analyze the chunks using spaCy nlp.pipe
+    :param nlp: the spaCy model
+    :param chunks: an iterable of tuples (offset, text), like the ones generated by read_text_chunks
+    :param batch_size: the number of chunks sent together to spaCy
+    :param n_process: the number of processes used by spaCy (-1 to use all the cores)
+    :return: a generator of tuples (offset, doc), where doc is the spaCy Doc of the chunk starting at offset
+    """
+    texts_with_offsets = ((text, offset) for offset, text in chunks)
+    for doc, offset in nlp.pipe(texts_with_offsets, as_tuples=True, batch_size=batch_size, n_process=n_process):
+        yield offset, doc
+
+
+def iter_entities(offset, doc):
+    """
+    Get the entities of a chunk with global offsets
+    :param offset: the character offset of the chunk in the file
+    :param doc: the spaCy Doc of the chunk
+    :return: a generator of tuples (start, end, label, text)
+    """
+    for ent in doc.ents:
+        yield offset + ent.start_char, offset + ent.end_char, ent.label_, ent.text
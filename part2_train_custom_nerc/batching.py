@@ -0,0 +1,89 @@
+"""
+Batching of the training instances.
+
+The batches are generated lazily (they are never materialized all at once), and the instances are grouped by length:
+the shuffled instances are taken in windows of several batches, each window is sorted by length and cut into batches,
+and the batches of the window are shuffled. This way each batch contains instances of similar length (less padding,
+and a more uniform cost per batch), while the order of the training is still random.
+
+The size of the batches can be measured in sentences or in words (a token budget), and it can be constant or grow
+from a start size to an end size (compounding), like spaCy recommends.
+"""
+import itertools
+import math
+import random
+
+BATCH_UNIT_SENTENCES = 'sentences'
+BATCH_UNIT_WORDS = 'words'
+BATCH_UNITS = [BATCH_UNIT_SENTENCES, BATCH_UNIT_WORDS]
+
+
+def compute_instance_lengths(instances):
+    """ The length (number of words) of each instance, the tokens of the texts are separated by spaces """
+    return [text.count(' ') + 1 for text, _ in instances]
+
+
+def iter_length_bucketed_batches(instances, lengths, batch_size=32, batch_size_end=None, compound_rate=1.001,
+                                 batch_unit=BATCH_UNIT_SENTENCES, bucket_window=16):
+    """
+    Lazily generate shuffled batches of instances of similar length
+    :param instances: the instances in spaCy format (a list, or any sequence that can be accessed by index)
+    :param lengths: the length of each instance (see compute_instance_lengths)
+    :param batch_size: the size of the batches (or the starting size, if batch_size_end is given)
+    :param batch_size_end: if given, the size of the batches grows (compounding) from batch_size up to this size
+    :param compound_rate: the rate at which the size of the batches grows
+    :param batch_unit: the unit of the batch size, 'sentences' or 'words' (a batch has at least one sentence)
+    :param bucket_window: the number of batches sorted by length together
+    :return: a generator of batches (lists of instances)
+    """
+    if batch_unit not in BATCH_UNITS:
+        raise Exception(f'The batch unit {batch_unit} is not valid. Use one of: {BATCH_UNITS}')
+
+    shuffled_indices = list(range(len(instances)))
+    random.shuffle(shuffled_indices)
+
+    if batch_size_end:
+        from spacy.util import compounding
+        batch_sizes = compounding(batch_size, batch_size_end, compound_rate)
+    else:
+        batch_sizes = itertools.repeat(batch_size)
+
+    # the number of sentences of a window (when the unit is words, assume that a sentence has 25 words on average)
+    window_size = bucket_window * max(batch_size, batch_size_end or 0)
+    if batch_unit == BATCH_UNIT_WORDS:
+        window_size = max(1, window_size // 25)
+
+    for window_start in range(0, len(shuffled_indices), window_size):
+        window = sorted(shuffled_indices[window_start:window_start + window_size], key=lengths.__getitem__)
+        batches = list(_cut_batches(window, lengths, batch_sizes, batch_unit))
+        random.shuffle(batches)
+        for batch in batches:
+            yield [instances[i] for i in batch]
+
+
+def _cut_batches(sorted_indices, lengths, batch_sizes, batch_unit):
+    """ Cut a list of instance indices into batches, taking the size of each batch from the batch_sizes generator """
+    batch = []
+    batch_amount = 0
+    batch_size = next(batch_sizes)
+    for i in sorted_indices:
+        amount = lengths[i] if batch_unit == BATCH_UNIT_WORDS else 1
+        if len(batch) > 0 and batch_amount + amount > batch_size:
+            yield batch
+            batch = []
+            batch_amount = 0
+            batch_size = next(batch_sizes)
+        batch.append(i)
+        batch_amount += amount
+    if len(batch) > 0:
+        yield batch
+
+
+def estimate_num_batches(num_instances, batch_size, batch_size_end=None, batch_unit=BATCH_UNIT_SENTENCES,
+                         bucket_window=16):
+    """ The number of batches of an epoch, if it can be known in advance (constant sentence batches), None otherwise """
+    if batch_size_end or batch_unit != BATCH_UNIT_SENTENCES:
+        return None
+    window_size = bucket_window * batch_size
+    full_windows, last_window = divmod(num_instances, window_size)
+    return full_windows * bucket_window + math.ceil(last_window / batch_size)
@@ -0,0 +1,169 @@
+"""
+Asynchronous checkpointing of the models during the training.
+
+Writing a model to disk and compressing it takes a lot of time, and the training would be stopped meanwhile. Instead,
+the model is only serialized to bytes in the training thread (a fast, in-memory operation), and a background thread
+takes care of writing it to disk and compressing it, while the training goes on. At most one serialized model waits
+for the background thread (besides the one being written), if the training is faster than the disk it waits, instead
+of accumulating copies of the model in memory.
+
+The zip files written contain a model snapshot (see part1_use_a_nerc.model_snapshot) made directly from the serialized
+bytes, and part1_use_a_nerc.run_nerc loads them like any other zipped model (the compression level can be chosen,
+level 0 means an uncompressed zip, which is much faster to write). The checkpoints can also be written as plain
+snapshots, a single file that is the fastest to write and to load, or as zips of a spaCy model directory (the ones that
+spacy.load reads once extracted), which are the slowest to write: the model has to be rebuilt from its bytes to call
+nlp.to_disk. Optionally, only the best K checkpoints (by fscore) are kept, the rest are deleted.
+"""
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import zipfile
+
+from instrumentation.tracing import stage
+from part1_use_a_nerc.model_snapshot import model_from_bytes, write_model_snapshot, write_model_snapshot_content, \
+    SNAPSHOT_SUFFIX, ZIPPED_SNAPSHOT_NAME
+
+CHECKPOINT_ZIP = 'zip'
+CHECKPOINT_SNAPSHOT = 'snapshot'
+CHECKPOINT_SPACY_ZIP = 'spacy_zip'
+CHECKPOINT_FORMATS = [CHECKPOINT_ZIP, CHECKPOINT_SNAPSHOT, CHECKPOINT_SPACY_ZIP]
+
+
+class CheckpointWriter:
+    """ Writes the checkpoints of a training in a background thread """
+
+    def __init__(self, output_model_dir, compression_level=6, keep_top_k=None, checkpoint_format=CHECKPOINT_ZIP):
+        """
+        :param output_model_dir: the directory to store the checkpoints
+        :param compression_level: the zip compression level, from 0 (no compression, fastest) to 9 (smallest files)
+        :param keep_top_k: if given, only the best K checkpoints (by fscore) are kept
+        :param checkpoint_format: 'zip' (a zipped model snapshot), 'snapshot' (a model snapshot file) or 'spacy_zip'
+        (a zip of the spaCy model directory, slower to write)
+        """
+        if checkpoint_format not in CHECKPOINT_FORMATS:
+            raise Exception(f'The checkpoint format {checkpoint_format} is not valid. Use one of: {CHECKPOINT_FORMATS}')
+        self.output_model_dir = output_model_dir
+        self.checkpoint_format = checkpoint_format
+        self.compression_level = compression_level
+        self.keep_top_k = keep_top_k
+        # the (fscore, path) of the checkpoints written so far (and not deleted)
+        self.checkpoints = []
+        self._error = None
+        # at most one checkpoint waits to be written, so submit blocks (backpressure) if the disk is slower
+        self._pending = queue.Queue(maxsize=1)
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, model_name, fscore, nlp, optimizer):
+        """
+        Serialize the model (in the calling thread), it will be written to disk in the background
+        It blocks if there is already a checkpoint waiting to be written
+        :param model_name: the name of the checkpoint file
+        :param fscore: the fscore of the model (to choose the best checkpoints)
+        :param nlp: the spaCy model to store
+        :param optimizer: the spaCy optimizer used in the training (necessary to correctly store the spaCy model)
+        :return:
+        """
+        self._raise_background_error()
+        with nlp.use_params(optimizer.averages):
+            model_bytes = nlp.to_bytes()
+            meta = dict(nlp.meta)
+        self._pending.put((model_name, fscore, meta, model_bytes))
+
+    def close(self):
+        """ Wait until all the submitted checkpoints have been written """
+        self._pending.put(None)
+        self._worker.join()
+        self._raise_background_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # the training failed: the error of a checkpoint is only reported, so that it does not hide the original error
+        try:
+            self.close()
+        except Exception as e:
+            print(f'{e}: {e.__cause__}')
+
+    def _raise_background_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise Exception('A checkpoint could not be written') from error
+
+    def _run(self):
+        """ The loop of the background thread """
+        while True:
+            checkpoint = self._pending.get()
+            if checkpoint is None:
+                return
+            try:
+                model_name, fscore, meta, model_bytes = checkpoint
+                with stage('write_checkpoint', 'checkpoint'):
+                    if self.checkpoint_format == CHECKPOINT_SNAPSHOT:
+                        model_path = self._write_snapshot(model_name, meta, model_bytes)
+                    else:
+                        model_path = self._write_checkpoint(model_name, meta, model_bytes)
+                # the serialized model is not kept in memory while waiting for the next checkpoint
+                del checkpoint, meta, model_bytes
+                print("Model saved to {}".format(os.path.abspath(model_path)))
+                self._keep_best_checkpoints(fscore, model_path)
+            except Exception as e:
+                self._error = e
+
+    def _write_checkpoint(self, model_name, meta, model_bytes):
+        """ Write a serialized model to a zip file, and return the path of the zip """
+        os.makedirs(os.path.abspath(self.output_model_dir), exist_ok=True)
+        model_zip_path = os.path.join(self.output_model_dir, model_name + '.zip')
+        compression = zipfile.ZIP_DEFLATED if self.compression_level > 0 else zipfile.ZIP_STORED
+        with tempfile.TemporaryDirectory(dir=self.output_model_dir) as tmp_dir:
+            tmp_zip_path = os.path.join(tmp_dir, '.checkpoint.zip')
+            with zipfile.ZipFile(tmp_zip_path, 'w', compression=compression,
+                                 compresslevel=self.compression_level or None) as model_zip:
+                if self.checkpoint_format == CHECKPOINT_ZIP:
+                    # the bytes are written as they are, the model is not rebuilt in this thread
+                    with model_zip.open(ZIPPED_SNAPSHOT_NAME, 'w') as snapshot_file:
+                        write_model_snapshot_content(meta, model_bytes, snapshot_file)
+                else:
+                    self._write_model_directory(model_zip, meta, model_bytes, tmp_dir)
+            # the zip is moved to its place only when it is complete
+            shutil.move(tmp_zip_path, model_zip_path)
+        return model_zip_path
+
+    @staticmethod
+    def _write_model_directory(model_zip, meta, model_bytes, tmp_dir):
+        """ Add the files of the spaCy model directory to a zip """
+        # the directory layout of spacy.load can only be written by nlp.to_disk, so (only for this format) the whole
+        # model is rebuilt from its bytes here: a slow, GIL-bound work that competes with the training thread, and a
+        # second copy of the model in memory while it is written
+        nlp = model_from_bytes(meta, model_bytes)
+        model_dir = os.path.join(tmp_dir, 'model')
+        nlp.to_disk(model_dir)
+        del nlp
+        for dir_path, _, file_names in os.walk(model_dir):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                model_zip.write(file_path, arcname=os.path.relpath(file_path, model_dir))
+
+    def _write_snapshot(self, model_name, meta, model_bytes):
+        """ Write a serialized model as a snapshot file, and return its path """
+        os.makedirs(os.path.abspath(self.output_model_dir), exist_ok=True)
+        snapshot_path = os.path.join(self.output_model_dir, model_name + SNAPSHOT_SUFFIX)
+        write_model_snapshot(meta, model_bytes, snapshot_path)
+        return snapshot_path
+
+    def _keep_best_checkpoints(self, fscore, model_zip_path):
+        """ Register a new checkpoint, and delete the ones that are not in the best K anymore """
+        self.checkpoints.append((fscore, model_zip_path))
+        self.checkpoints.sort(key=lambda checkpoint: checkpoint[0], reverse=True)
+        if self.keep_top_k is None:
+            return
+        for _, discarded_path in self.checkpoints[self.keep_top_k:]:
+            print(f'Deleting checkpoint (not in the best {self.keep_top_k} anymore): {discarded_path}')
+            os.remove(discarded_path)
+        self.checkpoints = self.checkpoints[:self.keep_top_k]
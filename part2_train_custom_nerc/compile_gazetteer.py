@@ -0,0 +1,65 @@
+"""
+Compiles a gazetteer (a list of known entities, see part1_use_a_nerc.gazetteer) from the annotated training data, and
+stores it next to a trained model, so it can be used when analyzing files with that model (--gazetteer_mode).
+
+Example:
+    python -m part2_train_custom_nerc.compile_gazetteer --train_data data/train.txt --model models/nerc_model.zip
+"""
+import argparse
+import os
+
+from part1_use_a_nerc.gazetteer import Gazetteer, gazetteer_path_for_model, GAZETTEER_ONLY
+from part2_train_custom_nerc.data_conversion import read_spacy_nerc_instances_from_file
+from part2_train_custom_nerc.evaluation import evaluate
+
+
+def compile_gazetteer(train_set_path, output_path, min_count=2, min_precision=0.6, eval_set_path=None):
+    """
+    Compile a gazetteer from the entities annotated in the training data, and write it to a file
+    :param train_set_path: path to the training set file in the correct format
+    :param output_path: path of the gazetteer file (JSON)
+    :param min_count: minimum number of times that an entity must be annotated to be in the gazetteer
+    :param min_precision: minimum ratio of the matches of an entity (in the training data) that are annotated
+    :param eval_set_path: if given, the gazetteer alone is evaluated on this data (e.g. the development set)
+    :return: the Gazetteer
+    """
+    print('Converting training input data...')
+    train_instances = read_spacy_nerc_instances_from_file(train_set_path)
+    print('Compiling the gazetteer...')
+    gazetteer = Gazetteer.compile(train_instances, min_count=min_count, min_precision=min_precision)
+    gazetteer.save(output_path)
+    print(f'Gazetteer with {len(gazetteer)} known entities saved to {os.path.abspath(output_path)}')
+
+    if eval_set_path:
+        scores = evaluate(read_spacy_nerc_instances_from_file(eval_set_path), None, gazetteer=gazetteer,
+                          gazetteer_mode=GAZETTEER_ONLY)
+        print('Scores of the gazetteer alone:', [f'{score_name.upper()}:{score_value:1.4f}'
+                                                 for score_name, score_value in scores.list_scores()])
+    return gazetteer
+
+
+def configure_argument_parser():
+    """ Console arguments parser configuration """
+    parser = argparse.ArgumentParser(description='Compile a gazetteer of known entities from the training data.',
+                                     add_help=True)
+    parser.add_argument('--train_data', type=str, required=True, help='Path to the training data')
+    output_group = parser.add_mutually_exclusive_group(required=True)
+    output_group.add_argument('--model', type=str,
+                              help='Path to the trained model, the gazetteer is stored next to it')
+    output_group.add_argument('--output', type=str, help='Path to store the gazetteer (JSON)')
+    parser.add_argument('--min_count', type=int, default=2,
+                        help='Minimum number of times that an entity must be annotated to be in the gazetteer')
+    parser.add_argument('--min_precision', type=float, default=0.6,
+                        help='Minimum ratio of the matches of an entity in the training data that are annotated')
+    parser.add_argument('--eval_data', type=str, required=False,
+                        help='Optional path to data (e.g. the development set) to evaluate the gazetteer alone')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = configure_argument_parser()
+    params = parser.parse_args()
+
+    compile_gazetteer(train_set_path=params.train_data,
+                      output_path=params.output or gazetteer_path_for_model(params.model),
+                      min_count=params.min_count, min_precision=params.min_precision, eval_set_path=params.eval_data)
@@ -0,0 +1,166 @@
+"""
+A persistent binary cache of the converted training corpora.
+
+Converting the BIO files to the spaCy format before each training takes time, so the converted instances can be
+stored in a compact binary file, named after the hash of the source file and the version of the converter (so the
+cache is rebuilt if any of them changes).
+
+The binary file is memory-mapped when it is loaded, so the instances are only decoded when they are accessed, by
+index (e.g. following a shuffled list of indices), and they do not need to be kept in memory.
+
+The layout of the binary file (all the integers are little-endian, int64 unless said otherwise):
+
+    magic (8 bytes) | format version (uint32) + padding | num_instances | num_entities | labels_length
+    labels (JSON list of the entity labels, padded to 8 bytes)
+    text_offsets     (num_instances + 1 byte offsets in the texts section)
+    entity_offsets   (num_instances + 1 indices of the first entity of each instance)
+    entities         (num_entities rows of: start, end, label index)
+    texts            (the UTF-8 texts of all the instances, one after the other)
+"""
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+
+from part2_train_custom_nerc.data_conversion import CONVERTER_VERSION, iter_spacy_nerc_instances_from_file
+
+_MAGIC = b'NERCCORP'
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct('<8sIxxxxQQQ')
+_INT64_SIZE = 8
+
+
+class CachedCorpus:
+    """ A read-only sequence of training instances in spaCy format, backed by a memory-mapped cache file """
+
+    def __init__(self, cache_path):
+        """
+        :param cache_path: the path of a cache file written by build_corpus_cache
+        """
+        self.cache_path = cache_path
+        self._file = open(cache_path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, format_version, self._num_instances, num_entities, labels_length = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or format_version != _FORMAT_VERSION:
+            raise Exception(f'The file is not a valid corpus cache (or it has an old format): {cache_path}')
+        position = _HEADER.size
+        self.labels = json.loads(bytes(self._mmap[position:position + labels_length]).decode('utf-8'))
+        position += _padded_length(labels_length)
+
+        # the integer sections are read directly from the memory-mapped file, without copying them
+        memory = memoryview(self._mmap)
+        self._text_offsets, position = _int64_section(memory, position, self._num_instances + 1)
+        self._entity_offsets, position = _int64_section(memory, position, self._num_instances + 1)
+        self._entities, position = _int64_section(memory, position, 3 * num_entities)
+        self._texts_position = position
+
+    def __len__(self):
+        return self._num_instances
+
+    def __getitem__(self, index):
+        """ Decode the instance at the given index, as a tuple (text, {"entities": [(start, end, label), ...]}) """
+        if index < 0:
+            index += self._num_instances
+        if not 0 <= index < self._num_instances:
+            raise IndexError(f'Instance index out of range: {index}')
+        text_start = self._texts_position + self._text_offsets[index]
+        text_end = self._texts_position + self._text_offsets[index + 1]
+        text = self._mmap[text_start:text_end].decode('utf-8')
+        entities = [(self._entities[3 * i], self._entities[3 * i + 1], self.labels[self._entities[3 * i + 2]])
+                    for i in range(self._entity_offsets[index], self._entity_offsets[index + 1])]
+        return text, {"entities": entities}
+
+    def __iter__(self):
+        for index in range(self._num_instances):
+            yield self[index]
+
+    def close(self):
+        """ Release the memory-mapped file (the instances cannot be accessed anymore) """
+        self._text_offsets.release()
+        self._entity_offsets.release()
+        self._entities.release()
+        self._mmap.close()
+        self._file.close()
+
+
+def _int64_section(memory, position, length):
+    """ A view of a section of int64 values, and the position where the next section starts """
+    end = position + length * _INT64_SIZE
+    return memory[position:end].cast('q'), end
+
+
+def _padded_length(length):
+    """ The length rounded up to a multiple of 8 bytes, to keep the integer sections aligned """
+    return (length + _INT64_SIZE - 1) // _INT64_SIZE * _INT64_SIZE
+
+
+def corpus_cache_path(source_path, cache_dir):
+    """ The path of the cache file for a source file, named after the hash of its content and the converter version """
+    sha256 = hashlib.sha256(f'converter-{CONVERTER_VERSION}-format-{_FORMAT_VERSION}'.encode('utf-8'))
+    with open(source_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return os.path.join(cache_dir, f'{os.path.basename(source_path)}.{sha256.hexdigest()[:24]}.corpus')
+
+
+def build_corpus_cache(source_path, cache_path, num_workers=1):
+    """
+    Convert a BIO file to the spaCy format and store the converted instances in a binary cache file
+    :param source_path: the path of the file with the training data (token tag per line)
+    :param cache_path: the path of the cache file to write
+    :param num_workers: if greater than 1, the file is converted in parallel by this number of processes
+    :return:
+    """
+    label_indices = {}
+    text_offsets = array('q', [0])
+    entity_offsets = array('q', [0])
+    entities = array('q')
+    cache_dir = os.path.dirname(os.path.abspath(cache_path))
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # the texts are written to a temporary file while converting, the sizes of the other sections are not known yet
+    with tempfile.TemporaryFile(dir=cache_dir) as texts_file:
+        for text, annotations in iter_spacy_nerc_instances_from_file(source_path, num_workers=num_workers):
+            encoded_text = text.encode('utf-8')
+            texts_file.write(encoded_text)
+            text_offsets.append(text_offsets[-1] + len(encoded_text))
+            for start, end, label in annotations['entities']:
+                entities.extend((start, end, label_indices.setdefault(label, len(label_indices))))
+            entity_offsets.append(len(entities) // 3)
+
+        labels = json.dumps(sorted(label_indices, key=label_indices.get)).encode('utf-8')
+        num_instances = len(text_offsets) - 1
+        if sys.byteorder != 'little' or text_offsets.itemsize != _INT64_SIZE:
+            raise Exception('The corpus cache can only be used in little-endian platforms with 64 bits integers')
+
+        # write everything to a temporary file and then rename it, so a half-written cache is never used
+        tmp_cache_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_cache_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, num_instances, len(entities) // 3, len(labels)))
+            f.write(labels.ljust(_padded_length(len(labels)), b' '))
+            for int64_array in (text_offsets, entity_offsets, entities):
+                f.write(int64_array.tobytes())
+            texts_file.seek(0)
+            shutil.copyfileobj(texts_file, f)
+        os.replace(tmp_cache_path, cache_path)
+
+
+def load_or_build_corpus_cache(source_path, cache_dir, num_workers=1):
+    """
+    Load the converted instances of a BIO file from the cache, converting it first if it is not in the cache yet
+    :param source_path: the path of the file with the training data (token tag per line)
+    :param cache_dir: the directory with the cache files
+    :param num_workers: if greater than 1, the file is converted in parallel by this number of processes
+    :return: a CachedCorpus with the converted instances
+    """
+    cache_path = corpus_cache_path(source_path, cache_dir)
+    if not os.path.exists(cache_path):
+        print(f'Converting {source_path} and storing the result in the cache: {cache_path}')
+        build_corpus_cache(source_path, cache_path, num_workers=num_workers)
+    return CachedCorpus(cache_path)
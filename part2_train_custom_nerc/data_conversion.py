@@ -10,17 +10,48 @@ token2 tag2
 ..
 
 It contains some ad-hoc changes and may also contain some bugs. It has only been tested for a certain dataset content.
+
+Big files can also be converted in parallel (num_workers > 1): the file is split into shards (byte ranges that start
+right after an empty line, so each one starts at a sentence boundary), the shards are converted by a pool of processes,
+and the results are merged in order. The result is exactly the same as the sequential conversion (see
+_iter_bio_instances about the state carried from a sentence to the next one).
 """
 
+import argparse
+import io
+import os
 import re
+from multiprocessing import Pool
 
+# The version of the conversion logic, it must be increased whenever a change alters the converted instances
+# (the converted corpora stored in the cache are rebuilt when it changes)
+CONVERTER_VERSION = 1
+
+# A line contains a token and its tag, separated by whitespace (a few tokens contain whitespace themselves)
+_TOKEN_TAG_REGEX = re.compile(r'(.+)\s+([-\w]+)')
+_TAG_REGEX = re.compile(r'[-\w]+')
+
+# The approximate size (in bytes) of the shards of the parallel conversion
+DEFAULT_SHARD_SIZE = 32 * 1024 * 1024
 
-def read_spacy_nerc_instances_from_file(path):
-    with open(path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
 
-    results = load_spacy_train_data_from_bio_dataset(lines)
-    return results
+def read_spacy_nerc_instances_from_file(path, num_workers=1, shard_size=DEFAULT_SHARD_SIZE):
+    return list(iter_spacy_nerc_instances_from_file(path, num_workers=num_workers, shard_size=shard_size))
+
+
+def iter_spacy_nerc_instances_from_file(path, num_workers=1, shard_size=DEFAULT_SHARD_SIZE):
+    """
+    Read a file lazily, yielding the instances in spaCy format one sentence at a time
+    :param path: the path of the file with the training data (token tag per line)
+    :param num_workers: if greater than 1, the shards of the file are converted in parallel by this number of processes
+    :param shard_size: the approximate size (in bytes) of the shards of the parallel conversion
+    :return: a generator of training instances in the spaCy format
+    """
+    if num_workers > 1:
+        yield from _iter_sharded_bio_instances(path, num_workers, shard_size)
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from iter_spacy_train_data_from_bio_dataset(f)
 
 
 def load_spacy_train_data_from_bio_dataset(lines):
@@ -34,54 +65,84 @@ def load_spacy_train_data_from_bio_dataset(lines):
     :param lines: the lines read from a file with suitable training data (token tag per line)
     :return: a list with the training instances converted to the spaCy format
     """
+    return list(iter_spacy_train_data_from_bio_dataset(lines))
+
+
+def iter_spacy_train_data_from_bio_dataset(lines):
+    """
+    The same as load_spacy_train_data_from_bio_dataset, but yielding the instances one sentence at a time, in a single
+    pass over the lines (so they can be read lazily from a file), and removing the overlapping entities on the fly
+    :param lines: an iterable of lines with suitable training data (token tag per line)
+    :return: a generator of training instances in the spaCy format
+    """
+    return _iter_bio_instances(lines, _new_open_entity())
+
 
-    train_instances = []
-    train_instance_text = ''
+def _new_open_entity():
+    """ The entity being read, a list (text, tag, offset), it stays open across sentences (see _iter_bio_instances) """
+    return ['', '', 0]
+
+
+def _iter_bio_instances(lines, open_entity):
+    """
+    The conversion of iter_spacy_train_data_from_bio_dataset, starting with the given open entity
+    Note that an entity that is open at the end of a sentence is not stored there, but it stays open and it is stored
+    in the next sentence (when a B or O tag is found), with its old offset. The sharded conversion has to reproduce
+    this, so the open entity is a list (text, tag, offset) that is updated when all the lines have been converted.
+    """
+    # the tokens of the current sentence (they will be joined with spaces), and the length of the joined text so far
+    train_instance_tokens = []
+    train_instance_length = 0
     train_instance_annotations = []
+    # the tags that have already been seen (and validated), to avoid checking them with a regex in every line
+    known_tags = set()
 
-    current_entity = ''
-    current_tag = ''
-    current_entity_offset = 0
-    for i, line in enumerate(lines):
-        if len(line.strip()) == 0 and len(train_instance_text.strip()) > 0:
-            train_instances.append((train_instance_text.strip(), {"entities": train_instance_annotations}))
-            train_instance_text = ''
-            train_instance_annotations = []
-            # print("Num train instances:", len(train_instances))
-            continue
-        if len(line.strip()) == 0 or (len(line.strip()) > 0 and ' ' not in line.strip()):
+    current_entity, current_tag, current_entity_offset = open_entity
+    for line in lines:
+        stripped_line = line.strip()
+        if len(stripped_line) == 0:
+            if len(train_instance_tokens) > 0:
+                yield (' '.join(train_instance_tokens).strip(),
+                       {"entities": _remove_overlapping_entities_from_list(train_instance_annotations)})
+                train_instance_tokens = []
+                train_instance_length = 0
+                train_instance_annotations = []
             # there are double empty lines separating sentences... skip the second...
+            continue
+        if ' ' not in stripped_line:
             # (also there are some lines only with tag, skip them)
             continue
 
-        res = re.sub(r'(.+)\s+([-\w]+)', r'\1###\2', line.strip())
-        current_offset = len(train_instance_text)
-
-        token, tag = res.strip().split('###')
+        # fast path: the tag is what comes after the last space (the regex is only needed for unusual lines)
+        token, _, tag = stripped_line.rpartition(' ')
+        if tag not in known_tags or '###' in token:
+            if _TAG_REGEX.fullmatch(tag) and '###' not in token:
+                known_tags.add(tag)
+            else:
+                res = _TOKEN_TAG_REGEX.sub(r'\1###\2', stripped_line)
+                token, tag = res.strip().split('###')
 
-        train_instance_text += token + ' '
+        current_offset = train_instance_length
+        train_instance_tokens.append(token)
+        train_instance_length += len(token) + 1
 
-        # print(line.strip())
         if tag.strip() == '':
             # quick fix to prevent the rare errors in the dataset when a token appears without tag
             tag = 'O'
 
         if tag.startswith('B'):
-            # print("Tag starting with B, current entity:", current_entity)
             # new entity, store previous entity if any
             if len(current_entity.strip()) > 0:
                 # there is some previous entity to be stored
-                # print("Storing annotation...")
-                train_instance_annotations.append((current_entity_offset, current_entity_offset + len(current_entity), current_tag))
+                train_instance_annotations.append(
+                    (current_entity_offset, current_entity_offset + len(current_entity), current_tag))
             current_entity = token.strip()
             current_tag = tag.split('-')[1].strip()
             current_entity_offset = current_offset
 
         elif tag.startswith('I'):
-            # print("Tag starting with I")
             current_entity += ' ' + token
         elif tag.startswith('O'):
-            # print("Tag starting with O")
             if len(current_entity.strip()) > 0:
                 # there is some previous entity to be stored
                 train_instance_annotations.append(
@@ -90,53 +151,174 @@ def load_spacy_train_data_from_bio_dataset(lines):
                 current_tag = ''
         else:
             raise Exception("ERROR HERE...", tag)
-        # print("Current entity:", current_entity, ' current tag:', current_tag)
+    open_entity[:] = [current_entity, current_tag, current_entity_offset]
+
+
+def compute_shard_ranges(path, shard_size=DEFAULT_SHARD_SIZE):
+    """
+    Split a file into byte ranges of roughly shard_size bytes, each one starting right after an empty line
+    :param path: the path of the file (token tag per line, empty lines as sentence boundary)
+    :param shard_size: the approximate size of the ranges
+    :return: a list of (start, end) byte offsets, that cover the whole file
+    """
+    file_size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as f:
+        while boundaries[-1] + shard_size < file_size:
+            f.seek(boundaries[-1] + shard_size)
+            # skip the rest of the (maybe partial) line, then the lines until an empty one (a sentence boundary)
+            f.readline()
+            for line in iter(f.readline, b''):
+                if len(line.strip()) == 0:
+                    break
+            boundaries.append(f.tell())
+    if boundaries[-1] < file_size:
+        boundaries.append(file_size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def _read_shard_lines(path, start, end):
+    """ Read the lines of a byte range of a file, split as they are when the file is read in text mode """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return io.StringIO(data.decode('utf-8'), newline=None).readlines()
+
+
+def _iter_sharded_bio_instances(path, num_workers, shard_size):
+    """
+    Convert the shards of a file in parallel, yielding the instances in order (see iter_spacy_nerc_instances_from_file)
+    Each shard is converted from its first B tag on (before it, the conversion depends on the entity left open by the
+    previous shards), and the lines before it are converted here, with the open entity carried from the previous shard
+    """
+    open_entity = _new_open_entity()
+    with Pool(processes=num_workers) as pool:
+        shard_args = [(path, start, end) for start, end in compute_shard_ranges(path, shard_size)]
+        for prefix_lines, instances, shard_open_entity in pool.imap(_convert_bio_shard, shard_args):
+            yield from _iter_bio_instances(prefix_lines, open_entity)
+            yield from instances
+            if shard_open_entity is not None:
+                open_entity = shard_open_entity
 
-    train_instances = remove_overlapping_entities(train_instances)
-    return train_instances
+
+def _convert_bio_shard(args):
+    """
+    Convert a shard of a file (in a worker process)
+    :return: the lines before the end of the first sentence with a B tag (to be converted with the open entity of the
+             previous shards), the instances of the rest of the lines, and the entity that is open at the end of the
+             shard (None if there is no B tag, then it depends on the open entity of the previous shards)
+    """
+    path, start, end = args
+    lines = _read_shard_lines(path, start, end)
+    independent_start = _find_end_of_first_sentence_with_b_tag(lines)
+    if independent_start is None:
+        return lines, [], None
+    # a B tag sets the whole open entity, so from there on the conversion is the same from any previous state
+    open_entity = _new_open_entity()
+    for _ in _iter_bio_instances(lines[:independent_start], open_entity):
+        pass
+    instances = list(_iter_bio_instances(lines[independent_start:], open_entity))
+    return lines[:independent_start], instances, open_entity
+
+
+def _find_end_of_first_sentence_with_b_tag(lines):
+    """ The index of the line after the sentence that contains the first B tag (None if there is no B tag) """
+    found_b_tag = False
+    for i, line in enumerate(lines):
+        stripped_line = line.strip()
+        if len(stripped_line) == 0:
+            if found_b_tag:
+                return i + 1
+            continue
+        if found_b_tag or ' ' not in stripped_line:
+            continue
+        # the tag is parsed as in _iter_bio_instances
+        token, _, tag = stripped_line.rpartition(' ')
+        if not _TAG_REGEX.fullmatch(tag) or '###' in token:
+            token, tag = _TOKEN_TAG_REGEX.sub(r'\1###\2', stripped_line).strip().split('###')
+        found_b_tag = tag.startswith('B')
+    return len(lines) if found_b_tag else None
 
 
 def remove_overlapping_entities(instances):
     """ Simple strategy of removing each second offending entity"""
-    # print('Hi')
     for instance in instances:
-        # print(instance)
-        entities = instance[1]['entities']
-        remaining_entities = []
-        for i in range(len(entities)):
-            if i >= len(entities) - 1:
-                # we are done here, it is the last one
-                continue
-            ent1 = entities[i]
-            ent2 = entities[i + 1]
-            if ent1[1] < ent2[0]:
-                # we are assuming that the entities are ordered along the sentence
-                # under that assumption this condition means no overlapping
-                remaining_entities.append(ent1)
-                # skip index for ent2
-                i += 1
-        instance[1]['entities'] = remaining_entities
+        instance[1]['entities'] = _remove_overlapping_entities_from_list(instance[1]['entities'])
 
     return instances
 
 
-def transform_conll_format_to_plain_text(input_path, output_path):
-    with open(input_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    results = []
+def _remove_overlapping_entities_from_list(entities):
+    """ Removes the overlapping entities of a single instance (see remove_overlapping_entities) """
+    remaining_entities = []
+    for i in range(len(entities) - 1):
+        # the last entity is never kept (there is no next entity to compare it with)
+        ent1 = entities[i]
+        ent2 = entities[i + 1]
+        if ent1[1] < ent2[0]:
+            # we are assuming that the entities are ordered along the sentence
+            # under that assumption this condition means no overlapping
+            remaining_entities.append(ent1)
+    return remaining_entities
+
+
+def transform_conll_format_to_plain_text(input_path, output_path, num_workers=1, shard_size=DEFAULT_SHARD_SIZE):
+    """
+    Write the sentences of a file in BIO format as plain text, a sentence (its tokens joined with spaces) per line
+    :param input_path: the path of the file in BIO format
+    :param output_path: the path of the plain text file to write
+    :param num_workers: if greater than 1, the shards of the file are converted in parallel by this number of processes
+    :param shard_size: the approximate size (in bytes) of the shards of the parallel conversion
+    """
+    with open(output_path, 'w', encoding='utf-8') as output_file:
+        if num_workers > 1:
+            # the sentences never continue from a shard to the next one, so the shards are independent
+            shard_args = [(input_path, start, end) for start, end in compute_shard_ranges(input_path, shard_size)]
+            with Pool(processes=num_workers) as pool:
+                for shard_text in pool.imap(_transform_bio_shard_to_plain_text, shard_args):
+                    output_file.write(shard_text)
+        else:
+            with open(input_path, 'r', encoding='utf-8') as input_file:
+                # each sentence is written as soon as it is complete, so the whole file is never kept in memory
+                for sentence in _iter_plain_text_sentences(input_file):
+                    output_file.write(sentence)
+
+
+def _transform_bio_shard_to_plain_text(args):
+    """ Convert a shard of a file to plain text (in a worker process) """
+    path, start, end = args
+    return ''.join(_iter_plain_text_sentences(_read_shard_lines(path, start, end)))
+
+
+def _iter_plain_text_sentences(lines):
+    """ The sentences of the lines in BIO format, as lines of plain text """
     current_sentence = []
     for line in lines:
         if line.strip() == '':
             if len(current_sentence) > 0:
-                results.append(' '.join(current_sentence))
+                yield ' '.join(current_sentence) + '\n'
                 current_sentence = []
         else:
             current_sentence.append(line.split()[0])
 
     # pick the last one
     if len(current_sentence) > 0:
-        results.append(' '.join(current_sentence))
+        yield ' '.join(current_sentence) + '\n'
+
+
+def configure_argument_parser():
+    """ Console arguments parser configuration """
+    parser = argparse.ArgumentParser(description='Convert a file in BIO format to plain text (a sentence per line).',
+                                     add_help=True)
+    parser.add_argument('--input', type=str, required=True, help='Path to the file in BIO format')
+    parser.add_argument('--output', type=str, required=True, help='Path to write the plain text')
+    parser.add_argument('--num_workers', type=int, default=1,
+                        help='Number of processes that convert the shards of the file in parallel')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = configure_argument_parser()
+    params = parser.parse_args()
 
-    results = [result + '\n' for result in results]
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.writelines(results)
+    transform_conll_format_to_plain_text(params.input, params.output, num_workers=params.num_workers)
@@ -0,0 +1,103 @@
+"""
+Evaluates a trained model on test data, with the scores of each entity type (label) and their bootstrap confidence
+intervals. If a baseline model is also given (e.g. a previous checkpoint), both models are compared with a paired
+bootstrap, to know whether the difference of their fscores is real or just noise of the test set.
+
+Example:
+    python -m part2_train_custom_nerc.evaluate_models --test_data data/test.txt --model models/nerc_model_epoch5.zip \
+        --baseline_model models/nerc_model_epoch3.zip
+"""
+import argparse
+
+from part1_use_a_nerc.run_nerc import load_custom_model
+from part2_train_custom_nerc.data_conversion import read_spacy_nerc_instances_from_file
+from part2_train_custom_nerc.evaluation import evaluate_counts, convert_golds_to_spans
+
+
+def evaluate_models(test_set_path, model_path, baseline_model_path=None, bootstrap_samples=1000, confidence=0.95,
+                    seed=0, batch_size=256, n_process=1):
+    """
+    Evaluate a model (and compare it with a baseline model, if given) and print the results
+    :param test_set_path: path to the test set file in the correct format
+    :param model_path: path to the model to evaluate
+    :param baseline_model_path: path to a model to compare with (optional)
+    :param bootstrap_samples: the number of resamples of the test set for the confidence intervals
+    :param confidence: the confidence level of the intervals
+    :param seed: the seed of the random generator of the resamples
+    :param batch_size: the number of instances that spaCy analyzes together
+    :param n_process: the number of processes used by spaCy to analyze the instances
+    :return: the SpanCounts of the model, and those of the baseline model (None if there is no baseline)
+    """
+    from part2_train_custom_nerc.span_metrics import bootstrap_confidence_intervals, paired_bootstrap
+    print('Converting test input data...')
+    test_instances = read_spacy_nerc_instances_from_file(test_set_path)
+    gold_spans = convert_golds_to_spans(test_instances)
+
+    counts = evaluate_counts(test_instances, load_custom_model(model_path), gold_spans=gold_spans,
+                             batch_size=batch_size, n_process=n_process)
+    _print_scores(model_path, counts, *bootstrap_confidence_intervals(counts, num_samples=bootstrap_samples,
+                                                                      confidence=confidence, seed=seed))
+    if baseline_model_path is None:
+        return counts, None
+
+    baseline_counts = evaluate_counts(test_instances, load_custom_model(baseline_model_path), gold_spans=gold_spans,
+                                      batch_size=batch_size, n_process=n_process)
+    _print_scores(baseline_model_path, baseline_counts,
+                  *bootstrap_confidence_intervals(baseline_counts, num_samples=bootstrap_samples,
+                                                  confidence=confidence, seed=seed))
+    comparison = paired_bootstrap(counts, baseline_counts, num_samples=bootstrap_samples, confidence=confidence,
+                                  seed=seed)
+    print(f'FSCORE difference (model - baseline): {comparison.difference:+1.4f} '
+          f'[{comparison.low:+1.4f}, {comparison.high:+1.4f}] ({confidence:.0%} paired bootstrap, '
+          f'{comparison.num_samples} samples), p-value: {comparison.p_value:1.4f}')
+    if comparison.low > 0:
+        print('>>> The model is significantly better than the baseline')
+    elif comparison.high < 0:
+        print('>>> The model is significantly worse than the baseline')
+    else:
+        print('>>> The difference between the model and the baseline is not significant')
+    return counts, baseline_counts
+
+
+def _print_scores(model_path, counts, micro_intervals, per_label_intervals):
+    """ Print the micro scores and the scores of each label, with their confidence intervals """
+    scores = counts.scores()
+    support = counts.support()
+    print(f'\n--- Scores of {model_path} ({counts.num_docs} instances) ---')
+    print(f'{"LABEL":<12}{"PRECISION":>24}{"RECALL":>24}{"FSCORE":>24}{"SUPPORT":>10}')
+    rows = [(label, label_scores, per_label_intervals[label], support[label])
+            for label, label_scores in sorted(scores.per_label.items())]
+    rows.append(('(micro)', scores, micro_intervals, sum(support.values())))
+    for label, label_scores, intervals, label_support in rows:
+        cells = [f'{score_value:1.4f} [{intervals[score_name][0]:1.3f}-{intervals[score_name][1]:1.3f}]'
+                 for score_name, score_value in label_scores.list_scores()]
+        print(f'{label:<12}' + ''.join(f'{cell:>24}' for cell in cells) + f'{label_support:>10}')
+
+
+def configure_argument_parser():
+    """ Console arguments parser configuration """
+    parser = argparse.ArgumentParser(description='Evaluate a trained model, and compare it with a baseline model.',
+                                     add_help=True)
+    parser.add_argument('--test_data', type=str, required=True, help='Path to the test data')
+    parser.add_argument('--model', type=str, required=True, help='Path to the model to evaluate')
+    parser.add_argument('--baseline_model', type=str, required=False,
+                        help='Path to a model (e.g. a previous checkpoint) to compare with, with a paired bootstrap')
+    parser.add_argument('--bootstrap_samples', type=int, default=1000,
+                        help='Number of resamples of the test data for the confidence intervals')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Confidence level of the intervals')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator of the resamples')
+    parser.add_argument('--batch_size', type=int, default=256,
+                        help='Number of instances that spaCy analyzes together')
+    parser.add_argument('--n_process', type=int, default=1,
+                        help='Number of processes used by spaCy to analyze the instances (-1 for all the cores)')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = configure_argument_parser()
+    params = parser.parse_args()
+
+    evaluate_models(test_set_path=params.test_data, model_path=params.model,
+                    baseline_model_path=params.baseline_model, bootstrap_samples=params.bootstrap_samples,
+                    confidence=params.confidence, seed=params.seed, batch_size=params.batch_size,
+                    n_process=params.n_process)
@@ -1,6 +1,11 @@
-from dataclasses import dataclass
+import random
+import warnings
+from dataclasses import dataclass, field
 from typing import Dict
 
+from part1_use_a_nerc.gazetteer import GazetteerAnnotator, GAZETTEER_MERGE
+from part2_train_custom_nerc.pretokenized import iter_pretokenized_entities
+
 
 @dataclass
 class EvaluationScores:
@@ -8,41 +13,116 @@ class EvaluationScores:
     precision: float
     recall: float
     fscore: float
+    # the scores of each entity type (label), if they have been calculated
+    per_label: Dict[str, 'EvaluationScores'] = field(default_factory=dict)
 
     def list_scores(self):
         return [('precision', self.precision), ('recall', self.recall), ('fscore', self.fscore)]
 
 
-def evaluate(test_instances, nlp) -> EvaluationScores:
+def evaluate(test_instances, nlp, gold_spans=None, batch_size=256, n_process=1, gazetteer=None,
+             gazetteer_mode=GAZETTEER_MERGE, gold_sets=None, entities_pool=None) -> EvaluationScores:
     """
     Calculate the precision, recall and fscore when using the model to predict the result for test some test instances
     :param test_instances: the instances to evaluate
     :param nlp: the spaCy model to be evaluated
-    :return: a instance of the class EvaluationScores, containing the resulting metrics
+    :param gold_spans: the gold labels of the instances already converted with convert_golds_to_spans (optional)
+                       the gold labels never change, so when evaluating several times they can be converted only once
+    :param batch_size: the number of instances that spaCy analyzes together
+    :param n_process: the number of processes used by spaCy to analyze the instances (-1 to use all the cores)
+    :param gazetteer: a Gazetteer of known entities, to evaluate the predictions in combination with it (optional)
+    :param gazetteer_mode: how the gazetteer is used: 'only' (the model is not used, it can be None), 'merge' or
+                           'triage' (see part1_use_a_nerc.gazetteer)
+    :param gold_sets: deprecated, the gold labels converted with convert_golds_to_str_sets, they are ignored (the
+                      entities are now matched by their offsets, so the gold labels are converted with
+                      convert_golds_to_spans instead)
+    :param entities_pool: a PretokenizedEntitiesPool of the model, to analyze the instances with its processes (then
+                          n_process is ignored), so that they are reused by several evaluations (e.g. in a training)
+    :return: a instance of the class EvaluationScores, containing the resulting metrics (also those of each label)
+    """
+    if gold_sets is not None:
+        warnings.warn('The gold_sets argument of evaluate is deprecated and ignored, use gold_spans (see '
+                      'convert_golds_to_spans)', DeprecationWarning, stacklevel=2)
+    return evaluate_counts(test_instances, nlp, gold_spans=gold_spans, batch_size=batch_size, n_process=n_process,
+                           gazetteer=gazetteer, gazetteer_mode=gazetteer_mode, entities_pool=entities_pool).scores()
+
+
+def evaluate_counts(test_instances, nlp, gold_spans=None, batch_size=256, n_process=1, gazetteer=None,
+                    gazetteer_mode=GAZETTEER_MERGE, entities_pool=None):
+    """
+    Predict the entities of the test instances and match them with the gold ones (the parameters are those of evaluate)
+    :return: the SpanCounts (see span_metrics) with the true positives, false positives and false negatives of each
+             instance and label, to calculate the scores or their bootstrap confidence intervals
+    """
+    from part2_train_custom_nerc.span_metrics import EntitySpans, SpanCounts  # numpy is imported on first use
+    if gold_spans is None:
+        gold_spans = convert_golds_to_spans(test_instances)
+
+    # Only the NER is needed to get the predictions, so the rest of the pipes (if any) are disabled
+    other_pipes = [pipe for pipe in nlp.pipe_names if pipe != 'ner'] if nlp is not None else []
+
+    # the texts are already tokenized, so the Docs are built directly from their words (without the tokenizer),
+    # with the same tokenization whatever the number of processes, with or without a gazetteer (so the scores of all
+    # of them can be compared)
+    def model_entities_function(texts, model_batch_size, model_n_process):
+        if entities_pool is not None:
+            return entities_pool.iter_entities(texts, batch_size=model_batch_size)
+        return iter_pretokenized_entities(nlp, texts, batch_size=model_batch_size, n_process=model_n_process,
+                                          disable=other_pipes)
+
+    if gazetteer is not None:
+        annotator = GazetteerAnnotator(gazetteer, nlp, mode=gazetteer_mode, disable=other_pipes,
+                                       model_entities_function=model_entities_function)
+        texts_with_context = ((text, None) for text, _ in test_instances)
+        predictions = (entities for entities, _ in annotator.iter_entities(texts_with_context, batch_size=batch_size,
+                                                                            n_process=n_process))
+    else:
+        predictions = model_entities_function((text for text, _ in test_instances), batch_size, n_process)
+
+    # The predicted entities are matched with the gold ones by their offsets (not by their text), so the same string
+    # in two places of a sentence are two different entities
+    predicted_spans = EntitySpans.from_entity_lists(predictions, label_names=gold_spans.label_names)
+    return SpanCounts.from_spans(predicted_spans, gold_spans)
+
+
+def stratified_subsample(instances, size, seed=0):
+    """
+    Get a fixed random subsample of the instances, keeping the proportion of instances of each entity type
+    (each instance is assigned to the type of its first entity, or to no type if it has no entities)
+    :param instances: the instances in spaCy format
+    :param size: the size of the subsample (if there are fewer instances, all of them are returned)
+    :param seed: the seed of the random generator, the same seed always gives the same subsample
+    :return: a list with the instances of the subsample, in their original order
     """
-    # Note: tp, fp and fn mean "True Positives", "False positives" and "False Negatives" respectively
-    overall_tp = 0
-    overall_fp = 0
-    overall_fn = 0
-    for text, golds in test_instances:
-        predictions = nlp(text).ents
-        tp, fp, fn = compare_predictions_and_gold_labels(convert_predictions_to_str_set(predictions),
-                                                         convert_gold_to_str_set((text, golds)))
-        overall_tp += tp
-        overall_fp += fp
-        overall_fn += fn
-
-    # PRECISION: tp / tp + fp
-    precision = overall_tp / (
-            overall_tp + overall_fp) if overall_tp + overall_fp > 0 else 0
-    # RECALL: tp / tp + fn
-    recall = overall_tp / (
-            overall_tp + overall_fn) if overall_tp + overall_fn > 0 else 0
-    # FSCORE:  2 * (prec * rec) / (prec + rec)
-    fscore = 2 * (precision * recall) / (precision + recall) if precision + recall > 0 else 0
-
-    # precision,recall and fscore of the named entity recognition
-    return EvaluationScores(precision=precision, recall=recall, fscore=fscore)
+    if size >= len(instances):
+        return list(instances)
+    indices_by_type: Dict[str, list] = {}
+    for i, (_, annotations) in enumerate(instances):
+        entities = annotations['entities']
+        indices_by_type.setdefault(entities[0][2] if len(entities) > 0 else '', []).append(i)
+
+    rng = random.Random(seed)
+    sampled_indices = []
+    for entity_type in sorted(indices_by_type):
+        type_indices = indices_by_type[entity_type]
+        type_size = max(1, round(size * len(type_indices) / len(instances)))
+        sampled_indices.extend(rng.sample(type_indices, min(type_size, len(type_indices))))
+    return [instances[i] for i in sorted(sampled_indices)]
+
+
+def convert_predictions_to_entities(predictions):
+    """ Helper method to convert the predicted spaCy spans into (start, end, label) tuples """
+    return [(x.start_char, x.end_char, x.label_) for x in predictions]
+
+
+def convert_golds_to_spans(test_instances):
+    """ Helper method to convert the gold labels of all the instances to integer arrays (see span_metrics) """
+    from part2_train_custom_nerc.span_metrics import EntitySpans
+    return EntitySpans.from_entity_lists(annotations['entities'] for _, annotations in test_instances)
+
+
+# The helpers of the previous evaluation, that matched the entities by their text (so the same string in two places of
+# a sentence was a single entity). They are kept for compatibility, evaluate matches the entities by their offsets now
 
 
 def convert_predictions_to_str_set(predictions):
@@ -55,6 +135,11 @@ def convert_gold_to_str_set(test_instance):
     return {test_instance[0][x[0]:x[1]] + '_' + x[2] for x in test_instance[1]['entities']}
 
 
+def convert_golds_to_str_sets(test_instances):
+    """ Helper method to convert the gold labels of all the instances (one set per instance) """
+    return [convert_gold_to_str_set(test_instance) for test_instance in test_instances]
+
+
 def compare_predictions_and_gold_labels(predictions_set, golds_set):
     """ Calculate True Positives (tp), False Positives (fp), and False Negatives (fn) """
     tp, fp, fn = 0, 0, 0
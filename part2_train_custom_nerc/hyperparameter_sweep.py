@@ -0,0 +1,153 @@
+"""
+A hyperparameter sweep for the custom NERC training.
+
+Several training configurations (dropout, batch size, number of epochs) are trained at the same time, each one in its
+own worker process, pinned to its own core (when the platform allows it). The train/dev data are converted only once,
+in the main process, and the workers share them read-only (they are inherited when the worker processes are forked;
+otherwise they are sent to each worker, and the memory-mapped cached corpora are reopened by the workers from their
+cache files).
+
+The rest of the training options (batching, checkpoints, budget...) are the same for all the configurations.
+
+The best scores reached by each configuration are collected into a single leaderboard, sorted by fscore.
+"""
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+
+from part2_train_custom_nerc.corpus_cache import CachedCorpus
+from part2_train_custom_nerc.spacy_nerc_training import train_nerc_model
+
+# The data shared by all the workers of the sweep: (base_lang, train_data, dev_data)
+_shared_data = None
+
+
+def grid_configurations(dropouts, batch_sizes, num_epochs_values):
+    """ All the combinations of the given values of the hyperparameters """
+    return [{'dropout': dropout, 'batch_size': batch_size, 'num_epochs': num_epochs}
+            for dropout, batch_size, num_epochs in itertools.product(dropouts, batch_sizes, num_epochs_values)]
+
+
+def random_configurations(num_configurations, dropouts, batch_sizes, num_epochs_values, seed=None):
+    """
+    Random combinations of the hyperparameters
+    The dropout is sampled uniformly between the minimum and the maximum of the given dropouts, the other values
+    are randomly chosen from the given values
+    """
+    rng = random.Random(seed)
+    return [{'dropout': round(rng.uniform(min(dropouts), max(dropouts)), 4),
+             'batch_size': rng.choice(batch_sizes),
+             'num_epochs': rng.choice(num_epochs_values)}
+            for _ in range(num_configurations)]
+
+
+def run_sweep(base_lang, train_data, dev_data, output_model_dir, model_name, configurations, num_workers=None,
+              training_options=None):
+    """
+    Train all the configurations in parallel, and build a leaderboard with the best scores of each one
+    :param base_lang: the base language for spaCy to instantiate the new blank models
+    :param train_data: the training data in spaCy format
+    :param dev_data: the development data (for evaluation during training) in spaCy format
+    :param output_model_dir: the directory to store the models (each configuration in its own subdirectory)
+    :param model_name: the name of the models (the number of the configuration is appended to it)
+    :param configurations: a list of dictionaries with the dropout, batch_size and num_epochs of each configuration
+    :param num_workers: the number of configurations trained at the same time (by default, the number of cores)
+    :param training_options: a dictionary with other arguments of train_nerc_model, the same for all the
+                             configurations (e.g. batch_size_end, keep_top_k, max_seconds, patience...)
+    :return: the leaderboard, a list with the configurations and their best scores, sorted by fscore
+    """
+    global _shared_data
+    _shared_data = (base_lang, train_data, dev_data)
+
+    # forked workers inherit the data that is already loaded, without copying it (when fork is not available, the
+    # data is sent once to each worker instead, but a cached corpus is memory-mapped, so only its path is sent)
+    use_fork = 'fork' in multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if use_fork else None)
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    num_workers = min(num_workers or len(cores), len(configurations))
+    available_cores = context.Queue()
+    for core in cores[:num_workers]:
+        available_cores.put(core)
+
+    print(f'Training {len(configurations)} configurations with {num_workers} workers...')
+    worker_args = [(config_number, configuration, output_model_dir, model_name, training_options or {})
+                   for config_number, configuration in enumerate(configurations)]
+    results = []
+    with context.Pool(processes=num_workers, initializer=_init_sweep_worker,
+                      initargs=(available_cores, None if use_fork else _portable_data(_shared_data))) as pool:
+        for result in pool.imap_unordered(_train_configuration, worker_args):
+            print(f'Configuration {result["config_number"]} finished, FSCORE:{result["fscore"]:1.4f}')
+            results.append(result)
+
+    leaderboard = sorted(results, key=lambda result: result['fscore'], reverse=True)
+    print_leaderboard(leaderboard)
+    if output_model_dir:
+        leaderboard_path = os.path.join(output_model_dir, f'{model_name}_sweep_leaderboard.json')
+        os.makedirs(os.path.abspath(output_model_dir), exist_ok=True)
+        with open(leaderboard_path, 'w', encoding='utf-8') as f:
+            json.dump(leaderboard, f, indent=2)
+        print(f'Leaderboard saved to {os.path.abspath(leaderboard_path)}')
+    return leaderboard
+
+
+def print_leaderboard(leaderboard):
+    """ Print the leaderboard as a table """
+    print('==========\nSweep leaderboard:')
+    print(f'{"rank":>4} {"config":>6} {"dropout":>8} {"batch":>6} {"epochs":>6} '
+          f'{"precision":>9} {"recall":>9} {"fscore":>9} {"time(s)":>9}')
+    for rank, result in enumerate(leaderboard, start=1):
+        print(f'{rank:>4} {result["config_number"]:>6} {result["dropout"]:>8} {result["batch_size"]:>6} '
+              f'{result["num_epochs"]:>6} {result["precision"]:>9.4f} {result["recall"]:>9.4f} '
+              f'{result["fscore"]:>9.4f} {result["seconds"]:>9.1f}')
+
+
+def _init_sweep_worker(available_cores, shared_data):
+    """ Initialization of each worker process of the sweep: pin it to a core (and receive the data if not forked) """
+    global _shared_data
+    if shared_data is not None:
+        _shared_data = _reopen_data(shared_data)
+    core = available_cores.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {core})
+
+
+def _portable_data(shared_data):
+    """ The shared data to be sent to the workers, with the cached corpora replaced by their paths """
+    base_lang, train_data, dev_data = shared_data
+    return base_lang, _corpus_reference(train_data), _corpus_reference(dev_data)
+
+
+def _corpus_reference(data):
+    return ('cached_corpus', data.cache_path) if isinstance(data, CachedCorpus) else data
+
+
+def _reopen_data(shared_data):
+    """ The shared data received by a worker, with the cached corpora opened again from their paths """
+    base_lang, train_data, dev_data = shared_data
+    return base_lang, _open_corpus_reference(train_data), _open_corpus_reference(dev_data)
+
+
+def _open_corpus_reference(data):
+    if isinstance(data, tuple) and len(data) == 2 and data[0] == 'cached_corpus':
+        return CachedCorpus(data[1])
+    return data
+
+
+def _train_configuration(args):
+    """ The work done by the sweep workers: train a configuration and return its best scores """
+    config_number, configuration, output_model_dir, model_name, training_options = args
+    base_lang, train_data, dev_data = _shared_data
+    config_model_name = f'{model_name}_sweep{config_number}'
+    config_output_dir = os.path.join(output_model_dir, config_model_name) if output_model_dir else None
+
+    start_time = time.perf_counter()
+    best_scores = train_nerc_model(base_lang=base_lang, train_data=train_data, dev_data=dev_data,
+                                   output_model_dir=config_output_dir, model_name=config_model_name,
+                                   num_epochs=configuration['num_epochs'], batch_size=configuration['batch_size'],
+                                   dropout=configuration['dropout'], **training_options)
+    scores = dict(best_scores.list_scores()) if best_scores else {'precision': 0.0, 'recall': 0.0, 'fscore': 0.0}
+    return {'config_number': config_number, **configuration, **scores,
+            'seconds': time.perf_counter() - start_time}
@@ -0,0 +1,255 @@
+"""
+Construction of spaCy Docs from the (already tokenized) instances, without running the spaCy tokenizer.
+
+The texts of the instances are the tokens of the BIO data joined with spaces, so the Docs are built directly from the
+words between the spaces, Doc(vocab, words=..., spaces=...), and their text is exactly the text of the instance (the
+extra spaces, if any, become whitespace tokens, as the spaCy tokenizer does). A few tokens of the data contain spaces
+themselves, they are split into several words, but the entities always start and end at the boundaries of the words.
+
+The gold entities are converted to BILUO tags directly from the character offsets of the words (the tags of entities
+that do not match the boundaries of the words are '-', like in spaCy, so they are ignored in the training).
+"""
+import os
+import pickle
+import re
+import shutil
+import tempfile
+from multiprocessing import Pool
+
+# the model of the worker processes of iter_pretokenized_entities, the names of its pipes that are not applied, and
+# the file of the weights loaded last (see PretokenizedEntitiesPool)
+_worker_nlp = None
+_worker_disable = ()
+_worker_weights_path = None
+
+# a word, and the spaces after it
+_WORD_REGEX = re.compile(r'([^ ]+)( *)')
+
+
+def split_words(text):
+    """
+    Split the text of an instance into the words of a Doc
+    :param text: the text of the instance (the tokens joined with spaces)
+    :return: the words, whether each word is followed by a space, and the character offset of each word
+    """
+    words, spaces, starts = [], [], []
+    leading_spaces = len(text) - len(text.lstrip(' '))
+    if leading_spaces > 0:
+        words.append(text[:leading_spaces])
+        spaces.append(False)
+        starts.append(0)
+    for match in _WORD_REGEX.finditer(text, leading_spaces):
+        following_spaces = match.group(2)
+        words.append(match.group(1))
+        spaces.append(len(following_spaces) > 0)
+        starts.append(match.start())
+        if len(following_spaces) > 1:
+            # the first space belongs to the word, the rest are a whitespace token (as in the spaCy tokenizer)
+            words.append(following_spaces[1:])
+            spaces.append(False)
+            starts.append(match.start(2) + 1)
+    return words, spaces, starts
+
+
+def biluo_tags(words, starts, entities):
+    """
+    Convert the entities of an instance to the BILUO tags of its words
+    :param words: the words of the instance (see split_words)
+    :param starts: the character offset of each word
+    :param entities: the entities of the instance, as (start, end, label) character offsets
+    :return: a list with the tag of each word
+    """
+    tags = ['O'] * len(words)
+    start_words = {start: i for i, start in enumerate(starts)}
+    end_words = {start + len(word): i for i, (start, word) in enumerate(zip(starts, words))}
+    for start, end, label in entities:
+        first_word, last_word = start_words.get(start), end_words.get(end)
+        if first_word is None or last_word is None or last_word < first_word:
+            # the entity does not match the boundaries of the words, the words that it covers are unknown ('-')
+            for i, word_start in enumerate(starts):
+                if word_start < end and word_start + len(words[i]) > start:
+                    tags[i] = '-'
+        elif first_word == last_word:
+            tags[first_word] = f'U-{label}'
+        else:
+            tags[first_word] = f'B-{label}'
+            for i in range(first_word + 1, last_word):
+                tags[i] = f'I-{label}'
+            tags[last_word] = f'L-{label}'
+    return tags
+
+
+def make_doc(vocab, text):
+    """ Build a spaCy Doc with the words of the text of an instance (its text is exactly the same) """
+    from spacy.tokens import Doc
+    words, spaces, _ = split_words(text)
+    return Doc(vocab, words=words, spaces=spaces)
+
+
+def pretokenize_instances(instances):
+    """
+    Split the texts of some training instances into words, and convert their entities to BILUO tags
+    It is a cheap split on the spaces, the training does it batch by batch (so the words of the whole training data
+    are never kept in memory)
+    :param instances: the instances in spaCy format (text, {'entities': [(start, end, label), ...]})
+    :return: a list of tuples (words, spaces, tags), one per instance
+    """
+    pretokenized_instances = []
+    for text, annotations in instances:
+        words, spaces, starts = split_words(text)
+        pretokenized_instances.append((words, spaces, biluo_tags(words, starts, annotations['entities'])))
+    return pretokenized_instances
+
+
+def make_gold_docs(vocab, pretokenized_instances):
+    """
+    Build the Docs and the GoldParses of some training instances, to be used in nlp.update
+    :param vocab: the vocabulary of the model
+    :param pretokenized_instances: the instances as (words, spaces, tags) tuples (see pretokenize_instances)
+    :return: a list of Docs and a list of GoldParses
+    """
+    from spacy.gold import GoldParse
+    from spacy.tokens import Doc
+    docs, golds = [], []
+    for words, spaces, tags in pretokenized_instances:
+        doc = Doc(vocab, words=words, spaces=spaces)
+        docs.append(doc)
+        golds.append(GoldParse(doc, entities=tags))
+    return docs, golds
+
+
+def pipe_pretokenized(nlp, texts, batch_size=256, disable=()):
+    """
+    Analyze some texts of instances with the pipes of a model (like nlp.pipe), without the spaCy tokenizer
+    :param nlp: the spaCy model
+    :param texts: the texts of the instances
+    :param batch_size: the number of texts that are analyzed together
+    :param disable: the names of the pipes that are not applied
+    :return: a generator of Docs
+    """
+    docs = (make_doc(nlp.vocab, text) for text in texts)
+    for name, proc in nlp.pipeline:
+        if name in disable:
+            continue
+        docs = proc.pipe(docs, batch_size=batch_size) if hasattr(proc, 'pipe') else map(proc, docs)
+    return docs
+
+
+def iter_pretokenized_entities(nlp, texts, batch_size=256, n_process=1, disable=()):
+    """
+    Get the entities of some texts of instances (see pipe_pretokenized), using several processes if requested
+    The processes of nlp.pipe only accept texts (that they tokenize with the spaCy tokenizer), so the batches of texts
+    are sent to a pool of processes that build the Docs themselves, and the tokenization does not depend on n_process
+    (to analyze texts with the same processes several times, e.g. in every evaluation of a training, see
+    PretokenizedEntitiesPool)
+    :param nlp: the spaCy model
+    :param texts: the texts of the instances
+    :param batch_size: the number of texts that are analyzed together
+    :param n_process: the number of processes (-1 to use all the cores)
+    :param disable: the names of the pipes that are not applied
+    :return: a generator with the entities of each text, as lists of (start, end, label) tuples
+    """
+    if n_process == 1:
+        for doc in pipe_pretokenized(nlp, texts, batch_size=batch_size, disable=disable):
+            yield _doc_entities(doc)
+        return
+    with Pool(processes=_num_processes(n_process), initializer=_init_pretokenized_worker,
+              initargs=(nlp, disable)) as pool:
+        tasks = ((None, batch) for batch in _iter_batches(texts, batch_size))
+        for batch_entities in pool.imap(_pretokenized_batch_entities, tasks):
+            yield from batch_entities
+
+
+class PretokenizedEntitiesPool:
+    """
+    A pool of processes that get the entities of texts of instances (like iter_pretokenized_entities) with a model
+    whose weights change, e.g. the model being trained, that is evaluated after every epoch
+    The pool is created only once (the model is sent to the processes only then), and each time the entities are
+    requested the current weights of the pipes are written once to a temporary file, that each process loads before
+    its first batch
+    """
+
+    def __init__(self, nlp, n_process, disable=()):
+        """
+        :param nlp: the spaCy model
+        :param n_process: the number of processes (-1 to use all the cores)
+        :param disable: the names of the pipes that are not applied
+        """
+        self.nlp = nlp
+        self.disable = disable
+        self._pool = Pool(processes=_num_processes(n_process), initializer=_init_pretokenized_worker,
+                          initargs=(nlp, disable))
+        self._weights_dir = tempfile.mkdtemp(prefix='nerc_eval_weights_')
+        self._weights_path = None
+        self._weights_version = 0
+
+    def iter_entities(self, texts, batch_size=256):
+        """
+        Get the entities of some texts with the current weights of the model
+        :param texts: the texts of the instances
+        :param batch_size: the number of texts that are analyzed together
+        :return: a generator with the entities of each text, as lists of (start, end, label) tuples
+        """
+        # (the weights of the previous call are no longer needed, all its batches have been analyzed)
+        if self._weights_path is not None:
+            os.remove(self._weights_path)
+        self._weights_version += 1
+        self._weights_path = os.path.join(self._weights_dir, f'weights{self._weights_version}.pickle')
+        weights = {name: proc.to_bytes() for name, proc in self.nlp.pipeline
+                   if name not in self.disable and hasattr(proc, 'to_bytes')}
+        with open(self._weights_path, 'wb') as f:
+            pickle.dump(weights, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tasks = ((self._weights_path, batch) for batch in _iter_batches(texts, batch_size))
+        for batch_entities in self._pool.imap(_pretokenized_batch_entities, tasks):
+            yield from batch_entities
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        shutil.rmtree(self._weights_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _num_processes(n_process):
+    return os.cpu_count() if n_process == -1 else n_process
+
+
+def _init_pretokenized_worker(nlp, disable):
+    global _worker_nlp, _worker_disable, _worker_weights_path
+    _worker_nlp = nlp
+    _worker_disable = disable
+    _worker_weights_path = None
+
+
+def _pretokenized_batch_entities(args):
+    """ The entities of a batch of texts (in a worker process), loading first the given weights if they are new """
+    global _worker_weights_path
+    weights_path, texts = args
+    if weights_path is not None and weights_path != _worker_weights_path:
+        with open(weights_path, 'rb') as f:
+            weights = pickle.load(f)
+        for name, pipe_bytes in weights.items():
+            _worker_nlp.get_pipe(name).from_bytes(pipe_bytes)
+        _worker_weights_path = weights_path
+    return [_doc_entities(doc) for doc in pipe_pretokenized(_worker_nlp, texts, batch_size=len(texts),
+                                                            disable=_worker_disable)]
+
+
+def _doc_entities(doc):
+    return [(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents]
+
+
+def _iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
@@ -1,11 +1,20 @@
 import argparse
 import os
 
+from instrumentation.tracing import stage, tracing_session
+from part2_train_custom_nerc.batching import BATCH_UNITS, BATCH_UNIT_SENTENCES
+from part2_train_custom_nerc.checkpointing import CHECKPOINT_FORMATS, CHECKPOINT_ZIP
+from part2_train_custom_nerc.corpus_cache import load_or_build_corpus_cache
 from part2_train_custom_nerc.data_conversion import read_spacy_nerc_instances_from_file
+from part2_train_custom_nerc.hyperparameter_sweep import grid_configurations, random_configurations, run_sweep
 from part2_train_custom_nerc.spacy_nerc_training import train_nerc_model
 
 
-def train(train_set_path, dev_set_path, output_model_dir, model_name, base_language='en', num_epochs='5'):
+def train(train_set_path, dev_set_path, output_model_dir, model_name, base_language='en', num_epochs='5',
+          eval_n_process=1, corpus_cache_dir=None, batch_size=32, batch_size_end=None,
+          batch_unit=BATCH_UNIT_SENTENCES, bucket_window=16, dropout=0.5, checkpoint_compression=6, keep_top_k=None,
+          max_seconds=None, max_steps=None, patience=None, eval_every=None, dev_subsample_size=500,
+          checkpoint_format=CHECKPOINT_ZIP, conversion_workers=1):
     """
     Reads the train/dev data from their respective locations and launches a NERC model training process
     :param train_set_path: path to the training set file in the correct format
@@ -14,23 +23,102 @@ def train(train_set_path, dev_set_path, output_model_dir, model_name, base_langu
     :param model_name: name of the model to be trained (will be used as the name of the resulting files)
     :param base_language: the base language for the (spaCy) blank model that will be trained
     :param num_epochs: number of epochs (full training loops)
+    :param eval_n_process: number of processes used to evaluate the model on the development data after each epoch
+    :param corpus_cache_dir: directory to cache the converted train/dev data, so they are only converted once
+    :param batch_size: size of the training batches (or their starting size, if batch_size_end is given)
+    :param batch_size_end: if given, the size of the batches grows (compounding) from batch_size up to this size
+    :param batch_unit: unit of the batch sizes, 'sentences' or 'words' (a token budget)
+    :param bucket_window: number of batches whose instances are sorted by length together
+    :param dropout: dropout rate used in the training steps
+    :param checkpoint_compression: zip compression level of the stored models, from 0 (no compression) to 9
+    :param keep_top_k: if given, only the best K stored models (by fscore) are kept
+    :param max_seconds: if given, the training stops after this time
+    :param max_steps: if given, the training stops after this number of training steps (batches)
+    :param patience: if given, the training stops after this number of epochs without improving the best fscore
+    :param eval_every: if given, the model is also evaluated every N batches on a subsample of the development data
+    :param dev_subsample_size: size of the (stratified) subsample of the development data used every N batches
+    :param checkpoint_format: format of the stored models, 'zip', 'snapshot' (a single file, fastest to load) or
+    'spacy_zip' (a zip of the spaCy model directory, slowest to write)
+    :param conversion_workers: number of processes that convert the train/dev data in parallel
     :return:
     """
-    if not _check_path_exist(train_set_path):
-        print(f'The TRAIN set path DOES NOT EXIST, please check it: {os.path.abspath(train_set_path)}')
-        return
-    if not _check_path_exist(dev_set_path):
-        print(f'The DEV set path DOES NOT EXIST, please check it: {os.path.abspath(dev_set_path)}')
+    instances = _load_train_dev_instances(train_set_path, dev_set_path, corpus_cache_dir, conversion_workers)
+    if instances is None:
         return
-    print('Converting training input data to a format suitable for training...')
-    train_instances = read_spacy_nerc_instances_from_file(train_set_path)
-    print('Converting evaluation input data to a format suitable for training...')
-    dev_instances = read_spacy_nerc_instances_from_file(dev_set_path)
+    train_instances, dev_instances = instances
     train_nerc_model(base_lang=base_language, train_data=train_instances, dev_data=dev_instances,
                      output_model_dir=output_model_dir,
-                     model_name=model_name, num_epochs=num_epochs)
+                     model_name=model_name, num_epochs=num_epochs, eval_n_process=eval_n_process,
+                     batch_size=batch_size, batch_size_end=batch_size_end, batch_unit=batch_unit,
+                     bucket_window=bucket_window, dropout=dropout, checkpoint_compression=checkpoint_compression,
+                     keep_top_k=keep_top_k, max_seconds=max_seconds, max_steps=max_steps, patience=patience,
+                     eval_every=eval_every, dev_subsample_size=dev_subsample_size,
+                     checkpoint_format=checkpoint_format)
+
+    print(f'Training finished (maximum number of epochs: {num_epochs})')
+
+
+def sweep(train_set_path, dev_set_path, output_model_dir, model_name, base_language='en', dropouts=(0.5,),
+          batch_sizes=(32,), num_epochs_values=(10,), num_random_configurations=0, num_workers=None,
+          corpus_cache_dir=None, conversion_workers=1, **training_options):
+    """
+    Reads the train/dev data once and launches a hyperparameter sweep, training several configurations in parallel
+    :param train_set_path: path to the training set file in the correct format
+    :param dev_set_path: path to the development set file in the correct format
+    :param output_model_dir: directory to store the resulting models (each configuration in its own subdirectory)
+    :param model_name: name of the models to be trained (will be used as the name of the resulting files)
+    :param base_language: the base language for the (spaCy) blank models that will be trained
+    :param dropouts: the dropout values to try
+    :param batch_sizes: the batch sizes to try
+    :param num_epochs_values: the numbers of epochs to try
+    :param num_random_configurations: if greater than zero, number of random configurations (instead of the grid)
+    :param num_workers: number of configurations trained at the same time (by default, the number of cores)
+    :param corpus_cache_dir: directory to cache the converted train/dev data, so they are only converted once
+    :param conversion_workers: number of processes that convert the train/dev data in parallel
+    :param training_options: other training options, the same for all the configurations (eval_n_process,
+                             batch_size_end, batch_unit, bucket_window, checkpoint_compression, keep_top_k,
+                             max_seconds, max_steps, patience, eval_every, dev_subsample_size, checkpoint_format; see
+                             train)
+    :return: the leaderboard with the best scores of each configuration
+    """
+    if training_options.get('eval_n_process', 1) != 1:
+        # the configurations are trained in the processes of a pool, which cannot start processes of their own
+        raise Exception('The evaluation cannot use several processes in sweep mode (eval_n_process must be 1)')
+    instances = _load_train_dev_instances(train_set_path, dev_set_path, corpus_cache_dir, conversion_workers)
+    if instances is None:
+        return
+    train_instances, dev_instances = instances
+    if num_random_configurations > 0:
+        configurations = random_configurations(num_random_configurations, dropouts, batch_sizes, num_epochs_values)
+    else:
+        configurations = grid_configurations(dropouts, batch_sizes, num_epochs_values)
+    return run_sweep(base_lang=base_language, train_data=train_instances, dev_data=dev_instances,
+                     output_model_dir=output_model_dir, model_name=model_name, configurations=configurations,
+                     num_workers=num_workers, training_options=training_options)
+
 
-    print(f'Training stopped after {num_epochs} epochs')
+def _load_train_dev_instances(train_set_path, dev_set_path, corpus_cache_dir=None, conversion_workers=1):
+    """ Reads the train/dev data (or loads them from the cache), returns None if any of the paths does not exist """
+    if not _check_path_exist(train_set_path):
+        print(f'The TRAIN set path DOES NOT EXIST, please check it: {os.path.abspath(train_set_path)}')
+        return None
+    if not _check_path_exist(dev_set_path):
+        print(f'The DEV set path DOES NOT EXIST, please check it: {os.path.abspath(dev_set_path)}')
+        return None
+    if corpus_cache_dir:
+        print('Loading the converted input data from the cache (they are converted if they are not there yet)...')
+        with stage('load_corpus_cache', 'convert'):
+            train_instances = load_or_build_corpus_cache(train_set_path, corpus_cache_dir,
+                                                         num_workers=conversion_workers)
+            dev_instances = load_or_build_corpus_cache(dev_set_path, corpus_cache_dir, num_workers=conversion_workers)
+    else:
+        print('Converting training input data to a format suitable for training...')
+        with stage('convert_bio', 'convert', path=train_set_path):
+            train_instances = read_spacy_nerc_instances_from_file(train_set_path, num_workers=conversion_workers)
+        print('Converting evaluation input data to a format suitable for training...')
+        with stage('convert_bio', 'convert', path=dev_set_path):
+            dev_instances = read_spacy_nerc_instances_from_file(dev_set_path, num_workers=conversion_workers)
+    return train_instances, dev_instances
 
 
 def _check_path_exist(path):
@@ -49,6 +137,56 @@ def configure_argument_parser():
     parser.add_argument('--output_dir', type=str, required=True, help='Path to the folder to store the trained models')
     parser.add_argument('--model_name', type=str, required=False, default='nerc_model',
                         help='Name for the model to be trained (will be used as part of the name of the stored model')
+    parser.add_argument('--eval_n_process', type=int, default=1,
+                        help='Number of processes used to evaluate the model after each epoch (-1 for all the cores)')
+    parser.add_argument('--corpus_cache_dir', type=str, required=False,
+                        help='Directory to cache the converted train/dev data, so later trainings start faster')
+    parser.add_argument('--conversion_workers', type=int, default=1,
+                        help='Number of processes that convert (shards of) the train/dev data in parallel')
+    parser.add_argument('--batch_size', type=int, default=32,
+                        help='Size of the training batches (or their starting size if --batch_size_end is given)')
+    parser.add_argument('--batch_size_end', type=int, required=False,
+                        help='If given, the size of the batches grows (compounding) up to this size')
+    parser.add_argument('--batch_unit', type=str, choices=BATCH_UNITS, default=BATCH_UNIT_SENTENCES,
+                        help='Unit of the batch sizes (use words for a token budget per batch)')
+    parser.add_argument('--bucket_window', type=int, default=16,
+                        help='Number of batches whose sentences are sorted by length together')
+    parser.add_argument('--dropout', type=float, default=0.5, help='Dropout rate used in the training steps')
+    parser.add_argument('--checkpoint_compression', type=int, choices=range(10), default=6,
+                        help='Zip compression level of the stored models, from 0 (no compression, fastest) to 9')
+    parser.add_argument('--checkpoint_format', type=str, choices=CHECKPOINT_FORMATS, default=CHECKPOINT_ZIP,
+                        help='Format of the stored models: zip, snapshot (a single file, fastest to load) or '
+                             'spacy_zip (a zip of the spaCy model directory, slowest to write)')
+    parser.add_argument('--keep_top_k', type=int, required=False,
+                        help='If given, only the best K stored models (by fscore) are kept')
+    parser.add_argument('--max_minutes', type=float, required=False,
+                        help='If given, the training stops after this time (wall-clock minutes)')
+    parser.add_argument('--max_steps', type=int, required=False,
+                        help='If given, the training stops after this number of training steps (batches)')
+    parser.add_argument('--patience', type=int, required=False,
+                        help='If given, the training stops after this number of epochs without improvement')
+    parser.add_argument('--eval_every', type=int, required=False,
+                        help='If given, evaluate also every N batches on a subsample of the development data')
+    parser.add_argument('--dev_subsample_size', type=int, default=500,
+                        help='Size of the (stratified) development subsample used with --eval_every')
+    parser.add_argument('--sweep', action='store_true',
+                        help='Train several configurations in parallel (hyperparameter sweep) instead of a single one')
+    parser.add_argument('--sweep_dropouts', type=float, nargs='+', default=[0.2, 0.35, 0.5],
+                        help='In sweep mode, the dropout values to try')
+    parser.add_argument('--sweep_batch_sizes', type=int, nargs='+', default=[16, 32, 64],
+                        help='In sweep mode, the batch sizes to try')
+    parser.add_argument('--sweep_num_epochs', type=int, nargs='+', default=[10],
+                        help='In sweep mode, the numbers of epochs to try')
+    parser.add_argument('--sweep_random', type=int, default=0,
+                        help='In sweep mode, number of random configurations to try (by default, the full grid)')
+    parser.add_argument('--sweep_workers', type=int, required=False,
+                        help='In sweep mode, number of configurations trained at the same time (default: cores)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Measure the time of each stage of the training, and print a summary at the end')
+    parser.add_argument('--profile_trace', type=str, required=False,
+                        help='Path to write the profile as a Chrome trace JSON file (implies --profile)')
+    parser.add_argument('--profile_memory', action='store_true',
+                        help='Also measure the peak of memory of each stage, slower (implies --profile)')
     return parser
 
 
@@ -56,6 +194,30 @@ if __name__ == '__main__':
     parser = configure_argument_parser()
     params = parser.parse_args()
 
-    train(train_set_path=params.train_data, dev_set_path=params.dev_data,
-          output_model_dir=params.output_dir, model_name=params.model_name,
-          base_language=params.lang, num_epochs=params.num_epochs)
+    # (in sweep mode, only the stages of the main process are profiled)
+    with tracing_session(trace_path=params.profile_trace, trace_memory=params.profile_memory,
+                         enabled=params.profile or params.profile_trace or params.profile_memory):
+        if params.sweep:
+            sweep(train_set_path=params.train_data, dev_set_path=params.dev_data,
+                  output_model_dir=params.output_dir, model_name=params.model_name, base_language=params.lang,
+                  dropouts=params.sweep_dropouts, batch_sizes=params.sweep_batch_sizes,
+                  num_epochs_values=params.sweep_num_epochs, num_random_configurations=params.sweep_random,
+                  num_workers=params.sweep_workers, corpus_cache_dir=params.corpus_cache_dir,
+                  conversion_workers=params.conversion_workers, eval_n_process=params.eval_n_process,
+                  batch_size_end=params.batch_size_end, batch_unit=params.batch_unit,
+                  bucket_window=params.bucket_window, checkpoint_compression=params.checkpoint_compression,
+                  keep_top_k=params.keep_top_k, max_seconds=params.max_minutes * 60 if params.max_minutes else None,
+                  max_steps=params.max_steps, patience=params.patience, eval_every=params.eval_every,
+                  dev_subsample_size=params.dev_subsample_size, checkpoint_format=params.checkpoint_format)
+        else:
+            train(train_set_path=params.train_data, dev_set_path=params.dev_data,
+                  output_model_dir=params.output_dir, model_name=params.model_name,
+                  base_language=params.lang, num_epochs=params.num_epochs, eval_n_process=params.eval_n_process,
+                  corpus_cache_dir=params.corpus_cache_dir, batch_size=params.batch_size,
+                  batch_size_end=params.batch_size_end, batch_unit=params.batch_unit,
+                  bucket_window=params.bucket_window,
+                  dropout=params.dropout, checkpoint_compression=params.checkpoint_compression,
+                  keep_top_k=params.keep_top_k, max_seconds=params.max_minutes * 60 if params.max_minutes else None,
+                  max_steps=params.max_steps, patience=params.patience, eval_every=params.eval_every,
+                  dev_subsample_size=params.dev_subsample_size, checkpoint_format=params.checkpoint_format,
+                  conversion_workers=params.conversion_workers)
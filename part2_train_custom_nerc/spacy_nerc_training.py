@@ -1,101 +1,206 @@
+import json
 import os
-import random
-import shutil
+import time
+from contextlib import nullcontext
 
-import spacy
-from spacy.util import minibatch
-from tqdm import tqdm
+from instrumentation.tracing import stage
+from part2_train_custom_nerc.batching import compute_instance_lengths, estimate_num_batches, \
+    iter_length_bucketed_batches, BATCH_UNIT_SENTENCES
+from part2_train_custom_nerc.checkpointing import CheckpointWriter, CHECKPOINT_ZIP
+from part2_train_custom_nerc.evaluation import evaluate, EvaluationScores, convert_golds_to_spans, \
+    stratified_subsample
+from part2_train_custom_nerc.pretokenized import make_gold_docs, pretokenize_instances, PretokenizedEntitiesPool
 
-from part2_train_custom_nerc.evaluation import evaluate, EvaluationScores
 
-
-def train_nerc_model(base_lang, train_data, dev_data, output_model_dir, model_name, num_epochs=5):
+def train_nerc_model(base_lang, train_data, dev_data, output_model_dir, model_name, num_epochs=5, eval_n_process=1,
+                     batch_size=32, batch_size_end=None, batch_unit=BATCH_UNIT_SENTENCES, bucket_window=16, dropout=0.5,
+                     checkpoint_compression=6, keep_top_k=None, max_seconds=None, max_steps=None, patience=None,
+                     eval_every=None, dev_subsample_size=500, checkpoint_format=CHECKPOINT_ZIP):
     """
     Train spaCy NERC model using new train and dev data.
     :param base_lang: the base language for spaCy to instantiate a new blank model
-    :param train_data: the training data in spaCy format
+    :param train_data: the training data in spaCy format (a list, or any sequence that can be accessed by index)
     :param dev_data: the development data (for evaluation during training) in spaCy format
     :param output_model_dir: the directory in which you want to store the resulting models
     :param model_name: the name for the model you are training (it will appear in the name of the resulting file)
     :param num_epochs: the number of epochs (full training data loops)
-    :return:
+    :param eval_n_process: the number of processes used to evaluate the model on the development data
+    :param batch_size: the size of the batches (or their starting size, if batch_size_end is given)
+    :param batch_size_end: if given, the size of the batches grows (compounding) from batch_size up to this size
+    :param batch_unit: the unit of the batch sizes, 'sentences' or 'words' (a token budget)
+    :param bucket_window: the number of batches whose instances are sorted by length together
+    :param dropout: the dropout rate used in the training steps
+    :param checkpoint_compression: the zip compression level of the stored models, from 0 (no compression) to 9
+    :param keep_top_k: if given, only the best K stored models (by fscore) are kept
+    :param max_seconds: if given, the training stops after this time (the last, partial, epoch is also evaluated)
+    :param max_steps: if given, the training stops after this number of training steps (batches)
+    :param patience: if given, the training stops after this number of epochs without improving the best fscore
+    :param eval_every: if given, the model is also evaluated every N batches, on a subsample of the development data
+                       (only to report the progress, the full development data is still used to store the models)
+    :param dev_subsample_size: the size of the (stratified) subsample of the development data used every N batches
+    :param checkpoint_format: the format of the stored models, 'zip', 'snapshot' (a single file, fastest to load) or
+    'spacy_zip' (a zip of the spaCy model directory, slowest to write)
+    :return: the best EvaluationScores reached on the development data (None if the fscore was always zero)
     """
     # First we create a new fresh spaCy model instance
     print('Instantiating a fresh model to be trained')
-    nlp = _instantiate_model_for_training(base_lang, train_data)
+    with stage('instantiate_model', 'train'):
+        nlp = _instantiate_model_for_training(base_lang, train_data)
+
+    # The gold labels of the development data never change, so we convert them only once for all the evaluations
+    dev_gold_spans = convert_golds_to_spans(dev_data)
+    if eval_every:
+        dev_subsample = stratified_subsample(dev_data, dev_subsample_size)
+        dev_subsample_gold_spans = convert_golds_to_spans(dev_subsample)
+    # The lengths of the training instances are used to group them in batches of similar length
+    train_lengths = compute_instance_lengths(train_data)
+    num_batches = estimate_num_batches(len(train_data), batch_size, batch_size_end, batch_unit, bucket_window)
+    # The throughput and the scores of each epoch are also written to a machine-readable log (one JSON per line)
+    training_log_path = os.path.join(output_model_dir, f'{model_name}_training_log.jsonl') if output_model_dir else None
 
     # This has to do with spaCy: we only want to train NER, so we remove the rest of the "tools" enabled by spaCy
     other_pipes = [pipe for pipe in nlp.pipe_names if pipe != "ner"]
-    with nlp.disable_pipes(*other_pipes):  # only train NER
+    # the processes that evaluate the model are started only once for all the evaluations (the current weights are
+    # sent to them in each evaluation), and before the thread of the checkpoint writer, so it is not forked
+    eval_pool = PretokenizedEntitiesPool(nlp, eval_n_process, disable=other_pipes) \
+        if eval_n_process != 1 else nullcontext()
+    # the models are written to disk (and compressed) in the background, while the training goes on
+    # (when the training ends, or it is stopped, the models that are still being written are waited for)
+    checkpoint_writer = CheckpointWriter(output_model_dir, compression_level=checkpoint_compression,
+                                         keep_top_k=keep_top_k, checkpoint_format=checkpoint_format) \
+        if output_model_dir is not None else nullcontext()
+    with eval_pool, nlp.disable_pipes(*other_pipes), checkpoint_writer:  # only train NER
         # reset and initialize the weights randomly because we're training a new model
         optimizer = nlp.begin_training()
         # create a progress bar, so we can see how the train progresses in the console
         epochs_progress_bar = _epoch_progress_bar(num_epochs=num_epochs)
         # init to zero the best fscore value (the metric we are going to use to measure how "good" the model is)
         best_fscore = 0.0
+        best_scores = None
+        # the training can also stop early, if it runs out of its time/steps budget or if it stops improving
+        training_start_time = time.perf_counter()
+        steps = 0
+        budget_exhausted = False
+        epochs_without_improvement = 0
         # Here is where the training starts, each epoch is a full pass over the training set
         for epoch in epochs_progress_bar:
-            # Shuffle the data to increase randomness in each epoch, this helps the learning process
-            random.shuffle(train_data)
-
-            # batch up the examples using spaCy's minibatch
-            batches = list(minibatch(train_data, size=32))
+            # The batches are generated lazily from the shuffled data, grouping instances of similar length
+            # (the indices are shuffled instead of the data, so the data can be a read-only sequence, like a cache)
+            batches = iter_length_bucketed_batches(train_data, train_lengths, batch_size=batch_size,
+                                                   batch_size_end=batch_size_end, batch_unit=batch_unit,
+                                                   bucket_window=bucket_window)
+            epoch_words, epoch_sentences, epoch_batches, epoch_loss = 0, 0, 0, 0.0
+            epoch_start_time = time.perf_counter()
             # another progress bar, this time for the batches inside an epoch
-            with _batch_progress_bar(batches, epoch=epoch, num_epochs=num_epochs) as t:
+            with stage('train_epoch', 'train', epoch=epoch), \
+                    _batch_progress_bar(batches, total=num_batches, epoch=epoch, num_epochs=num_epochs) as t:
                 # each batch is a group of examples that will be used to perform one "training-step"
                 for batch in t:
                     batch_losses = {}
-                    # get the text and their gold annotations from the batch
-                    texts, annotations = zip(*batch)
+                    # the texts are already tokenized: the instances of the batch are split into words (a cheap split
+                    # on the spaces, done batch by batch so the words of the whole training data are never kept in
+                    # memory) and the Docs are built directly from them, with their gold tags (without the tokenizer)
+                    with stage('make_docs', 'train', epoch=epoch, step=steps + 1):
+                        docs, golds = make_gold_docs(nlp.vocab, pretokenize_instances(batch))
                     # this is the training step performed by spaCy, after this the model should have learnt "a tiny bit"
                     # spaCy manages a lot of things behind-the-scenes, we do not need to worry about them
-                    nlp.update(
-                        texts,  # batch of texts
-                        annotations,  # batch of annotations
-                        drop=0.5,  # dropout - make it harder to memorise data
-                        losses=batch_losses, sgd=optimizer
-                    )
-                    # we report the "loss" to the progress bar, so we can have an idea about how the training is going
-                    __report_to_progress_bar(t, batch_losses['ner'])
+                    with stage('nlp.update', 'train', epoch=epoch, step=steps + 1, sentences=len(batch)):
+                        nlp.update(
+                            docs,  # batch of pre-tokenized texts
+                            golds,  # batch of gold annotations
+                            drop=dropout,  # dropout - make it harder to memorise data
+                            losses=batch_losses, sgd=optimizer
+                        )
+                    epoch_words += sum(len(doc) for doc in docs)
+                    epoch_sentences += len(batch)
+                    epoch_batches += 1
+                    epoch_loss += batch_losses['ner']
+                    # we report the "loss" and the throughput to the progress bar, so we can see how the training goes
+                    elapsed_time = time.perf_counter() - epoch_start_time
+                    __report_to_progress_bar(t, batch_losses['ner'], words_per_second=epoch_words / elapsed_time,
+                                             sentences_per_second=epoch_sentences / elapsed_time)
+
+                    steps += 1
+                    if eval_every and steps % eval_every == 0:
+                        # a quick evaluation on a fixed subsample, to see the progress in the middle of the epoch
+                        with stage('evaluate_subsample', 'train', epoch=epoch, step=steps):
+                            subsample_scores = evaluate(dev_subsample, nlp, gold_spans=dev_subsample_gold_spans)
+                        subsample_scores_msg = [f'{score_name.upper()}:{score_value:1.4f}'
+                                                for score_name, score_value in subsample_scores.list_scores()]
+                        t.write(f'Step {steps} dev subsample scores: {subsample_scores_msg}')
+                        _append_to_training_log(training_log_path, {
+                            'epoch': epoch, 'step': steps, 'dev_subsample_size': len(dev_subsample),
+                            **dict(subsample_scores.list_scores())})
+                    if (max_steps and steps >= max_steps) or \
+                            (max_seconds and time.perf_counter() - training_start_time >= max_seconds):
+                        budget_exhausted = True
+                        break
+            epoch_time = time.perf_counter() - epoch_start_time
 
             # after a full epoch of training, we evaluate the current status of our model
-            scores: EvaluationScores = evaluate(dev_data, nlp)
+            with stage('evaluate', 'train', epoch=epoch):
+                scores: EvaluationScores = evaluate(dev_data, nlp, gold_spans=dev_gold_spans, n_process=eval_n_process,
+                                                    entities_pool=eval_pool if eval_n_process != 1 else None)
             # we get the fscore out, because we will focus on it to assess our model (the higher the better)
             current_fscore = scores.fscore
             print('Scores:', [f'{score_name.upper()}:{score_value:1.4f}'
                               for score_name, score_value in scores.list_scores()])
+            print(f'Throughput: {epoch_words / epoch_time:1.1f} words/sec, '
+                  f'{epoch_sentences / epoch_time:1.1f} sentences/sec, {epoch_batches} batches in {epoch_time:1.1f}s')
+            _append_to_training_log(training_log_path, {
+                'epoch': epoch, 'batches': epoch_batches, 'sentences': epoch_sentences, 'words': epoch_words,
+                'seconds': epoch_time, 'words_per_second': epoch_words / epoch_time,
+                'sentences_per_second': epoch_sentences / epoch_time, 'loss': epoch_loss,
+                **dict(scores.list_scores()),
+                'per_label': {label: dict(label_scores.list_scores())
+                              for label, label_scores in scores.per_label.items()}})
 
             # compare the previous best fscore with the current one
             # it is better, then we store a new version of our model (we will end up having several versions)
             if current_fscore > best_fscore:
                 print(f'New BEST Fscore so far, CURRENT: {current_fscore:1.4f} \
                      PREVIOUS: {best_fscore:1.4f}  DIFF:{current_fscore - best_fscore:1.4f}')
-                _save_model(output_model_dir, f'{model_name}_epoch{epoch}_fscore{current_fscore:1.4f}', nlp, optimizer)
+                _save_model(checkpoint_writer, f'{model_name}_epoch{epoch}_fscore{current_fscore:1.4f}', current_fscore,
+                            nlp, optimizer)
                 best_fscore = current_fscore
+                best_scores = scores
+                epochs_without_improvement = 0
+            else:
+                epochs_without_improvement += 1
+
+            if budget_exhausted:
+                print(f'Training stopped after {steps} steps, the time/steps budget is exhausted')
+                break
+            if patience and epochs_without_improvement >= patience:
+                print(f'Training stopped early, the fscore has not improved in the last {patience} epochs')
+                break
+
+    return best_scores
+
+
+def _append_to_training_log(training_log_path, record):
+    """ Append a record (as a line of JSON) to the machine-readable training log, if there is one """
+    if training_log_path is None:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(training_log_path)), exist_ok=True)
+    with open(training_log_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
 
 
-def _save_model(output_model_dir_path, model_name, nlp, optimizer):
+def _save_model(checkpoint_writer, model_name, fscore, nlp, optimizer):
     """
-    Saves the model to the provided directory, using the provided name
-    :param output_model_dir_path: the directory path to store the model
+    Saves the model using the provided name (the model is serialized now, and written to disk in the background)
+    :param checkpoint_writer: the CheckpointWriter that writes the models to the output directory
     :param model_name: the name of the model file
+    :param fscore: the fscore of the model (used to keep only the best models, if the writer is configured to)
     :param nlp: the spaCy model to store
     :param optimizer: the spaCy optimizer used in the training (necessary to correctly store the spaCy model)
     :return:
     """
-    if output_model_dir_path is not None:
-        if not os.path.exists(output_model_dir_path):
-            os.makedirs(os.path.abspath(output_model_dir_path))
-        model_path = os.path.join(output_model_dir_path, model_name)
-        with nlp.use_params(optimizer.averages):
-            print('Saving resulting model...')
-            nlp.to_disk(model_path)
-            # an additional step to compress the resulting model is necessary
-            print('Compressing model to a zip file...')
-            shutil.make_archive(model_path, 'zip', model_path)
-            print('Deleting uncompressed version of the model...')
-            shutil.rmtree(model_path)
-        print("Model saved to {}".format(os.path.abspath(model_path + '.zip')))
+    if isinstance(checkpoint_writer, CheckpointWriter):
+        print('Saving resulting model (it is written and compressed in the background)...')
+        with stage('save_model', 'train'):
+            checkpoint_writer.submit(model_name, fscore, nlp, optimizer)
 
     else:
         print('No valid output model name was set (non-null and non-existing model name required)')
@@ -109,6 +214,7 @@ def _instantiate_model_for_training(base_lang, train_data):
     :param train_data: the training data (we need it here to get all the possible labels from it)
     :return: a blank instance of a spaCy model
     """
+    import spacy
     nlp = spacy.blank(base_lang)
     ner = nlp.create_pipe("ner")
     nlp.add_pipe(ner, last=True)
@@ -126,6 +232,7 @@ def _instantiate_model_for_training(base_lang, train_data):
 
 def _epoch_progress_bar(num_epochs):
     """Helper function to clean-up the batch progress bar boilerplate, the parameters are expected to remain constant"""
+    from tqdm import tqdm
     t = tqdm(range(num_epochs),
              position=0,
              desc=f'NERC training progress',
@@ -134,9 +241,10 @@ def _epoch_progress_bar(num_epochs):
     return t
 
 
-def _batch_progress_bar(batches, epoch, num_epochs):
+def _batch_progress_bar(batches, total, epoch, num_epochs):
     """Helper function to clean-up the batch progress bar boilerplate, the parameters are expected to remain constant"""
-    t = tqdm(batches, total=len(batches),
+    from tqdm import tqdm
+    t = tqdm(batches, total=total,
              position=0,
              leave=True,
              desc=f'Epoch {epoch}/{num_epochs} progress',
@@ -145,6 +253,6 @@ def _batch_progress_bar(batches, epoch, num_epochs):
     return t
 
 
-def __report_to_progress_bar(progress_bar, loss):
-    """ Helper function to print the loss in the progress bar"""
-    progress_bar.postfix = f'; LOSS:{loss:1.4f}'
+def __report_to_progress_bar(progress_bar, loss, words_per_second, sentences_per_second):
+    """ Helper function to print the loss and the throughput in the progress bar"""
+    progress_bar.postfix = f'; LOSS:{loss:1.4f}; WORDS/S:{words_per_second:1.0f}; SENTS/S:{sentences_per_second:1.1f}'
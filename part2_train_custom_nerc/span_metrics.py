@@ -0,0 +1,226 @@
+"""
+Span-level metrics of the NERC, computed with vectorized numpy operations over integer arrays.
+
+The entities (predicted or gold) of a set of documents are stored as parallel integer arrays: the document index, the
+start and end character offsets, and a label id. A predicted entity is a true positive only if there is a gold entity
+in the same document with exactly the same offsets and label (so the same string in two different places of a
+sentence are two different entities).
+
+The matching produces, for each document and label, the number of true positives, false positives and false negatives
+(a matrix of documents x labels). From them the micro and per-label precision, recall and fscore are calculated, and
+also bootstrap confidence intervals: the documents are resampled with replacement many times, and the counts of each
+resample are a matrix product of the number of times each document is drawn by the count matrices, so thousands of
+resamples take a few seconds even with large test sets. With the same resamples for two models (a paired bootstrap)
+the difference of their fscores can be tested.
+"""
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+
+from part2_train_custom_nerc.evaluation import EvaluationScores
+
+# the resamples are drawn in blocks, so that the (resamples x documents) weights matrix has at most this many cells
+_MAX_BOOTSTRAP_BLOCK_CELLS = 2 ** 22
+
+
+@dataclass
+class EntitySpans:
+    """ The entities of a set of documents, as parallel integer arrays (one position per entity) """
+    docs: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+    labels: np.ndarray
+    label_names: List[str]
+    num_docs: int
+
+    @classmethod
+    def from_entity_lists(cls, entity_lists, label_names=()):
+        """
+        Build the arrays from the entities of each document
+        :param entity_lists: an iterable with the entities of each document, as (start, end, label) tuples
+        :param label_names: the names of the labels already known (e.g. those of the gold entities), they keep their
+                            ids, and the new labels are added after them
+        :return: an EntitySpans
+        """
+        label_ids = {label: label_id for label_id, label in enumerate(label_names)}
+        docs, starts, ends, labels = [], [], [], []
+        num_docs = 0
+        for doc_index, entities in enumerate(entity_lists):
+            num_docs = doc_index + 1
+            for start, end, label in entities:
+                docs.append(doc_index)
+                starts.append(start)
+                ends.append(end)
+                labels.append(label_ids.setdefault(label, len(label_ids)))
+        return cls(docs=np.array(docs, dtype=np.int64), starts=np.array(starts, dtype=np.int64),
+                   ends=np.array(ends, dtype=np.int64), labels=np.array(labels, dtype=np.int64),
+                   label_names=list(label_ids), num_docs=num_docs)
+
+    def rows(self):
+        """ The entities as a (entities x 4) matrix, without repetitions """
+        rows = np.stack([self.docs, self.starts, self.ends, self.labels], axis=1)
+        return np.unique(rows, axis=0) if len(rows) > 0 else rows.reshape(0, 4)
+
+    def __len__(self):
+        return len(self.docs)
+
+
+@dataclass
+class SpanCounts:
+    """ The true positives, false positives and false negatives, as (documents x labels) matrices """
+    tp: np.ndarray
+    fp: np.ndarray
+    fn: np.ndarray
+    label_names: List[str]
+
+    @classmethod
+    def from_spans(cls, predicted: EntitySpans, gold: EntitySpans):
+        """
+        Match the predicted entities with the gold ones (same document, offsets and label)
+        The label ids of the predictions must extend those of the gold entities (see EntitySpans.from_entity_lists)
+        """
+        if predicted.label_names[:len(gold.label_names)] != gold.label_names:
+            raise Exception('The label ids of the predictions do not extend the label ids of the gold entities')
+        num_docs = max(predicted.num_docs, gold.num_docs)
+        label_names = list(max(predicted.label_names, gold.label_names, key=len))
+        num_labels = len(label_names)
+        predicted_rows = predicted.rows()
+        gold_rows = gold.rows()
+        # each entity appears at most once in each matrix, so the entities found twice in both together are matches
+        _, entity_ids = np.unique(np.concatenate([predicted_rows, gold_rows]), axis=0, return_inverse=True)
+        entity_ids = entity_ids.reshape(-1)
+        matched = np.bincount(entity_ids)[entity_ids] == 2
+        predicted_matched = matched[:len(predicted_rows)]
+        gold_matched = matched[len(predicted_rows):]
+
+        def count_matrix(rows, mask):
+            cells = rows[mask, 0] * num_labels + rows[mask, 3]
+            return np.bincount(cells, minlength=num_docs * num_labels).reshape(num_docs, num_labels)
+
+        return cls(tp=count_matrix(predicted_rows, predicted_matched),
+                   fp=count_matrix(predicted_rows, ~predicted_matched),
+                   fn=count_matrix(gold_rows, ~gold_matched), label_names=label_names)
+
+    @property
+    def num_docs(self):
+        return self.tp.shape[0]
+
+    def scores(self) -> EvaluationScores:
+        """ The micro precision, recall and fscore, with the scores of each label in per_label """
+        tp, fp, fn = self.tp.sum(), self.fp.sum(), self.fn.sum()
+        per_label_tp, per_label_fp, per_label_fn = self.tp.sum(axis=0), self.fp.sum(axis=0), self.fn.sum(axis=0)
+        precision, recall, fscore = _precision_recall_fscore(per_label_tp, per_label_fp, per_label_fn)
+        per_label = {label: EvaluationScores(precision=float(precision[i]), recall=float(recall[i]),
+                                             fscore=float(fscore[i]))
+                     for i, label in enumerate(self.label_names)}
+        precision, recall, fscore = _precision_recall_fscore(tp, fp, fn)
+        return EvaluationScores(precision=float(precision), recall=float(recall), fscore=float(fscore),
+                                per_label=per_label)
+
+    def support(self) -> Dict[str, int]:
+        """ The number of gold entities of each label """
+        support = (self.tp + self.fn).sum(axis=0)
+        return {label: int(support[i]) for i, label in enumerate(self.label_names)}
+
+
+def iter_bootstrap_counts(counts_list, num_samples=1000, seed=0):
+    """
+    Resample the documents with replacement, with the same resamples for all the given counts (paired bootstrap)
+    :param counts_list: a list of SpanCounts of the same documents (e.g. of two models on the same test set)
+    :param num_samples: the number of resamples
+    :param seed: the seed of the random generator
+    :return: a generator of blocks of resamples, for each block a list (one item per SpanCounts) of (tp, fp, fn)
+             tuples, each one a (resamples x labels) matrix with the counts of each resample
+    """
+    num_docs = counts_list[0].num_docs
+    if any(counts.num_docs != num_docs for counts in counts_list):
+        raise Exception('The bootstrap needs the counts of the same documents')
+    rng = np.random.RandomState(seed)
+    block_size = max(1, _MAX_BOOTSTRAP_BLOCK_CELLS // max(1, num_docs))
+    matrices = [(counts.tp.astype(np.float64), counts.fp.astype(np.float64), counts.fn.astype(np.float64))
+                for counts in counts_list]
+    for block_start in range(0, num_samples, block_size):
+        num_block_samples = min(block_size, num_samples - block_start)
+        # the number of times that each document is drawn in each resample (resamples x documents)
+        drawn_docs = rng.randint(0, num_docs, size=(num_block_samples, num_docs))
+        drawn_docs += np.arange(num_block_samples)[:, np.newaxis] * num_docs
+        weights = np.bincount(drawn_docs.reshape(-1), minlength=num_block_samples * num_docs) \
+            .reshape(num_block_samples, num_docs).astype(np.float64)
+        yield [(weights @ tp, weights @ fp, weights @ fn) for tp, fp, fn in matrices]
+
+
+def bootstrap_confidence_intervals(counts: SpanCounts, num_samples=1000, confidence=0.95, seed=0):
+    """
+    Calculate bootstrap confidence intervals (percentile method) of the micro and per-label scores
+    :param counts: the SpanCounts of a model on a test set
+    :param num_samples: the number of resamples of the documents
+    :param confidence: the confidence level of the intervals
+    :param seed: the seed of the random generator
+    :return: a dict {score name: (low, high)} for the micro scores, and a dict {label: {score name: (low, high)}}
+    """
+    micro_samples, per_label_samples = [], []
+    for [(tp, fp, fn)] in iter_bootstrap_counts([counts], num_samples=num_samples, seed=seed):
+        micro_samples.append(np.stack(_precision_recall_fscore(tp.sum(axis=1), fp.sum(axis=1), fn.sum(axis=1)),
+                                      axis=1))
+        per_label_samples.append(np.stack(_precision_recall_fscore(tp, fp, fn), axis=2))
+    micro_low, micro_high = _percentile_interval(np.concatenate(micro_samples), confidence)
+    per_label_low, per_label_high = _percentile_interval(np.concatenate(per_label_samples), confidence)
+    score_names = ['precision', 'recall', 'fscore']
+    micro_intervals = {name: (float(micro_low[j]), float(micro_high[j])) for j, name in enumerate(score_names)}
+    per_label_intervals = {label: {name: (float(per_label_low[i, j]), float(per_label_high[i, j]))
+                                   for j, name in enumerate(score_names)}
+                           for i, label in enumerate(counts.label_names)}
+    return micro_intervals, per_label_intervals
+
+
+@dataclass
+class PairedBootstrapResult:
+    """ The difference of the micro fscores of two models (fscore of the model minus fscore of the baseline) """
+    difference: float
+    low: float
+    high: float
+    # the ratio of the resamples in which the model is not better than the baseline (a one-sided p-value)
+    p_value: float
+    num_samples: int
+
+
+def paired_bootstrap(counts: SpanCounts, baseline_counts: SpanCounts, num_samples=1000, confidence=0.95,
+                     seed=0) -> PairedBootstrapResult:
+    """
+    Compare the micro fscores of two models on the same test set, with the same resamples of the documents for both
+    :param counts: the SpanCounts of the model
+    :param baseline_counts: the SpanCounts of the baseline model (e.g. a previous checkpoint)
+    :param num_samples: the number of resamples of the documents
+    :param confidence: the confidence level of the interval of the difference
+    :param seed: the seed of the random generator
+    :return: a PairedBootstrapResult
+    """
+    differences = []
+    for (tp, fp, fn), (baseline_tp, baseline_fp, baseline_fn) in \
+            iter_bootstrap_counts([counts, baseline_counts], num_samples=num_samples, seed=seed):
+        fscore = _precision_recall_fscore(tp.sum(axis=1), fp.sum(axis=1), fn.sum(axis=1))[2]
+        baseline_fscore = _precision_recall_fscore(baseline_tp.sum(axis=1), baseline_fp.sum(axis=1),
+                                                   baseline_fn.sum(axis=1))[2]
+        differences.append(fscore - baseline_fscore)
+    differences = np.concatenate(differences)
+    low, high = _percentile_interval(differences, confidence)
+    return PairedBootstrapResult(difference=counts.scores().fscore - baseline_counts.scores().fscore,
+                                 low=float(low), high=float(high), p_value=float(np.mean(differences <= 0)),
+                                 num_samples=num_samples)
+
+
+def _precision_recall_fscore(tp, fp, fn):
+    """ The precision, recall and fscore of arrays of counts (element-wise, 0 when they are undefined) """
+    tp, fp, fn = np.asarray(tp, dtype=np.float64), np.asarray(fp, dtype=np.float64), np.asarray(fn, dtype=np.float64)
+    precision = np.divide(tp, tp + fp, out=np.zeros_like(tp), where=tp + fp > 0)
+    recall = np.divide(tp, tp + fn, out=np.zeros_like(tp), where=tp + fn > 0)
+    # 2 * (prec * rec) / (prec + rec) is the same as 2 * tp / (2 * tp + fp + fn)
+    fscore = np.divide(2 * tp, 2 * tp + fp + fn, out=np.zeros_like(tp), where=tp > 0)
+    return precision, recall, fscore
+
+
+def _percentile_interval(samples, confidence):
+    """ The percentile interval of the samples (along the first axis) """
+    alpha = (1 - confidence) / 2
+    return np.percentile(samples, 100 * alpha, axis=0), np.percentile(samples, 100 * (1 - alpha), axis=0)
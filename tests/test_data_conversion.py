@@ -0,0 +1,63 @@
+import os
+import random
+
+import pytest
+
+from part2_train_custom_nerc.data_conversion import compute_shard_ranges, read_spacy_nerc_instances_from_file, \
+    transform_conll_format_to_plain_text
+
+TOKENS = ['steel', 'Zr', '-', 'based', 'AB2', 'alloys', '%', '0.5', 'café', 'laves phase', 'of']
+TAGS = ['O', 'O', 'O', 'B-MAT', 'I-MAT', 'B-SPL', 'I-SPL', 'I-MAT']
+DEV_DATA_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'dev.txt')
+
+
+def _write_bio_file(path, seed, num_sentences=300, newline='\n'):
+    """ A random file in BIO format, with entities that continue after empty lines and I tags without a B tag """
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(num_sentences):
+        for _ in range(rng.randint(1, 12)):
+            lines.append(f'{rng.choice(TOKENS)} {rng.choice(TAGS)}')
+        lines.extend([''] * rng.choice([1, 1, 1, 2]))
+    with open(path, 'w', encoding='utf-8', newline=newline) as f:
+        f.write('\n'.join(lines) + ('\n' if rng.random() < 0.5 else ''))
+
+
+@pytest.mark.parametrize('seed, shard_size, newline', [(0, 64, '\n'), (1, 300, '\n'), (2, 1000, '\r\n'),
+                                                       (3, 1, '\n'), (4, 10 ** 9, '\n')])
+def test_sharded_conversion_equals_sequential(tmp_path, seed, shard_size, newline):
+    path = str(tmp_path / 'data.txt')
+    _write_bio_file(path, seed, newline=newline)
+    sequential = read_spacy_nerc_instances_from_file(path)
+    sharded = read_spacy_nerc_instances_from_file(path, num_workers=2, shard_size=shard_size)
+    assert len(sequential) > 0
+    assert sharded == sequential
+
+
+def test_sharded_conversion_of_the_dev_data():
+    sequential = read_spacy_nerc_instances_from_file(DEV_DATA_PATH)
+    assert read_spacy_nerc_instances_from_file(DEV_DATA_PATH, num_workers=3, shard_size=20000) == sequential
+
+
+@pytest.mark.parametrize('shard_size', [50, 700])
+def test_sharded_plain_text_equals_sequential(tmp_path, shard_size):
+    path = str(tmp_path / 'data.txt')
+    _write_bio_file(path, seed=5)
+    transform_conll_format_to_plain_text(path, str(tmp_path / 'sequential.txt'))
+    transform_conll_format_to_plain_text(path, str(tmp_path / 'sharded.txt'), num_workers=2, shard_size=shard_size)
+    with open(tmp_path / 'sequential.txt', encoding='utf-8') as sequential_file, \
+            open(tmp_path / 'sharded.txt', encoding='utf-8') as sharded_file:
+        assert sharded_file.read() == sequential_file.read()
+
+
+def test_shard_ranges_cover_the_file_and_start_after_empty_lines(tmp_path):
+    path = str(tmp_path / 'data.txt')
+    _write_bio_file(path, seed=6)
+    with open(path, 'rb') as f:
+        data = f.read()
+    ranges = compute_shard_ranges(path, shard_size=100)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(data)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    for start, _ in ranges[1:]:
+        assert data[:start].endswith(b'\n\n')
@@ -0,0 +1,76 @@
+import json
+import os
+
+import pytest
+
+from part1_use_a_nerc.entity_output import ColumnarEntityWriter, ENTITIES_COLUMNAR, ENTITIES_JSONL, \
+    load_entity_columns, open_entity_writer
+
+RECORDS = [('doc1.txt', 0, 7, 'MAT', 'silicon'),
+           ('doc1.txt', 12, 15, 'UNIT', 'GPa'),
+           ('doc2.txt', 3, 9, 'MAT', 'acier é'),
+           ('doc3.txt', 100, 101, 'OTHER', ''),
+           ('doc2.txt', 20, 27, 'UNIT', '°C ✓')]
+
+
+def test_columnar_round_trip(tmp_path):
+    output_dir = str(tmp_path / 'entities.columns')
+    # a small buffer, so the columns are appended to the files several times
+    with ColumnarEntityWriter(output_dir, buffer_entities=2) as writer:
+        for record in RECORDS:
+            writer.write(*record)
+    with load_entity_columns(output_dir) as columns:
+        assert len(columns) == len(RECORDS)
+        assert [columns[i] for i in range(len(columns))] == RECORDS
+        assert columns.docs == ['doc1.txt', 'doc2.txt', 'doc3.txt']
+        assert columns.labels == ['MAT', 'UNIT', 'OTHER']
+        with pytest.raises(IndexError):
+            columns[len(RECORDS)]
+
+
+def test_columnar_as_numpy(tmp_path):
+    numpy = pytest.importorskip('numpy')
+    output_dir = str(tmp_path / 'entities.columns')
+    with open_entity_writer(output_dir, ENTITIES_COLUMNAR) as writer:
+        for record in RECORDS:
+            writer.write(*record)
+    with load_entity_columns(output_dir) as columns:
+        arrays = columns.as_numpy()
+        assert arrays['start'].tolist() == [record[1] for record in RECORDS]
+        assert arrays['end'].tolist() == [record[2] for record in RECORDS]
+        assert arrays['doc'].dtype == numpy.int32
+        del arrays
+
+
+def test_columnar_empty_output(tmp_path):
+    output_dir = str(tmp_path / 'entities.columns')
+    ColumnarEntityWriter(output_dir).close()
+    with load_entity_columns(output_dir) as columns:
+        assert len(columns) == 0
+
+
+def test_columnar_incomplete_output_is_not_loaded(tmp_path):
+    output_dir = str(tmp_path / 'entities.columns')
+    with ColumnarEntityWriter(output_dir) as writer:
+        writer.write(*RECORDS[0])
+    # a new output in the same directory removes the meta.json of the previous one until it is closed
+    writer = ColumnarEntityWriter(output_dir)
+    with pytest.raises(Exception):
+        load_entity_columns(output_dir)
+    writer.close()
+
+
+def test_jsonl_output(tmp_path):
+    output_path = str(tmp_path / 'entities.jsonl')
+    with open_entity_writer(output_path, ENTITIES_JSONL) as writer:
+        for record in RECORDS:
+            writer.write(*record)
+    assert writer.num_entities == len(RECORDS)
+    with open(output_path, 'r', encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert [(line['doc'], line['start'], line['end'], line['label'], line['text']) for line in lines] == RECORDS
+
+
+def test_invalid_format(tmp_path):
+    with pytest.raises(Exception):
+        open_entity_writer(os.path.join(str(tmp_path), 'entities'), 'xml')
@@ -0,0 +1,135 @@
+import pytest
+
+from part1_use_a_nerc.gazetteer import Gazetteer, GazetteerAnnotator, GAZETTEER_MERGE, GAZETTEER_ONLY, \
+    GAZETTEER_TRIAGE, merge_entities
+
+
+def _gazetteer(*entries):
+    gazetteer = Gazetteer()
+    for text, label in entries:
+        gazetteer.add(text, label)
+    return gazetteer
+
+
+def test_longest_match_wins():
+    gazetteer = _gazetteer(('silicon', 'MAT'), ('silicon carbide', 'MAT2'), ('silicon carbide fiber', 'MAT3'))
+    text = 'A silicon carbide layer on silicon carbide fiber.'
+    assert gazetteer.find_entities(text) == [(2, 17, 'MAT2'), (27, 48, 'MAT3')]
+
+
+def test_leftmost_match_wins_over_overlapping_ones():
+    gazetteer = _gazetteer(('lithium iron', 'A'), ('iron phosphate', 'B'))
+    # 'lithium iron' starts first, so 'iron phosphate' (which overlaps it) is not found
+    assert gazetteer.find_entities('lithium iron phosphate') == [(0, 12, 'A')]
+
+
+def test_falls_back_to_shorter_match_when_longer_one_is_incomplete():
+    gazetteer = _gazetteer(('carbon', 'MAT'), ('carbon nano tube', 'MAT2'))
+    assert gazetteer.find_entities('carbon nano powder') == [(0, 6, 'MAT')]
+
+
+def test_only_whole_tokens_are_matched():
+    gazetteer = _gazetteer(('iron', 'MAT'))
+    assert gazetteer.find_entities('ironic irons iron-based') == [(13, 17, 'MAT')]
+
+
+def test_offsets_ignore_whitespace_differences():
+    gazetteer = _gazetteer(('silicon carbide', 'MAT'))
+    text = 'pure silicon   carbide'
+    assert gazetteer.find_entities(text) == [(5, 22, 'MAT')]
+    assert text[5:22] == 'silicon   carbide'
+
+
+def test_compile_discards_ambiguous_forms():
+    instances = [('the temperature of steel', {'entities': [(4, 15, 'PROP'), (19, 24, 'MAT')]}),
+                 ('a high temperature', {'entities': []}),
+                 ('temperature and steel', {'entities': [(16, 21, 'MAT')]}),
+                 ('room temperature', {'entities': []})]
+    gazetteer = Gazetteer.compile(instances, min_precision=0.5)
+    # 'temperature' is annotated in only 1 of its 4 appearances
+    assert gazetteer.find_entities('temperature of steel') == [(15, 20, 'MAT')]
+
+
+def test_save_and_load(tmp_path):
+    gazetteer = _gazetteer(('silicon carbide', 'MAT'), ('GPa', 'UNIT'))
+    path = str(tmp_path / 'model.gazetteer.json')
+    gazetteer.save(path)
+    loaded = Gazetteer.load(path)
+    assert loaded.entries == gazetteer.entries
+    assert loaded.find_entities('5 GPa silicon carbide') == [(2, 5, 'UNIT'), (6, 21, 'MAT')]
+
+
+def test_merge_entities_gives_precedence_to_the_primary_ones():
+    primary = [(0, 10, 'A')]
+    secondary = [(5, 15, 'B'), (10, 12, 'C'), (20, 25, 'D')]
+    assert merge_entities(primary, secondary) == [(0, 10, 'A'), (10, 12, 'C'), (20, 25, 'D')]
+
+
+def test_annotator_only_mode_does_not_need_a_model():
+    annotator = GazetteerAnnotator(_gazetteer(('steel', 'MAT')), nlp=None, mode=GAZETTEER_ONLY)
+    results = list(annotator.iter_entities([('steel bar', 1), ('wood', 2), ('a steel', 3)], batch_size=2))
+    assert results == [([(0, 5, 'MAT')], 1), ([], 2), ([(2, 7, 'MAT')], 3)]
+    assert annotator.texts == 3
+    assert annotator.model_texts == 0
+
+
+class _FakeEntity:
+    def __init__(self, start_char, end_char, label_):
+        self.start_char, self.end_char, self.label_ = start_char, end_char, label_
+
+
+class _FakeDoc:
+    def __init__(self, text):
+        # the model finds the first word as an entity
+        self.ents = [_FakeEntity(0, len(text.split(' ')[0]), 'MODEL')]
+
+
+class _FakeModel:
+    """ Reads the texts ahead (like the multiprocess nlp.pipe) and counts the calls to pipe """
+
+    def __init__(self):
+        self.pipe_calls = 0
+        self.texts = []
+
+    def pipe(self, texts, batch_size, n_process, disable):
+        self.pipe_calls += 1
+        texts = iter(texts)
+        read_ahead = []
+        while True:
+            read_ahead.extend(next(texts, None) for _ in range(batch_size + 1))
+            read_ahead = [text for text in read_ahead if text is not None]
+            if len(read_ahead) == 0:
+                return
+            text = read_ahead.pop(0)
+            self.texts.append(text)
+            yield _FakeDoc(text)
+
+
+@pytest.mark.parametrize('mode', [GAZETTEER_MERGE, GAZETTEER_TRIAGE])
+def test_annotator_uses_a_single_pipe(mode):
+    texts = [f'word{i} steel' if i % 3 == 0 else f'word{i} wood' for i in range(50)]
+    model = _FakeModel()
+    annotator = GazetteerAnnotator(_gazetteer(('steel', 'MAT')), nlp=model, mode=mode)
+    results = list(annotator.iter_entities(((text, i) for i, text in enumerate(texts)), batch_size=4, n_process=2))
+    assert model.pipe_calls == 1
+    assert [context for _, context in results] == list(range(50))
+    for (entities, i), text in zip(results, texts):
+        gazetteer_entities = [(len(text) - 5, len(text), 'MAT')] if 'steel' in text else []
+        model_entities = [(0, len(text.split(' ')[0]), 'MODEL')] if mode == GAZETTEER_MERGE or 'steel' in text else []
+        assert entities == sorted(model_entities + gazetteer_entities)
+    assert annotator.model_texts == len(model.texts) == (50 if mode == GAZETTEER_MERGE else 17)
+
+
+def test_annotator_with_a_model_entities_function():
+    calls = []
+
+    def model_entities_function(texts, batch_size, n_process):
+        calls.append((batch_size, n_process))
+        return ([(0, 1, 'MODEL')] for _ in texts)
+
+    annotator = GazetteerAnnotator(_gazetteer(('steel', 'MAT')), nlp=_FakeModel(), mode=GAZETTEER_TRIAGE,
+                                   model_entities_function=model_entities_function)
+    results = list(annotator.iter_entities([('a steel', 1), ('wood', 2)], batch_size=1, n_process=3))
+    assert results == [([(0, 1, 'MODEL'), (2, 7, 'MAT')], 1), ([], 2)]
+    assert calls == [(1, 3)]
+    assert annotator.nlp.pipe_calls == 0
@@ -0,0 +1,72 @@
+import random
+from collections import Counter
+
+from part1_use_a_nerc.heavy_hitters import SpaceSaving
+
+
+def _zipf_stream(num_items, length, seed):
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, num_items + 1)]
+    return rng.choices([f'item{i}' for i in range(num_items)], weights=weights, k=length)
+
+
+def _check_guarantees(sketch, exact_counts):
+    """ The counts are never underestimated, and are overestimated by at most their error (<= total / capacity) """
+    assert sketch.total == sum(exact_counts.values())
+    assert len(sketch) <= sketch.capacity
+    for item, count in sketch.counts.items():
+        assert exact_counts[item] <= count <= exact_counts[item] + sketch.errors[item]
+    assert sketch.error_bound() <= sketch.total / sketch.capacity
+    # every item more frequent than total / capacity is kept
+    for item, count in exact_counts.items():
+        if count > sketch.total / sketch.capacity:
+            assert item in sketch.counts
+
+
+def test_exact_when_capacity_is_enough():
+    items = _zipf_stream(50, 2000, seed=0)
+    sketch = SpaceSaving(capacity=50)
+    sketch.update(items)
+    assert dict(sketch.counts) == dict(Counter(items))
+    assert sketch.error_bound() == 0
+
+
+def test_guarantees_with_small_capacity():
+    items = _zipf_stream(1000, 20000, seed=1)
+    sketch = SpaceSaving(capacity=100)
+    sketch.update(items)
+    exact_counts = Counter(items)
+    _check_guarantees(sketch, exact_counts)
+    assert sketch.most_common(1)[0][0] == exact_counts.most_common(1)[0][0]
+
+
+def test_add_with_count():
+    sketch = SpaceSaving(capacity=2)
+    sketch.add('a', 5)
+    sketch.add('b', 3)
+    sketch.add('c', 1)
+    # 'c' replaces the smallest counter ('b'), inheriting its count as error
+    assert sketch.counts == {'a': 5, 'c': 4}
+    assert sketch.errors == {'a': 0, 'c': 3}
+    assert sketch.total == 9
+
+
+def test_merge_keeps_the_guarantees():
+    first_items = _zipf_stream(1000, 15000, seed=2)
+    second_items = _zipf_stream(1000, 15000, seed=3)
+    first, second = SpaceSaving(capacity=100), SpaceSaving(capacity=100)
+    first.update(first_items)
+    second.update(second_items)
+    merged = first.merge(second)
+    assert merged is first
+    _check_guarantees(merged, Counter(first_items) + Counter(second_items))
+
+
+def test_merge_of_non_full_sketches_is_exact():
+    first, second = SpaceSaving(capacity=10), SpaceSaving(capacity=10)
+    first.update(['a', 'a', 'b'])
+    second.update(['b', 'c'])
+    first.merge(second)
+    assert first.counts == {'a': 2, 'b': 2, 'c': 1}
+    assert first.error_bound() == 0
+    assert first.total == 5
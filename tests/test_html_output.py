@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from part1_use_a_nerc.html_output import PaginatedHtmlWriter
+
+
+def _read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def test_single_page_without_index(tmp_path):
+    html_path = str(tmp_path / 'x.txt._HIGHLIGHTED.html')
+    with PaginatedHtmlWriter(html_path, max_page_chars=100) as writer:
+        writer.write('<p>one</p>')
+    assert os.listdir(str(tmp_path)) == ['x.txt._HIGHLIGHTED.html']
+    assert 'Next' not in _read(html_path)
+
+
+def test_pages_link_only_to_written_pages(tmp_path):
+    html_path = str(tmp_path / 'x.txt._HIGHLIGHTED.html')
+    with PaginatedHtmlWriter(html_path, max_page_chars=10, max_pages=2) as writer:
+        for _ in range(5):
+            writer.write('<p>0123456789</p>')
+        assert not writer.accepting
+    assert writer.truncated
+    assert len(writer.page_paths) == 2
+    assert all(os.path.exists(page_path) for page_path in writer.page_paths)
+    first_page, last_page = _read(writer.page_paths[0]), _read(writer.page_paths[1])
+    assert os.path.basename(writer.page_paths[1]) in first_page
+    assert 'Next' not in last_page
+    assert 'Index' in last_page
+    assert 'Only the first 2 pages' in _read(html_path)
+
+
+def test_single_truncated_page_links_to_the_index(tmp_path):
+    html_path = str(tmp_path / 'x.txt._HIGHLIGHTED.html')
+    with PaginatedHtmlWriter(html_path, max_page_chars=10, max_pages=1) as writer:
+        writer.write('<p>0123456789</p>')
+        assert not writer.accepting
+        writer.write('<p>skipped</p>')
+    page = _read(writer.page_paths[0])
+    assert 'Next' not in page
+    assert 'Index' in page
+    assert 'skipped' not in page
+    assert sorted(os.listdir(str(tmp_path))) == ['x.txt._HIGHLIGHTED.html', 'x.txt._HIGHLIGHTED.page0001.html']
+
+
+def test_empty_input_writes_nothing(tmp_path):
+    with PaginatedHtmlWriter(str(tmp_path / 'x.txt._HIGHLIGHTED.html')):
+        pass
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_max_pages_must_be_positive(tmp_path):
+    with pytest.raises(Exception):
+        PaginatedHtmlWriter(str(tmp_path / 'x.txt._HIGHLIGHTED.html'), max_pages=0)
@@ -0,0 +1,111 @@
+import random
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from part2_train_custom_nerc.evaluation import compare_predictions_and_gold_labels  # noqa: E402
+from part2_train_custom_nerc.span_metrics import EntitySpans, SpanCounts, bootstrap_confidence_intervals, \
+    paired_bootstrap  # noqa: E402
+
+GOLD = [[(0, 5, 'MAT'), (10, 13, 'UNIT')],
+        [],
+        [(0, 4, 'MAT'), (6, 10, 'MAT')]]
+PREDICTED = [[(0, 5, 'MAT'), (10, 13, 'MAT')],
+             [(2, 3, 'UNIT')],
+             [(0, 4, 'MAT'), (6, 10, 'MAT'), (6, 10, 'MAT')]]
+
+
+def _counts(predicted, gold):
+    gold_spans = EntitySpans.from_entity_lists(gold)
+    return SpanCounts.from_spans(EntitySpans.from_entity_lists(predicted, label_names=gold_spans.label_names),
+                                 gold_spans)
+
+
+def test_counts_match_offsets_and_labels():
+    counts = _counts(PREDICTED, GOLD)
+    assert counts.num_docs == 3
+    assert counts.label_names == ['MAT', 'UNIT']
+    # the repeated prediction of the third document is counted once
+    assert counts.tp.tolist() == [[1, 0], [0, 0], [2, 0]]
+    assert counts.fp.tolist() == [[1, 0], [0, 1], [0, 0]]
+    assert counts.fn.tolist() == [[0, 1], [0, 0], [0, 0]]
+    assert counts.support() == {'MAT': 3, 'UNIT': 1}
+
+
+def test_scores():
+    scores = _counts(PREDICTED, GOLD).scores()
+    assert scores.precision == pytest.approx(3 / 5)
+    assert scores.recall == pytest.approx(3 / 4)
+    assert scores.fscore == pytest.approx(2 * 3 / (2 * 3 + 2 + 1))
+    assert scores.per_label['MAT'].precision == pytest.approx(3 / 4)
+    assert scores.per_label['MAT'].recall == pytest.approx(1.0)
+    assert scores.per_label['UNIT'].fscore == 0.0
+
+
+def test_same_text_in_two_places_are_two_entities():
+    gold = [[(0, 3, 'MAT'), (8, 11, 'MAT')]]
+    counts = _counts([[(0, 3, 'MAT')]], gold)
+    assert (counts.tp.sum(), counts.fp.sum(), counts.fn.sum()) == (1, 0, 1)
+
+
+def test_labels_only_in_the_predictions():
+    counts = _counts([[(0, 3, 'NEW')]], [[(0, 3, 'MAT')]])
+    assert counts.label_names == ['MAT', 'NEW']
+    assert counts.scores().fscore == 0.0
+
+
+def test_inconsistent_label_ids_are_rejected():
+    gold_spans = EntitySpans.from_entity_lists([[(0, 3, 'MAT')]])
+    predicted_spans = EntitySpans.from_entity_lists([[(0, 3, 'UNIT')]])
+    with pytest.raises(Exception):
+        SpanCounts.from_spans(predicted_spans, gold_spans)
+
+
+def test_micro_counts_equal_the_previous_evaluation_without_repeated_texts():
+    rng = random.Random(0)
+    gold, predicted = [], []
+    for _ in range(200):
+        entities = [(start, start + 3, rng.choice(['A', 'B'])) for start in range(0, 40, 5) if rng.random() < 0.5]
+        gold.append(entities)
+        predicted.append([entity for entity in entities if rng.random() < 0.7] +
+                         [(start, start + 2, 'A') for start in range(1, 40, 10) if rng.random() < 0.2])
+    counts = _counts(predicted, gold)
+    expected = [0, 0, 0]
+    for predictions, golds in zip(predicted, gold):
+        for i, value in enumerate(compare_predictions_and_gold_labels(set(predictions), set(golds))):
+            expected[i] += value
+    assert [counts.tp.sum(), counts.fp.sum(), counts.fn.sum()] == expected
+
+
+def test_bootstrap_intervals_contain_the_scores():
+    rng = random.Random(1)
+    gold = [[(0, 3, 'A'), (5, 8, 'B')] for _ in range(300)]
+    predicted = [[entity for entity in entities if rng.random() < 0.8] for entities in gold]
+    counts = _counts(predicted, gold)
+    scores = counts.scores()
+    micro, per_label = bootstrap_confidence_intervals(counts, num_samples=500, seed=0)
+    low, high = micro['recall']
+    assert low <= scores.recall <= high
+    assert 0 < high - low < 0.2
+    assert micro['precision'] == (1.0, 1.0)
+    assert set(per_label) == {'A', 'B'}
+    # the same seed gives the same intervals
+    assert bootstrap_confidence_intervals(counts, num_samples=500, seed=0) == (micro, per_label)
+
+
+def test_paired_bootstrap():
+    rng = random.Random(2)
+    gold = [[(0, 3, 'A'), (5, 8, 'A')] for _ in range(300)]
+    better = _counts([[entity for entity in entities if rng.random() < 0.9] for entities in gold], gold)
+    worse = _counts([[entity for entity in entities if rng.random() < 0.5] for entities in gold], gold)
+    comparison = paired_bootstrap(better, worse, num_samples=500, seed=0)
+    assert comparison.difference == pytest.approx(better.scores().fscore - worse.scores().fscore)
+    assert 0 < comparison.low <= comparison.difference <= comparison.high
+    assert comparison.p_value == 0.0
+
+    same = paired_bootstrap(better, better, num_samples=100, seed=0)
+    assert (same.difference, same.low, same.high) == (0.0, 0.0, 0.0)
+
+    with pytest.raises(Exception):
+        paired_bootstrap(better, _counts([[]], [[(0, 3, 'A')]]), num_samples=10)